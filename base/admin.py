@@ -1,8 +1,12 @@
 from django.contrib import admin
-from .models import Alimento, RegistroDiario, PerfilNutricional, AlimentoNutriente, Nutriente
+from .models import Alimento, RegistroDiario, PerfilNutricional, AlimentoNutriente, Nutriente, IngestaDiaria, PlantillaComida, PlantillaComidaAlimento, TrabajoAnalisis
 
 admin.site.register(Alimento)
 admin.site.register(PerfilNutricional)
 admin.site.register(RegistroDiario)
 admin.site.register(AlimentoNutriente)
 admin.site.register(Nutriente)
+admin.site.register(IngestaDiaria)
+admin.site.register(PlantillaComida)
+admin.site.register(PlantillaComidaAlimento)
+admin.site.register(TrabajoAnalisis)
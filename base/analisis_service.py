@@ -0,0 +1,135 @@
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from base import cohortes
+from base.basedatos import lecturas_analiticas
+from base.cohortes import DIMENSIONES_POR_DEFECTO, MACRONUTRIENTES
+
+
+# Función que calcula los totales por cohorte según ANALISIS_CONSUMO_BACKEND: 'sql' (consultas agrupadas,
+# base/cohortes.py) o 'numpy' (cálculo vectorizado por bloques, base/cohortes_numpy.py; requiere numpy).
+def obtener_agregador():
+    backend = getattr(settings, 'ANALISIS_CONSUMO_BACKEND', 'sql')
+    if backend == 'sql':
+        return cohortes.agregar_por_cohortes
+    if backend == 'numpy':
+        try:
+            from base import cohortes_numpy
+        except ImportError as error:
+            raise ImproperlyConfigured("ANALISIS_CONSUMO_BACKEND = 'numpy' requiere instalar numpy") from error
+        return cohortes_numpy.agregar_por_cohortes
+    raise ImproperlyConfigured(f"ANALISIS_CONSUMO_BACKEND desconocido: {backend!r}")
+
+
+# Analiza el consumo nutricional de todos los perfiles agrupándolos en cohortes (por defecto, menores de 30 años y
+# mayores o iguales a 30 años). Los totales de cada cohorte se obtienen con el backend configurado
+# (ver obtener_agregador) y luego se calcula el promedio por usuario en cada grupo. Se lee de la réplica de análisis.
+@lecturas_analiticas()
+def analisis_consumo(fecha_inicio=None, fecha_fin=None, dimensiones=DIMENSIONES_POR_DEFECTO):
+    # Convertir fechas de string a objetos date si son proporcionadas
+    fecha_inicio = datetime.strptime(fecha_inicio, "%Y-%m-%d").date() if fecha_inicio else None
+    fecha_fin = datetime.strptime(fecha_fin, "%Y-%m-%d").date() if fecha_fin else None
+
+    resultados = obtener_agregador()(dimensiones, fecha_inicio, fecha_fin)
+
+    # Calcular promedios
+    for grupo in resultados.values():
+        total_usuarios = grupo.pop('usuarios')
+        if total_usuarios > 0:
+            for key in MACRONUTRIENTES + ['diversidad_nutrientes']:
+                grupo[key] /= total_usuarios
+            for nutriente in grupo['nutrientes']:
+                grupo['nutrientes'][nutriente] /= total_usuarios
+
+    return resultados
+
+# Nombre legible de una cohorte: 'menores_30' → 'menores de 30', 'de_18_a_30__Mujer' → 'de 18 a 30, Mujer'.
+def _descripcion(cohorte):
+    etiquetas = [re.sub(r'^(menores|mayores)_(\d+)$', r'\1 de \2', etiqueta) for etiqueta in cohorte.split('__')]
+    return ', '.join(etiqueta.replace('_', ' ') for etiqueta in etiquetas)
+
+
+# Evalúa cuál grupo tiene un mayor riesgo basado en su consumo nutricional. Utiliza los resultados del análisis de consumo
+# para comparar el consumo calórico y de macronutrientes entre las cohortes, y la diversidad de nutrientes consumidos.
+# Admite cualquier combinación de dimensiones; con las dimensiones por defecto compara menores y mayores de 30.
+# Proporciona como resultado un grupo con mayor riesgo y las razones de esta evaluación.
+def evaluar_grupos(resultados):
+    cohortes = list(resultados)
+
+    # Cohorte con el mayor valor; en un empate, la última (la de mayor edad con las dimensiones por defecto)
+    def mayor(valor):
+        return max(reversed(cohortes), key=valor)
+
+    evaluacion = {
+        'grupo_mas_riesgo': f"El grupo de {_descripcion(mayor(lambda cohorte: resultados[cohorte]['calorias']))}",
+        'razones': ['mayor consumo calórico'],
+    }
+
+    # Comparar macronutrientes
+    for nutriente in ['proteinas', 'carbohidratos', 'grasas']:
+        cohorte = mayor(lambda cohorte: resultados[cohorte][nutriente])
+        evaluacion['razones'].append(f'mayor consumo de {nutriente} en {_descripcion(cohorte)}')
+
+    # Comparar diversidad de nutrientes: sólo si no todas las cohortes consumieron la misma cantidad de nutrientes
+    diversidad = {cohorte: len(resultados[cohorte]['nutrientes']) for cohorte in cohortes}
+    if len(set(diversidad.values())) > 1:
+        cohorte = min(cohortes, key=diversidad.get)
+        evaluacion['razones'].append(f'menor diversidad de nutrientes en {_descripcion(cohorte)}.')
+
+    return evaluacion
+
+
+# Servicio de análisis de consumo por grupos. No calcula nada al importarse: el análisis se ejecuta en el primer uso
+# y el resultado se guarda en la caché de Django durante ANALISIS_CONSUMO_CACHE_TIMEOUT segundos.
+# El método precalentar permite calcularlo explícitamente (por ejemplo, tras un despliegue) antes de la primera petición.
+class AnalisisConsumoService:
+    prefijo_cache = 'analisis_consumo'
+
+    def __init__(self, timeout=None, dimensiones=DIMENSIONES_POR_DEFECTO):
+        self.timeout = timeout if timeout is not None else getattr(settings, 'ANALISIS_CONSUMO_CACHE_TIMEOUT', 300)
+        self.dimensiones = dimensiones
+
+    def _clave(self, fecha_inicio, fecha_fin):
+        dimensiones = '|'.join(dimension.clave() for dimension in self.dimensiones)
+        return f"{self.prefijo_cache}:{dimensiones}:{fecha_inicio or ''}:{fecha_fin or ''}"
+
+    # Calcula el análisis sin leer ni escribir la caché ({'resultados', 'evaluacion'}).
+    def calcular(self, fecha_inicio=None, fecha_fin=None):
+        resultados = analisis_consumo(fecha_inicio, fecha_fin, self.dimensiones)
+        return {
+            'resultados': resultados,
+            'evaluacion': evaluar_grupos(resultados),
+        }
+
+    def obtener(self, fecha_inicio=None, fecha_fin=None):
+        clave = self._clave(fecha_inicio, fecha_fin)
+        datos = cache.get(clave)
+        if datos is None:
+            datos = self.calcular(fecha_inicio, fecha_fin)
+            cache.set(clave, datos, self.timeout)
+        return datos['resultados'], datos['evaluacion']
+
+    # Resultado guardado en la caché para vistas async, o None si aún no se calculó (el cálculo se encola con
+    # base.trabajos_service en vez de hacerlo dentro de la petición).
+    async def aen_cache(self, fecha_inicio=None, fecha_fin=None):
+        datos = await cache.aget(self._clave(fecha_inicio, fecha_fin))
+        if datos is None:
+            return None
+        return datos['resultados'], datos['evaluacion']
+
+    def precalentar(self, fecha_inicio=None, fecha_fin=None):
+        datos = self.calcular(fecha_inicio, fecha_fin)
+        self.guardar(datos, fecha_inicio, fecha_fin)
+        return datos['resultados'], datos['evaluacion']
+
+    # Guarda en la caché un resultado calculado fuera del servicio ({'resultados', 'evaluacion'}), como el de un
+    # trabajo en segundo plano que terminó.
+    def guardar(self, datos, fecha_inicio=None, fecha_fin=None):
+        cache.set(self._clave(fecha_inicio, fecha_fin), datos, self.timeout)
+
+    def invalidar(self, fecha_inicio=None, fecha_fin=None):
+        cache.delete(self._clave(fecha_inicio, fecha_fin))
@@ -0,0 +1,73 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Alias de la réplica de lectura para análisis y reportes (ver DATABASES en settings). Si no está configurado, todo
+# se lee de 'default'.
+ALIAS_ANALITICA = 'analitica'
+
+_lecturas_analiticas = ContextVar('lecturas_analiticas', default=False)
+
+
+def alias_analitica():
+    return ALIAS_ANALITICA if ALIAS_ANALITICA in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+# Dentro de este contexto (o en una función decorada con él) las lecturas van a la réplica de análisis. Sólo sirve
+# para consultas que se evalúan dentro: un queryset que se recorre después (por ejemplo, en una respuesta en
+# streaming) debe fijar la base con .using(alias_analitica()).
+@contextmanager
+def lecturas_analiticas():
+    token = _lecturas_analiticas.set(True)
+    try:
+        yield
+    finally:
+        _lecturas_analiticas.reset(token)
+
+
+# Envía a la réplica las lecturas hechas dentro de lecturas_analiticas(); el resto, y todas las escrituras, van a
+# 'default'. La escritura se fija explícitamente porque, sin router, Django guardaría un objeto leído de la réplica
+# en la réplica. La réplica no se migra: replica el esquema de 'default'.
+class RouterAnalitica:
+    def db_for_read(self, model, **hints):
+        if _lecturas_analiticas.get():
+            return alias_analitica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las dos bases tienen los mismos datos
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == ALIAS_ANALITICA:
+            return False
+        return None
+
+
+# PRAGMAs de SQLITE_PRAGMAS para cada conexión SQLite nueva (ver signals.py). Con journal_mode=WAL las lecturas no
+# bloquean a las escrituras ni al revés, y synchronous=NORMAL sólo sincroniza el disco en los checkpoints.
+# journal_mode queda guardado en el archivo: sólo se cambia si es distinto, porque cambiarlo requiere que no haya
+# otras conexiones abiertas. Si otro proceso lo impide, la conexión sigue con el modo actual.
+def configurar_sqlite(conexion):
+    if conexion.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    modo = pragmas.pop('journal_mode', None)
+    with conexion.cursor() as cursor:
+        if modo is not None:
+            cursor.execute('PRAGMA journal_mode')
+            if cursor.fetchone()[0].lower() not in (modo.lower(), 'memory'):
+                try:
+                    cursor.execute(f'PRAGMA journal_mode = {modo}')
+                except OperationalError:
+                    logger.warning('No se pudo cambiar journal_mode a %s: la base está en uso', modo)
+        for pragma, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
@@ -0,0 +1,150 @@
+import logging
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from base.models import Alimento
+
+logger = logging.getLogger(__name__)
+
+TABLA_BUSQUEDA = 'base_alimento_busqueda'
+LIMITE_AUTOCOMPLETAR = 10
+LIMITE_MAXIMO_AUTOCOMPLETAR = 50
+CANDIDATOS_AUTOCOMPLETAR = 200
+# Longitud máxima de los índices de prefijo de la tabla FTS5 (migración 0004_alimento_busqueda)
+PREFIJO_MAXIMO = 8
+
+
+def _usa_fts():
+    return connection.vendor == 'sqlite'
+
+
+def _terminos(texto):
+    return re.findall(r'\w+', texto or '')
+
+
+# Convierte el texto del usuario en una consulta MATCH de FTS5: cada palabra se entrecomilla (así los operadores
+# de FTS5 que escriba el usuario no se interpretan) y se busca como prefijo. Todas las palabras deben aparecer.
+# Los prefijos se recortan a PREFIJO_MAXIMO caracteres para que siempre se resuelvan con un índice de prefijo.
+def consulta_fts(texto):
+    return ' '.join(f'"{termino[:PREFIJO_MAXIMO]}"*' for termino in _terminos(texto))
+
+
+# Filtra un queryset de Alimento por el texto indicado. En SQLite usa el índice FTS5 (insensible a acentos y por
+# prefijo); en otros motores recurre a icontains sobre nombre y descripción.
+def filtrar_alimentos(queryset, texto):
+    terminos = _terminos(texto)
+    if not terminos:
+        return queryset
+    if _usa_fts():
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {TABLA_BUSQUEDA} WHERE {TABLA_BUSQUEDA} MATCH %s', [consulta_fts(texto)]
+        ))
+    for termino in terminos:
+        queryset = queryset.filter(Q(nombre__icontains=termino) | Q(descripcion__icontains=termino))
+    return queryset
+
+
+def _candidatos(consulta, usuario):
+    filtro_usuario = 'AND a.usuario_id = %s' if usuario is not None else ''
+    parametros = [consulta] + ([usuario.id] if usuario is not None else []) + [CANDIDATOS_AUTOCOMPLETAR]
+    sql = f"""
+        SELECT b.rowid AS id FROM {TABLA_BUSQUEDA} b JOIN base_alimento a ON a.id = b.rowid
+        WHERE {TABLA_BUSQUEDA} MATCH %s {filtro_usuario}
+        ORDER BY b.rowid DESC LIMIT %s
+    """
+    return sql, parametros
+
+
+# Autocompletado: devuelve hasta `limite` alimentos, primero los que coinciden en el nombre y después los que sólo
+# coinciden en la descripción, y dentro de cada grupo los de nombre más corto. Si se indica usuario, sólo busca
+# entre sus alimentos. Cada grupo toma como máximo CANDIDATOS_AUTOCOMPLETAR coincidencias (las más recientes),
+# así que un prefijo muy común ("pro") cuesta lo mismo que uno raro sin importar el tamaño del catálogo.
+# No se usa bm25: necesita estadísticas de todas las filas que coinciden con el prefijo.
+def autocompletar_alimentos(texto, usuario=None, limite=LIMITE_AUTOCOMPLETAR):
+    limite = max(1, min(limite, LIMITE_MAXIMO_AUTOCOMPLETAR))
+    if not _terminos(texto):
+        return []
+    if not _usa_fts():
+        alimentos = filtrar_alimentos(Alimento.objects.all(), texto)
+        if usuario is not None:
+            alimentos = alimentos.filter(usuario=usuario)
+        primero = _terminos(texto)[0]
+        return list(alimentos.annotate(
+            prioridad=Case(When(nombre__istartswith=primero, then=Value(0)), default=Value(1),
+                           output_field=IntegerField())
+        ).order_by('prioridad', 'nombre').only('id', 'nombre')[:limite])
+
+    consulta = consulta_fts(texto)
+    en_nombre, parametros_nombre = _candidatos(f'nombre : ({consulta})', usuario)
+    en_todo, parametros_todo = _candidatos(consulta, usuario)
+    sql = f"""
+        SELECT a.id, a.nombre FROM (
+            SELECT id, 0 AS grupo FROM ({en_nombre})
+            UNION ALL
+            SELECT id, 1 AS grupo FROM ({en_todo})
+        ) c JOIN base_alimento a ON a.id = c.id
+        GROUP BY a.id
+        ORDER BY MIN(c.grupo), length(a.nombre), a.id DESC
+        LIMIT %s
+    """
+    return list(Alimento.objects.raw(sql, parametros_nombre + parametros_todo + [limite]))
+
+
+# Reconstruye el índice desde base_alimento (por ejemplo, tras cargar datos con SQL directo) y lo compacta.
+def reconstruir_indice():
+    if not _usa_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLA_BUSQUEDA}({TABLA_BUSQUEDA}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {TABLA_BUSQUEDA}({TABLA_BUSQUEDA}) VALUES ('optimize')")
+
+
+# Triggers que mantienen el índice sincronizado con base_alimento (también con bulk_create, update() y las
+# eliminaciones en cascada). Cualquier migración que rehaga base_alimento en SQLite (AddField, AlterField...) los
+# borra junto con la tabla vieja.
+TRIGGERS_BUSQUEDA = {
+    f'{TABLA_BUSQUEDA}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_BUSQUEDA}_ai AFTER INSERT ON base_alimento BEGIN
+            INSERT INTO {TABLA_BUSQUEDA}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+        END
+    """,
+    f'{TABLA_BUSQUEDA}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_BUSQUEDA}_ad AFTER DELETE ON base_alimento BEGIN
+            INSERT INTO {TABLA_BUSQUEDA}({TABLA_BUSQUEDA}, rowid, nombre, descripcion)
+            VALUES ('delete', old.id, old.nombre, old.descripcion);
+        END
+    """,
+    f'{TABLA_BUSQUEDA}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_BUSQUEDA}_au AFTER UPDATE OF nombre, descripcion ON base_alimento BEGIN
+            INSERT INTO {TABLA_BUSQUEDA}({TABLA_BUSQUEDA}, rowid, nombre, descripcion)
+            VALUES ('delete', old.id, old.nombre, old.descripcion);
+            INSERT INTO {TABLA_BUSQUEDA}(rowid, nombre, descripcion) VALUES (new.id, new.nombre, new.descripcion);
+        END
+    """,
+}
+
+
+# Repone los triggers que falten y, si faltaba alguno, reconstruye el índice con lo que cambió mientras no
+# estaban. Se ejecuta tras cada migrate (ver signals.py). Devuelve True si tuvo que reponer algo.
+def asegurar_indice(alias=DEFAULT_DB_ALIAS):
+    conexion = connections[alias]
+    if conexion.vendor != 'sqlite':
+        return False
+    nombres = [TABLA_BUSQUEDA, *TRIGGERS_BUSQUEDA]
+    with conexion.cursor() as cursor:
+        cursor.execute(
+            f"SELECT name FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(nombres))})", nombres
+        )
+        existentes = {fila[0] for fila in cursor.fetchall()}
+        # Sin la tabla (migraciones anteriores a 0004, o la réplica de análisis) no hay nada que mantener
+        faltantes = [nombre for nombre in TRIGGERS_BUSQUEDA if nombre not in existentes]
+        if TABLA_BUSQUEDA not in existentes or not faltantes:
+            return False
+        logger.warning('Faltaban los triggers de búsqueda %s: se reponen y se reconstruye el índice', faltantes)
+        for nombre in faltantes:
+            cursor.execute(TRIGGERS_BUSQUEDA[nombre])
+        cursor.execute(f"INSERT INTO {TABLA_BUSQUEDA}({TABLA_BUSQUEDA}) VALUES ('rebuild')")
+    return True
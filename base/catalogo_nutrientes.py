@@ -0,0 +1,79 @@
+from collections import namedtuple
+from itertools import count
+
+from django.db import transaction
+
+from base.models import Nutriente
+from base.utils import NECESIDADES_MICRONUTRIENTES_ESPECIFICOS
+from base.versiones import AMBITO_CATALOGO, versiones
+
+# necesidad: necesidad diaria si es uno de NECESIDADES_MICRONUTRIENTES_ESPECIFICOS, si no None
+InfoNutriente = namedtuple('InfoNutriente', ['id', 'nombre', 'tipo', 'necesidad'])
+
+
+# Catálogo de nutrientes en memoria del proceso: id → InfoNutriente. La tabla es chica y cambia poco, así que se lee
+# entera una vez y las consultas de análisis agrupan por nutriente_id sin unir Nutriente. Se reutiliza mientras la
+# versión del ámbito del catálogo (base/versiones.py, en la base y compartida por todos los workers) sea la misma con
+# la que se cargó. La versión se comprueba una vez por petición (nueva_peticion, ver signals.py), no en cada uso: un
+# cambio hecho en otro worker se ve desde la petición siguiente. Fuera de una petición (comandos, tareas) se usa la
+# carga que haya. Un id desconocido, por ejemplo un nutriente recién creado por otro proceso, fuerza la recarga.
+class CatalogoNutrientes:
+    def __init__(self):
+        # (versión, {id: InfoNutriente}); se reemplaza entero para que otro hilo nunca vea una mezcla de los dos
+        self._estado = None
+        self._peticiones = count(1)
+        # Número de la última petición iniciada y de la última para la que se leyó la versión
+        self._peticion = 0
+        self._revisada = 0
+
+    def nueva_peticion(self):
+        self._peticion = next(self._peticiones)
+
+    def _version(self, estado):
+        peticion = self._peticion
+        if estado is not None and self._revisada == peticion:
+            return estado[0]
+        version = versiones(AMBITO_CATALOGO)[0]
+        self._revisada = peticion
+        return version
+
+    def _cargar(self, version):
+        nutrientes = {
+            nutriente_id: InfoNutriente(nutriente_id, nombre, tipo, NECESIDADES_MICRONUTRIENTES_ESPECIFICOS.get(nombre))
+            for nutriente_id, nombre, tipo in Nutriente.objects.values_list('id', 'nombre', 'tipo')
+        }
+        self._estado = (version, nutrientes)
+        return nutrientes
+
+    def nutrientes(self, ids=()):
+        estado = self._estado
+        version = self._version(estado)
+        if estado is None or estado[0] != version or any(nutriente_id not in estado[1] for nutriente_id in ids):
+            return self._cargar(version)
+        return estado[1]
+
+    def info(self, nutriente_id):
+        return self.nutrientes((nutriente_id,)).get(nutriente_id)
+
+    # Pasa totales {nutriente_id: cantidad} a {nombre: cantidad}, la forma en que se guardan y devuelven. Los
+    # nutrientes con el mismo nombre se suman; los ids que ya no existen se descartan.
+    def por_nombre(self, totales):
+        nutrientes = self.nutrientes(totales)
+        resultado = {}
+        for nutriente_id, total in totales.items():
+            info = nutrientes.get(nutriente_id)
+            if info is not None:
+                resultado[info.nombre] = resultado.get(info.nombre, 0) + total
+        return resultado
+
+    # Se descarta ya en este proceso (un id reutilizado tras deshacer una transacción no debe quedar con el nombre
+    # anterior) y otra vez al confirmarse, por si otro hilo la recargó mientras tanto. La versión compartida, para el
+    # resto de los workers, la incrementa la señal que llama a este método.
+    def invalidar(self):
+        def descartar():
+            self._estado = None
+        descartar()
+        transaction.on_commit(descartar)
+
+
+catalogo_nutrientes = CatalogoNutrientes()
@@ -0,0 +1,119 @@
+from itertools import product
+
+from django.db.models import Case, CharField, Count, F, FloatField, Sum, Value, When
+
+from base.catalogo_nutrientes import catalogo_nutrientes
+from base.models import NIVEL_ACTIVIDAD_CHOICES, PerfilNutricional, RegistroDiario
+
+MACRONUTRIENTES = ['calorias', 'proteinas', 'carbohidratos', 'grasas']
+
+
+# Dimensión de cohorte por rangos de edad. Con limites=(30,) produce los grupos históricos
+# 'menores_30' y 'mayores_30'; con más límites agrega grupos intermedios 'de_18_a_30', etc.
+class DimensionEdad:
+    def __init__(self, limites=(30,)):
+        self.limites = sorted(limites)
+
+    def clave(self):
+        return 'edad:' + ','.join(str(limite) for limite in self.limites)
+
+    def etiquetas(self):
+        etiquetas = [f'menores_{self.limites[0]}']
+        for inferior, superior in zip(self.limites, self.limites[1:]):
+            etiquetas.append(f'de_{inferior}_a_{superior}')
+        etiquetas.append(f'mayores_{self.limites[-1]}')
+        return etiquetas
+
+    def expresion(self, prefijo=''):
+        etiquetas = self.etiquetas()
+        casos = [
+            When(**{f'{prefijo}edad__lt': limite}, then=Value(etiqueta))
+            for limite, etiqueta in zip(self.limites, etiquetas)
+        ]
+        return Case(*casos, default=Value(etiquetas[-1]), output_field=CharField())
+
+
+# Dimensión de cohorte por un campo con opciones fijas de PerfilNutricional (sexo, nivel_actividad).
+class DimensionCampo:
+    def __init__(self, campo, opciones):
+        self.campo = campo
+        self.opciones = [valor for valor, _ in opciones]
+
+    def clave(self):
+        return self.campo
+
+    def etiquetas(self):
+        return list(self.opciones)
+
+    def expresion(self, prefijo=''):
+        return F(f'{prefijo}{self.campo}')
+
+
+DIMENSION_SEXO = DimensionCampo('sexo', PerfilNutricional._meta.get_field('sexo').choices)
+DIMENSION_NIVEL_ACTIVIDAD = DimensionCampo('nivel_actividad', NIVEL_ACTIVIDAD_CHOICES)
+DIMENSIONES_POR_DEFECTO = (DimensionEdad((30,)),)
+
+
+def _anotar_dimensiones(queryset, dimensiones, prefijo=''):
+    anotaciones = {f'cohorte_{i}': dimension.expresion(prefijo) for i, dimension in enumerate(dimensiones)}
+    return queryset.annotate(**anotaciones), list(anotaciones)
+
+
+def _grupo_vacio():
+    return {'usuarios': 0, 'calorias': 0, 'proteinas': 0, 'carbohidratos': 0, 'grasas': 0, 'nutrientes': {},
+            'diversidad_nutrientes': 0}
+
+
+def _grupo(resultados, fila, campos):
+    return resultados.setdefault('__'.join(str(fila[campo]) for campo in campos), _grupo_vacio())
+
+
+# Calcula los totales de macronutrientes y de cada nutriente por cohorte con cuatro consultas agrupadas,
+# independientemente del número de registros: una para contar perfiles por cohorte, otra para los macronutrientes,
+# otra para los nutrientes y otra para la diversidad (suma, sobre los usuarios, de los nutrientes distintos que
+# consumió cada uno). Devuelve un diccionario con una entrada por cohorte.
+def agregar_por_cohortes(dimensiones=DIMENSIONES_POR_DEFECTO, fecha_inicio=None, fecha_fin=None):
+    resultados = {
+        '__'.join(combinacion): _grupo_vacio()
+        for combinacion in product(*(dimension.etiquetas() for dimension in dimensiones))
+    }
+
+    perfiles, campos = _anotar_dimensiones(PerfilNutricional.objects.all(), dimensiones)
+    for fila in perfiles.values(*campos).annotate(usuarios=Count('id')).order_by():
+        _grupo(resultados, fila, campos)['usuarios'] = fila['usuarios']
+
+    registros = RegistroDiario.objects.filter(usuario__perfilnutricional__isnull=False)
+    if fecha_inicio:
+        registros = registros.filter(fecha__gte=fecha_inicio)
+    if fecha_fin:
+        registros = registros.filter(fecha__lte=fecha_fin)
+    registros, campos = _anotar_dimensiones(registros, dimensiones, 'usuario__perfilnutricional__')
+
+    macros = registros.values(*campos).annotate(**{
+        macro: Sum(F(f'alimento__{macro}') * F('cantidad'), output_field=FloatField())
+        for macro in MACRONUTRIENTES
+    }).order_by()
+    for fila in macros:
+        grupo = _grupo(resultados, fila, campos)
+        for macro in MACRONUTRIENTES:
+            grupo[macro] = fila[macro] or 0
+
+    # Por nutriente_id, sin unir Nutriente: los nombres salen del catálogo en memoria
+    nutrientes = registros.filter(alimento__alimentonutriente__isnull=False).values(
+        *campos, 'alimento__alimentonutriente__nutriente_id'
+    ).annotate(
+        total=Sum(F('alimento__alimentonutriente__cantidad') * F('cantidad'), output_field=FloatField())
+    ).order_by()
+    for fila in nutrientes:
+        grupo = _grupo(resultados, fila, campos)
+        grupo['nutrientes'][fila['alimento__alimentonutriente__nutriente_id']] = fila['total'] or 0
+    for grupo in resultados.values():
+        grupo['nutrientes'] = catalogo_nutrientes.por_nombre(grupo['nutrientes'])
+
+    diversidad = registros.values('usuario_id', *campos).annotate(
+        distintos=Count('alimento__alimentonutriente__nutriente', distinct=True)
+    ).order_by()
+    for fila in diversidad:
+        _grupo(resultados, fila, campos)['diversidad_nutrientes'] += fila['distintos']
+
+    return resultados
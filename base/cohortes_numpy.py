@@ -0,0 +1,141 @@
+from itertools import product
+
+import numpy as np
+from django.db import connections, transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from base.catalogo_nutrientes import catalogo_nutrientes
+from base.cohortes import DIMENSIONES_POR_DEFECTO, MACRONUTRIENTES, _anotar_dimensiones, _grupo_vacio
+from base.models import Alimento, AlimentoNutriente, PerfilNutricional, RegistroDiario
+
+# Filas de RegistroDiario procesadas por bloque: acota la memoria a unas decenas de MB sin importar el rango de fechas
+TAMANO_BLOQUE = 100_000
+
+
+class _Cohortes:
+    def __init__(self, dimensiones):
+        self.claves = ['__'.join(combinacion) for combinacion in product(*(d.etiquetas() for d in dimensiones))]
+        self.indices = {clave: i for i, clave in enumerate(self.claves)}
+
+    def indice(self, valores):
+        clave = '__'.join(str(valor) for valor in valores)
+        if clave not in self.indices:
+            self.indices[clave] = len(self.claves)
+            self.claves.append(clave)
+        return self.indices[clave]
+
+
+# Ejecuta la consulta de un values_list numérico directamente sobre el cursor y devuelve las filas en bloques de
+# arrays float64, sin los convertidores por fila del ORM (que con millones de filas dominan el tiempo total). Se usa
+# la base que elige el router para el queryset (la réplica de análisis dentro de lecturas_analiticas).
+def _bloques(queryset, columnas, tamano_bloque):
+    alias = queryset.db
+    sql, parametros = queryset.query.get_compiler(using=alias).as_sql()
+    with connections[alias].cursor() as cursor:
+        cursor.execute(sql, parametros)
+        while True:
+            filas = cursor.fetchmany(tamano_bloque)
+            if not filas:
+                break
+            yield np.array(filas, dtype=np.float64).reshape(len(filas), columnas)
+
+
+def _matriz(queryset, columnas):
+    bloques = list(_bloques(queryset, columnas, TAMANO_BLOQUE))
+    return np.concatenate(bloques) if bloques else np.zeros((0, columnas))
+
+
+def _matriz_alimentos(registros):
+    usados = registros.values('alimento_id')
+    filas = _matriz(Alimento.objects.filter(id__in=usados).order_by('id').values_list(
+        'id', *(Cast(macro, FloatField()) for macro in MACRONUTRIENTES)
+    ), 1 + len(MACRONUTRIENTES))
+    ids = filas[:, 0].astype(np.int64)
+    macros = filas[:, 1:]
+
+    relaciones = _matriz(AlimentoNutriente.objects.filter(alimento_id__in=usados).values_list(
+        'alimento_id', 'nutriente_id', Cast('cantidad', FloatField())
+    ), 3)
+    nutrientes_ids, columnas = np.unique(relaciones[:, 1].astype(np.int64), return_inverse=True)
+    filas_relacion = np.searchsorted(ids, relaciones[:, 0].astype(np.int64))
+    # Matriz densa alimento × nutriente (las relaciones repetidas se suman, como en la versión SQL)
+    cantidades = np.zeros((len(ids), len(nutrientes_ids)), dtype=np.float64)
+    np.add.at(cantidades, (filas_relacion, columnas), relaciones[:, 2])
+    presentes = np.zeros(cantidades.shape, dtype=bool)
+    presentes[filas_relacion, columnas] = True
+
+    nutrientes = catalogo_nutrientes.nutrientes(nutrientes_ids.tolist())
+    return ids, macros, cantidades, presentes, [nutrientes[i].nombre for i in nutrientes_ids.tolist()]
+
+
+# Versión vectorizada de base.cohortes.agregar_por_cohortes (mismo resultado). Lee los registros del rango como
+# columnas (usuario, alimento, cantidad) en bloques de TAMANO_BLOQUE filas y los cruza con una matriz densa
+# alimento × nutriente: los totales por cohorte se obtienen con productos y sumas por segmento de NumPy, y la
+# diversidad con una matriz booleana usuario × nutriente.
+def agregar_por_cohortes(dimensiones=DIMENSIONES_POR_DEFECTO, fecha_inicio=None, fecha_fin=None,
+                         tamano_bloque=TAMANO_BLOQUE):
+    cohortes = _Cohortes(dimensiones)
+    # Los registros de usuarios sin perfil se descartan en NumPy en vez de con un JOIN a PerfilNutricional
+    registros = RegistroDiario.objects.all()
+    if fecha_inicio:
+        registros = registros.filter(fecha__gte=fecha_inicio)
+    if fecha_fin:
+        registros = registros.filter(fecha__lte=fecha_fin)
+
+    # Una sola transacción (en la base de lectura) para que todas las lecturas vean el mismo estado de la base
+    with transaction.atomic(using=registros.db):
+        perfiles, campos = _anotar_dimensiones(PerfilNutricional.objects.all(), dimensiones)
+        filas = list(perfiles.order_by('usuario_id').values_list('usuario_id', *campos))
+        usuarios = np.array([fila[0] for fila in filas], dtype=np.int64)
+        cohorte_usuario = np.array([cohortes.indice(fila[1:]) for fila in filas], dtype=np.int64)
+
+        alimentos, macros, cantidades, presentes, nombres = _matriz_alimentos(registros)
+        total_cohortes = len(cohortes.claves)
+        totales_macros = np.zeros((total_cohortes, len(MACRONUTRIENTES)))
+        totales_nutrientes = np.zeros((total_cohortes, len(nombres)))
+        nutrientes_presentes = np.zeros((total_cohortes, len(nombres)), dtype=bool)
+        consumidos = np.zeros((len(usuarios), len(nombres)), dtype=bool)
+
+        consulta = registros.values_list('usuario_id', 'alimento_id', Cast('cantidad', FloatField()))
+        for datos in _bloques(consulta, 3, tamano_bloque):
+            ids_usuario = datos[:, 0].astype(np.int64)
+            fila_usuario = np.minimum(np.searchsorted(usuarios, ids_usuario), max(len(usuarios) - 1, 0))
+            con_perfil = usuarios[fila_usuario] == ids_usuario if len(usuarios) else np.zeros(len(datos), dtype=bool)
+            datos, fila_usuario = datos[con_perfil], fila_usuario[con_perfil]
+            if not len(datos):
+                continue
+            fila_alimento = np.searchsorted(alimentos, datos[:, 1].astype(np.int64))
+            cantidad = datos[:, 2]
+            cohorte = cohorte_usuario[fila_usuario]
+
+            # Suma por cohorte: se ordena el bloque por cohorte y se reduce cada segmento
+            orden = np.argsort(cohorte, kind='stable')
+            cohorte_ordenada = cohorte[orden]
+            inicios = np.flatnonzero(np.r_[True, cohorte_ordenada[1:] != cohorte_ordenada[:-1]])
+            grupos = cohorte_ordenada[inicios]
+            alimento_ordenado = fila_alimento[orden]
+            cantidad_ordenada = cantidad[orden][:, None]
+            totales_macros[grupos] += np.add.reduceat(macros[alimento_ordenado] * cantidad_ordenada, inicios)
+            if nombres:
+                totales_nutrientes[grupos] += np.add.reduceat(
+                    cantidades[alimento_ordenado] * cantidad_ordenada, inicios
+                )
+                presentes_bloque = presentes[alimento_ordenado]
+                nutrientes_presentes[grupos] |= np.logical_or.reduceat(presentes_bloque, inicios)
+                filas, columnas = np.nonzero(presentes_bloque)
+                consumidos[fila_usuario[orden][filas], columnas] = True
+
+    usuarios_por_cohorte = np.bincount(cohorte_usuario, minlength=total_cohortes)
+    diversidad_por_cohorte = np.bincount(cohorte_usuario, weights=consumidos.sum(axis=1), minlength=total_cohortes)
+    resultados = {}
+    for indice, clave in enumerate(cohortes.claves):
+        grupo = resultados[clave] = _grupo_vacio()
+        grupo['usuarios'] = int(usuarios_por_cohorte[indice])
+        grupo['diversidad_nutrientes'] = float(diversidad_por_cohorte[indice])
+        for posicion, macro in enumerate(MACRONUTRIENTES):
+            grupo[macro] = float(totales_macros[indice, posicion])
+        for columna in np.flatnonzero(nutrientes_presentes[indice]).tolist():
+            nombre = nombres[columna]
+            grupo['nutrientes'][nombre] = grupo['nutrientes'].get(nombre, 0) + float(totales_nutrientes[indice, columna])
+    return resultados
@@ -0,0 +1,83 @@
+import hashlib
+from datetime import date, datetime, time, timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from base.versiones import estado
+
+
+# Equivalente async de user_passes_test (en Django 5.0 login_required y user_passes_test sólo envuelven vistas sync).
+# Obtiene el usuario con request.auser() y lo deja en request.user, así las plantillas ({{ user }}) no vuelven a
+# consultarlo de forma síncrona. Si el usuario no pasa la prueba redirige al login, o responde 403 en JSON si `api`.
+def usuario_pasa_prueba_async(prueba, api=False):
+    def decorador(vista):
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            usuario = await request.auser()
+            request.user = usuario
+            if prueba(usuario):
+                return await vista(request, *args, **kwargs)
+            if api:
+                return JsonResponse({'detail': 'Las credenciales de autenticación no se proveyeron.'}, status=403)
+            return redirect_to_login(request.get_full_path())
+        return envoltura
+    return decorador
+
+
+login_requerido_async = usuario_pasa_prueba_async(lambda u: u.is_authenticated)
+superusuario_requerido_async = usuario_pasa_prueba_async(lambda u: u.is_authenticated and u.is_superuser)
+api_login_requerido_async = usuario_pasa_prueba_async(lambda u: u.is_authenticated, api=True)
+
+
+# Huella de los parámetros GET, sin importar su orden: la misma URL con otros filtros es otra respuesta
+def _huella_consulta(request):
+    consulta = urlencode(sorted(request.GET.lists()), doseq=True)
+    return hashlib.sha256(consulta.encode()).hexdigest()[:16]
+
+
+# GET condicional a partir de los contadores de base/versiones.py. `ambitos(request, *args, **kwargs)` devuelve los
+# ámbitos de los que depende la respuesta. El ETag se arma con el usuario, esas versiones y los parámetros GET, y
+# Last-Modified con la hora del último cambio, con una sola consulta a VersionDatos: si el cliente ya tiene la
+# versión actual se responde 304 sin ejecutar la vista. Con `diario` la respuesta depende además de la fecha de hoy
+# y cambia al empezar el día. Cache-Control private, no-cache: el navegador guarda la página pero la revalida
+# siempre, y ningún proxy la comparte. Vale para vistas sync y async; debe ir después de la autenticación, porque
+# usa request.user.
+def condicional_por_version(ambitos, diario=False):
+    def etag(request, *args, **kwargs):
+        partes = [request.user.pk, *request._estado_versiones[0]]
+        if diario:
+            partes.append(date.today().isoformat())
+        if request.GET:
+            partes.append(_huella_consulta(request))
+        return '"%s"' % '-'.join(str(parte) for parte in partes)
+
+    def modificado(request, *args, **kwargs):
+        fecha = request._estado_versiones[1]
+        if diario:
+            fecha = max(fecha, datetime.combine(date.today(), time.min).astimezone(timezone.utc))
+        return fecha
+
+    def decorador(vista):
+        condicional = condition(etag_func=etag, last_modified_func=modificado)(vista)
+        condicional = cache_control(private=True, no_cache=True)(condicional)
+
+        # condition llama a etag y modificado de forma síncrona: el estado se lee antes (en un hilo si la vista es
+        # async) y se deja en la petición
+        if iscoroutinefunction(vista):
+            @wraps(vista)
+            async def envoltura(request, *args, **kwargs):
+                request._estado_versiones = await sync_to_async(estado)(*ambitos(request, *args, **kwargs))
+                return await condicional(request, *args, **kwargs)
+        else:
+            @wraps(vista)
+            def envoltura(request, *args, **kwargs):
+                request._estado_versiones = estado(*ambitos(request, *args, **kwargs))
+                return condicional(request, *args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,105 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from base.basedatos import alias_analitica
+from base.models import RegistroDiario
+
+# Filas leídas de la base por vuelta del cursor y filas enviadas juntas en cada fragmento de la respuesta
+FILAS_POR_CONSULTA = 2000
+FILAS_POR_FRAGMENTO = 500
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+COLUMNAS_HISTORIAL = ['fecha', 'usuario', 'alimento', 'cantidad', 'calorias', 'proteinas', 'carbohidratos', 'grasas']
+COLUMNAS_EXCESOS = ['fecha', 'usuario', 'total_calorias', 'limite_calorias']
+
+
+class _Eco:
+    # Objeto tipo archivo para csv.writer: devuelve la línea en vez de guardarla
+    def write(self, valor):
+        return valor
+
+
+def _lineas_csv(columnas, filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(columnas)
+    for fila in filas:
+        yield escritor.writerow([fila[columna] for columna in columnas])
+
+
+def _lineas_ndjson(columnas, filas):
+    for fila in filas:
+        yield json.dumps({columna: fila[columna] for columna in columnas}, cls=DjangoJSONEncoder) + '\n'
+
+
+# Agrupa las líneas en fragmentos de FILAS_POR_FRAGMENTO. La primera línea se envía sola para que el cliente reciba
+# el encabezado (y empiece la descarga) sin esperar al primer bloque de filas.
+def _fragmentos(lineas):
+    primera = next(lineas, None)
+    if primera is None:
+        return
+    yield primera
+    fragmento = []
+    for linea in lineas:
+        fragmento.append(linea)
+        if len(fragmento) == FILAS_POR_FRAGMENTO:
+            yield ''.join(fragmento)
+            fragmento = []
+    if fragmento:
+        yield ''.join(fragmento)
+
+
+# Respuesta que genera el archivo a medida que se envía: la primera línea sale antes de consultar la base y las filas
+# se leen con QuerySet.iterator(), así que la memoria usada no depende de cuántas filas se exporten.
+def respuesta_exportacion(filas, columnas, formato, nombre):
+    tipo, extension = FORMATOS[formato]
+    lineas = _lineas_csv(columnas, filas) if formato == 'csv' else _lineas_ndjson(columnas, filas)
+    respuesta = StreamingHttpResponse(_fragmentos(lineas), content_type=tipo)
+    respuesta['Content-Disposition'] = f'attachment; filename="{nombre}.{extension}"'
+    return respuesta
+
+
+# Historial de RegistroDiario (de un usuario o de todos) como filas de diccionarios, leído por bloques.
+def filas_historial(usuario=None, desde=None, hasta=None):
+    registros = RegistroDiario.objects.select_related('alimento', 'usuario').only(
+        'fecha', 'cantidad', 'usuario__username', 'alimento__nombre', 'alimento__calorias', 'alimento__proteinas',
+        'alimento__carbohidratos', 'alimento__grasas',
+    )
+    if usuario is not None:
+        registros = registros.filter(usuario=usuario)
+    else:
+        # El historial completo se exporta desde la réplica de análisis; el de un usuario, de 'default' para que
+        # incluya lo que acaba de registrar
+        registros = registros.using(alias_analitica())
+    if desde:
+        registros = registros.filter(fecha__gte=desde)
+    if hasta:
+        registros = registros.filter(fecha__lte=hasta)
+    for registro in registros.order_by('usuario_id', 'fecha', 'id').iterator(chunk_size=FILAS_POR_CONSULTA):
+        alimento = registro.alimento
+        yield {
+            'fecha': registro.fecha,
+            'usuario': registro.usuario.username,
+            'alimento': alimento.nombre,
+            'cantidad': registro.cantidad,
+            'calorias': alimento.calorias,
+            'proteinas': alimento.proteinas,
+            'carbohidratos': alimento.carbohidratos,
+            'grasas': alimento.grasas,
+        }
+
+
+def filas_excesos(excesos):
+    for fila in excesos.using(alias_analitica()).iterator(chunk_size=FILAS_POR_CONSULTA):
+        yield {
+            'fecha': fila['fecha'],
+            'usuario': fila['usuario__username'],
+            'total_calorias': fila['total_calorias'],
+            'limite_calorias': fila['limite_calorias'],
+        }
@@ -0,0 +1,200 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from base.models import Alimento
+from base.versiones import AMBITO_ALIMENTOS, ambito_usuario, incrementar_al_confirmar
+
+logger = logging.getLogger(__name__)
+
+# Alturas en píxeles de las miniaturas. El listado muestra las imágenes a 50px: usa 50 (1x) y 100 (2x);
+# 400 queda para vistas de detalle y la API.
+ALTURAS = (50, 100, 400)
+FORMATOS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+CARPETA_DERIVADOS = 'alimentos_imagenes/derivados/'
+
+_ejecutor = None
+_ejecutor_lock = Lock()
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    with _ejecutor_lock:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGENES_HILOS', 2),
+                                           thread_name_prefix='imagenes')
+        return _ejecutor
+
+
+# Devuelve los tamaños generados ({'50': {'ancho', 'alto', 'webp', 'jpeg'}, ...}) si corresponden a la imagen actual.
+def tamanos_vigentes(alimento):
+    derivados = alimento.imagen_derivados or {}
+    if not alimento.imagen or derivados.get('origen') != alimento.imagen.name:
+        return {}
+    return derivados.get('tamanos', {})
+
+
+# Indica si las miniaturas guardadas no corresponden a la imagen actual (nueva, reemplazada o eliminada).
+def necesita_derivados(alimento):
+    if alimento.imagen:
+        return (alimento.imagen_derivados or {}).get('origen') != alimento.imagen.name
+    return bool(alimento.imagen_derivados)
+
+
+# Menor tamaño generado con al menos la altura pedida (o el mayor disponible).
+def tamano_para(tamanos, altura):
+    alturas = sorted(int(clave) for clave in tamanos)
+    elegida = next((disponible for disponible in alturas if disponible >= altura), alturas[-1])
+    return tamanos[str(elegida)]
+
+
+# srcset con densidades 1x y 2x para mostrar la imagen a la altura indicada, o None si aún no hay miniaturas.
+def srcset(alimento, altura, formato):
+    tamanos = tamanos_vigentes(alimento)
+    if not tamanos:
+        return None
+    uno = tamano_para(tamanos, altura)[formato]
+    dos = tamano_para(tamanos, altura * 2)[formato]
+    return f'{default_storage.url(uno)} 1x, {default_storage.url(dos)} 2x'
+
+
+# Rutas de todos los archivos generados registrados en imagen_derivados.
+def rutas_derivados(derivados):
+    return {
+        ruta
+        for tamano in (derivados or {}).get('tamanos', {}).values()
+        for formato, ruta in tamano.items() if formato in FORMATOS
+    }
+
+
+def _codificar(imagen, formato):
+    if formato == 'jpeg' and imagen.mode != 'RGB':
+        # JPEG no admite transparencia: se compone sobre fondo blanco
+        rgba = imagen.convert('RGBA')
+        fondo = Image.new('RGB', rgba.size, (255, 255, 255))
+        fondo.paste(rgba, mask=rgba.getchannel('A'))
+        imagen = fondo
+    elif formato == 'webp' and imagen.mode not in ('RGB', 'RGBA'):
+        imagen = imagen.convert('RGBA' if 'transparency' in imagen.info or imagen.mode in ('LA', 'P') else 'RGB')
+    salida = BytesIO()
+    imagen.save(salida, **FORMATOS[formato])
+    return salida.getvalue()
+
+
+def eliminar_archivos(rutas):
+    for ruta in rutas:
+        try:
+            default_storage.delete(ruta)
+        except OSError:
+            logger.warning('No se pudo eliminar la miniatura %s', ruta)
+
+
+# Elimina las miniaturas registradas en `derivados` si ningún alimento usa ya su imagen de origen: como se nombran
+# por el contenido del origen, los alimentos con la misma imagen comparten también las miniaturas.
+def liberar_derivados(derivados, conservar=()):
+    rutas = rutas_derivados(derivados) - set(conservar)
+    origen = (derivados or {}).get('origen')
+    if not rutas or (origen and Alimento.objects.filter(imagen=origen).exists()):
+        return False
+    eliminar_archivos(rutas)
+    return True
+
+
+# Rutas de las miniaturas de un tamaño. El nombre sale del archivo de origen, que el almacenamiento nombra por el
+# hash de su contenido (ver storage.py): la misma imagen siempre produce las mismas rutas.
+def _rutas_tamano(origen, altura):
+    nombre_base = os.path.splitext(os.path.basename(origen))[0]
+    return {formato: f'{CARPETA_DERIVADOS}{nombre_base}_{altura}.{formato}' for formato in FORMATOS}
+
+
+# Tamaño ya generado (por otro alimento con la misma imagen o una ejecución anterior), o None si falta algún archivo.
+# Las dimensiones se leen de la cabecera de la miniatura, sin decodificarla.
+def _tamano_existente(rutas):
+    if not all(default_storage.exists(ruta) for ruta in rutas.values()):
+        return None
+    with default_storage.open(rutas['jpeg'], 'rb') as archivo:
+        ancho, alto = Image.open(archivo).size
+    return {'ancho': ancho, 'alto': alto, **rutas}
+
+
+# Genera las miniaturas de la imagen de un alimento y las guarda en imagen_derivados. Las que ya existen se reutilizan
+# (con `forzar` se vuelven a codificar). Si la imagen cambió mientras se generaban, descarta el resultado (la nueva
+# imagen tiene su propia tarea). Se ejecuta sin bloquear la petición desde programar_derivados, o directamente desde
+# el comando generar_miniaturas.
+def generar_derivados(alimento_id, forzar=False):
+    alimento = Alimento.objects.filter(pk=alimento_id).only('id', 'usuario_id', 'imagen', 'imagen_derivados').first()
+    if alimento is None:
+        return None
+    anteriores = alimento.imagen_derivados
+    derivados = {}
+    if alimento.imagen:
+        origen = alimento.imagen.name
+        imagen = None
+        derivados = {'origen': origen, 'tamanos': {}}
+        for altura in ALTURAS:
+            rutas = _rutas_tamano(origen, altura)
+            tamano = None if forzar else _tamano_existente(rutas)
+            if tamano is None:
+                if imagen is None:
+                    with alimento.imagen.open('rb') as archivo:
+                        imagen = ImageOps.exif_transpose(Image.open(archivo))
+                        imagen.load()
+                copia = imagen.copy()
+                copia.thumbnail((altura * 4, altura), Image.LANCZOS)
+                tamano = {'ancho': copia.width, 'alto': copia.height}
+                for formato, ruta in rutas.items():
+                    default_storage.delete(ruta)
+                    tamano[formato] = default_storage.save(ruta, ContentFile(_codificar(copia, formato)))
+            derivados['tamanos'][str(altura)] = tamano
+        vigente = Alimento.objects.filter(pk=alimento_id, imagen=origen)
+    else:
+        vigente = Alimento.objects.filter(Q(imagen='') | Q(imagen__isnull=True), pk=alimento_id)
+
+    # update() no dispara señales ni los triggers de búsqueda: la versión se incrementa explícitamente
+    if vigente.update(imagen_derivados=derivados):
+        liberar_derivados(anteriores, conservar=rutas_derivados(derivados))
+        incrementar_al_confirmar(ambito_usuario(alimento.usuario_id), AMBITO_ALIMENTOS)
+    else:
+        liberar_derivados(derivados)
+    return derivados
+
+# Envoltura de generar_derivados para hilos de un pool: registra los errores y cierra la conexión del hilo.
+def generar_derivados_en_hilo(alimento_id, forzar=False):
+    try:
+        generar_derivados(alimento_id, forzar)
+    except Exception:
+        logger.exception('Error generando las miniaturas del alimento %s', alimento_id)
+    finally:
+        # Cada hilo del pool tiene su propia conexión a la base de datos
+        connections.close_all()
+
+
+# Encola la generación de miniaturas para cuando se confirme la transacción en curso, así la petición que sube
+# la imagen no espera al redimensionado. Con IMAGENES_HILOS = 0 se generan al confirmar en el mismo hilo.
+def programar_derivados(alimento):
+    alimento_id = alimento.pk
+    if not getattr(settings, 'IMAGENES_HILOS', 2):
+        transaction.on_commit(lambda: generar_derivados(alimento_id))
+        return
+    transaction.on_commit(lambda: _obtener_ejecutor().submit(generar_derivados_en_hilo, alimento_id))
+
+
+# Elimina el archivo de imagen si ningún alimento lo usa. Con el almacenamiento por contenido un mismo archivo puede
+# estar compartido, así que la base de datos hace de contador de referencias.
+def liberar_imagen(nombre):
+    if not nombre or Alimento.objects.filter(imagen=nombre).exists():
+        return False
+    Alimento._meta.get_field('imagen').storage.delete(nombre)
+    return True
@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, FloatField, OuterRef, Q, Sum
+
+from base.catalogo_nutrientes import catalogo_nutrientes
+from base.cohortes import MACRONUTRIENTES
+from base.models import IngestaDiaria, RegistroDiario
+
+USUARIOS_POR_RECALCULO = 200
+
+# Recalculos pendientes mientras hay un bloque diferir_recalculo() activo: días (usuario_id, fecha) y alimentos.
+_pendientes = ContextVar('ingestas_pendientes', default=None)
+
+
+# Micronutrientes por (usuario, fecha), agrupados por nutriente_id (sin unir Nutriente) y con los nombres del
+# catálogo en memoria.
+def _micronutrientes(registros):
+    filas = registros.filter(alimento__alimentonutriente__isnull=False).values(
+        'usuario_id', 'fecha', nutriente_id=F('alimento__alimentonutriente__nutriente_id')
+    ).annotate(
+        total=Sum(F('alimento__alimentonutriente__cantidad') * F('cantidad'), output_field=FloatField())
+    ).order_by()
+    totales = {}
+    for fila in filas:
+        totales.setdefault((fila['usuario_id'], fila['fecha']), {})[fila['nutriente_id']] = fila['total']
+    return {clave: catalogo_nutrientes.por_nombre(por_id) for clave, por_id in totales.items()}
+
+
+# Arma los IngestaDiaria de los registros indicados con dos consultas agrupadas por (usuario, fecha). Tanto los
+# macronutrientes como los micronutrientes se multiplican por la cantidad registrada (porciones del alimento), igual
+# que en las cohortes y el reporte de excesos.
+def _ingestas(registros):
+    micronutrientes = _micronutrientes(registros)
+    filas = registros.values('usuario_id', 'fecha').annotate(**{
+        macro: Sum(F(f'alimento__{macro}') * F('cantidad'), output_field=DecimalField())
+        for macro in MACRONUTRIENTES
+    }).order_by()
+    return [
+        IngestaDiaria(
+            usuario_id=fila['usuario_id'], fecha=fila['fecha'],
+            micronutrientes=micronutrientes.get((fila['usuario_id'], fila['fecha']), {}),
+            **{macro: fila[macro] or 0 for macro in MACRONUTRIENTES}
+        )
+        for fila in filas
+    ]
+
+
+def _reemplazar(filtro):
+    with transaction.atomic():
+        ingestas = _ingestas(RegistroDiario.objects.filter(filtro))
+        IngestaDiaria.objects.filter(filtro).delete()
+        IngestaDiaria.objects.bulk_create(ingestas)
+
+
+# Recalcula los días (usuario_id, fecha) indicados con un número fijo de consultas. Los días que ya no tienen
+# registros quedan eliminados.
+def _recalcular_claves(claves):
+    fechas_por_usuario = {}
+    for usuario_id, fecha in claves:
+        fechas_por_usuario.setdefault(usuario_id, set()).add(fecha)
+    usuarios = list(fechas_por_usuario.items())
+    # Se agrupan los usuarios en bloques para no exceder la profundidad máxima de expresiones de SQLite
+    for inicio in range(0, len(usuarios), USUARIOS_POR_RECALCULO):
+        filtro = Q()
+        for usuario_id, fechas in usuarios[inicio:inicio + USUARIOS_POR_RECALCULO]:
+            filtro |= Q(usuario_id=usuario_id, fecha__in=fechas)
+        _reemplazar(filtro)
+
+
+# Recalcula todos los días en los que aparece alguno de los registros indicados, sin enumerarlos en Python:
+# los días afectados se expresan como un EXISTS correlacionado sobre (usuario, fecha).
+def _recalcular_dias_de(registros):
+    _reemplazar(Q(Exists(registros.filter(usuario_id=OuterRef('usuario_id'), fecha=OuterRef('fecha')))))
+
+
+# Agrupa en un único recálculo al salir del bloque todos los cambios hechos dentro de él
+# (por ejemplo, al eliminar un alimento con todos sus registros y nutrientes en cascada).
+@contextmanager
+def diferir_recalculo():
+    if _pendientes.get() is not None:
+        yield
+        return
+    pendientes = {'claves': set(), 'alimentos': set()}
+    token = _pendientes.set(pendientes)
+    try:
+        yield
+    finally:
+        _pendientes.reset(token)
+    with transaction.atomic():
+        _recalcular_claves(pendientes['claves'])
+        if pendientes['alimentos']:
+            _recalcular_dias_de(RegistroDiario.objects.filter(alimento_id__in=pendientes['alimentos']))
+
+
+# Recalcula desde los registros el IngestaDiaria de un usuario en una fecha (o lo elimina si ya no quedan
+# registros ese día). Se ejecuta dentro de la transacción del cambio que lo provocó.
+def recalcular_ingesta(usuario_id, fecha):
+    pendientes = _pendientes.get()
+    if pendientes is not None:
+        pendientes['claves'].add((usuario_id, fecha))
+        return
+    _recalcular_claves({(usuario_id, fecha)})
+
+
+# Recalcula varios días (usuario_id, fecha) juntos, con el mismo número de consultas que uno solo.
+def recalcular_ingestas(claves):
+    pendientes = _pendientes.get()
+    if pendientes is not None:
+        pendientes['claves'].update(claves)
+        return
+    _recalcular_claves(claves)
+
+
+# Recalcula los IngestaDiaria de todos los días en los que aparece el alimento indicado.
+def recalcular_ingestas_de_alimento(alimento_id):
+    pendientes = _pendientes.get()
+    if pendientes is not None:
+        pendientes['alimentos'].add(alimento_id)
+        return
+    _recalcular_dias_de(RegistroDiario.objects.filter(alimento_id=alimento_id))
+
+
+# Recalcula los IngestaDiaria de todos los días en los que aparece algún alimento con el nutriente indicado.
+def recalcular_ingestas_de_nutriente(nutriente_id):
+    _recalcular_dias_de(RegistroDiario.objects.filter(alimento__alimentonutriente__nutriente_id=nutriente_id))
+
+
+# Reconstruye en bloque los IngestaDiaria (opcionalmente de un usuario y/o un rango de fechas), usuario por usuario,
+# con dos consultas agrupadas por usuario y bulk_create. Pensado para cargas iniciales y correcciones.
+def reconstruir_ingestas(usuario_id=None, desde=None, hasta=None, tamano_lote=1000):
+    filtros = {}
+    if usuario_id is not None:
+        filtros['usuario_id'] = usuario_id
+    if desde:
+        filtros['fecha__gte'] = desde
+    if hasta:
+        filtros['fecha__lte'] = hasta
+
+    IngestaDiaria.objects.filter(**filtros).delete()
+
+    registros = RegistroDiario.objects.filter(**filtros)
+    usuarios = registros.order_by('usuario_id').values_list('usuario_id', flat=True).distinct()
+    total = 0
+    for usuario in usuarios:
+        ingestas = _ingestas(registros.filter(usuario_id=usuario))
+        IngestaDiaria.objects.bulk_create(ingestas, batch_size=tamano_lote)
+        total += len(ingestas)
+    return total
@@ -0,0 +1,254 @@
+import json
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.test import Client
+from django.urls import reverse
+
+from base.ingesta_service import diferir_recalculo, reconstruir_ingestas
+from base.models import Alimento, AlimentoNutriente, Nutriente, PerfilNutricional, RegistroDiario
+
+CLAVE = 'benchmark-clave-123'
+# Errores distintos que se muestran por URL en el reporte
+ERRORES_POR_URL = 5
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    # Método del rango más cercano
+    indice = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[indice]
+
+
+# Cliente HTTP contra un servidor real (--url). Maneja la cookie y el token CSRF como lo haría un navegador.
+class ClienteHttp:
+    def __init__(self, url_base):
+        import requests
+
+        self.url_base = url_base.rstrip('/')
+        self.sesion = requests.Session()
+
+    def _csrf(self):
+        return self.sesion.cookies.get('csrftoken', '')
+
+    def get(self, ruta, datos=None):
+        respuesta = self.sesion.get(self.url_base + ruta, params=datos)
+        return respuesta.status_code
+
+    def post(self, ruta, datos=None):
+        if not self._csrf():
+            self.sesion.get(self.url_base + reverse('login'))
+        datos = dict(datos or {}, csrfmiddlewaretoken=self._csrf())
+        respuesta = self.sesion.post(self.url_base + ruta, data=datos, allow_redirects=False,
+                                     headers={'Referer': self.url_base + ruta})
+        return respuesta.status_code
+
+
+# Cliente en proceso basado en django.test.Client: no necesita servidor y mide la aplicación completa
+# (middleware, vistas, ORM y plantillas) sin la red.
+class ClienteLocal:
+    def __init__(self):
+        self.cliente = Client(SERVER_NAME='localhost')
+
+    def get(self, ruta, datos=None):
+        return self.cliente.get(ruta, datos).status_code
+
+    def post(self, ruta, datos=None):
+        return self.cliente.post(ruta, datos).status_code
+
+
+class Command(BaseCommand):
+    help = ('Siembra usuarios, alimentos, nutrientes e historial de registros y ejecuta en paralelo los flujos '
+            'principales de la aplicación, reportando en JSON el rendimiento y la latencia p50/p95/p99 por URL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=20, help='Usuarios a sembrar')
+        parser.add_argument('--alimentos', type=int, default=30, help='Alimentos por usuario')
+        parser.add_argument('--nutrientes', type=int, default=12, help='Nutrientes del catálogo')
+        parser.add_argument('--nutrientes-por-alimento', type=int, default=4)
+        parser.add_argument('--dias', type=int, default=30, help='Días de historial de RegistroDiario')
+        parser.add_argument('--registros-por-dia', type=int, default=5)
+        parser.add_argument('--hilos', type=int, default=8, help='Hilos concurrentes')
+        parser.add_argument('--iteraciones', type=int, default=5, help='Repeticiones del flujo por usuario')
+        parser.add_argument('--url', default=None,
+                            help='URL base de un servidor en ejecución; por defecto se usa un cliente en proceso')
+        parser.add_argument('--prefijo', default='bench', help='Prefijo de los usuarios sembrados')
+        parser.add_argument('--sin-sembrar', action='store_true', help='Reutiliza los datos ya sembrados')
+        parser.add_argument('--limpiar', action='store_true', help='Elimina los datos sembrados al terminar')
+        parser.add_argument('--salida', default=None, help='Archivo donde guardar el reporte JSON')
+
+    def handle(self, *args, **options):
+        prefijo = options['prefijo']
+        if not options['sin_sembrar']:
+            inicio = time.perf_counter()
+            self.sembrar(options)
+            self.stderr.write(f"Datos sembrados en {time.perf_counter() - inicio:.1f}s")
+
+        usuarios = list(User.objects.filter(username__startswith=f'{prefijo}_usuario').values_list('username', 'id'))
+        alimentos = {}
+        for usuario_id, alimento_id in Alimento.objects.filter(
+            usuario_id__in=[usuario_id for _, usuario_id in usuarios]
+        ).values_list('usuario_id', 'id'):
+            alimentos.setdefault(usuario_id, []).append(alimento_id)
+
+        muestras = {}
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['hilos']) as ejecutor:
+            tareas = [
+                ejecutor.submit(self.flujo_usuario, options, username, alimentos.get(usuario_id, []))
+                for username, usuario_id in usuarios
+            ]
+            tareas.append(ejecutor.submit(self.flujo_admin, options, f'{prefijo}_admin'))
+            for tarea in tareas:
+                for nombre, duracion, error in tarea.result():
+                    muestras.setdefault(nombre, []).append((duracion, error))
+        duracion_total = time.perf_counter() - inicio
+
+        reporte = self.reporte(options, muestras, duracion_total)
+        salida = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(salida)
+        self.stdout.write(salida)
+
+        if options['limpiar']:
+            self.limpiar(prefijo)
+
+    def limpiar(self, prefijo):
+        # Los registros eliminados en cascada se recalculan una sola vez al final
+        with transaction.atomic(), diferir_recalculo():
+            User.objects.filter(username__startswith=f'{prefijo}_').delete()
+            Nutriente.objects.filter(nombre__startswith=f'{prefijo} ').delete()
+
+    def sembrar(self, options):
+        prefijo = options['prefijo']
+        clave = make_password(CLAVE)
+        self.limpiar(prefijo)
+
+        User.objects.create(username=f'{prefijo}_admin', password=clave, is_staff=True, is_superuser=True)
+        nutrientes = Nutriente.objects.bulk_create([
+            Nutriente(nombre=f'{prefijo} nutriente {i}', tipo='vitamina' if i % 2 else 'mineral')
+            for i in range(options['nutrientes'])
+        ])
+        usuarios = User.objects.bulk_create([
+            User(username=f'{prefijo}_usuario{i}', password=clave) for i in range(options['usuarios'])
+        ])
+        perfiles = [
+            PerfilNutricional(usuario=usuario, edad=18 + (i * 7) % 60, sexo='Hombre' if i % 2 else 'Mujer',
+                              peso=Decimal('70'), altura=Decimal('1.70'), nivel_actividad='moderado')
+            for i, usuario in enumerate(usuarios)
+        ]
+        # bulk_create no llama a save(): los objetivos se calculan antes de insertar
+        for perfil in perfiles:
+            perfil.actualizar_objetivos()
+        PerfilNutricional.objects.bulk_create(perfiles)
+        alimentos = Alimento.objects.bulk_create([
+            Alimento(usuario=usuario, nombre=f'Alimento {j}', calorias=Decimal(50 + (j * 37) % 500),
+                     proteinas=Decimal(j % 30), carbohidratos=Decimal(j % 60), grasas=Decimal(j % 25),
+                     descripcion='Alimento sembrado para benchmark')
+            for usuario in usuarios for j in range(options['alimentos'])
+        ], batch_size=1000)
+        if nutrientes:
+            AlimentoNutriente.objects.bulk_create([
+                AlimentoNutriente(alimento=alimento, nutriente=nutrientes[(i + k) % len(nutrientes)],
+                                  cantidad=Decimal('2.5'), unidad='mg')
+                for i, alimento in enumerate(alimentos) for k in range(options['nutrientes_por_alimento'])
+            ], batch_size=1000)
+
+        alimentos_por_usuario = {}
+        for alimento in alimentos:
+            alimentos_por_usuario.setdefault(alimento.usuario_id, []).append(alimento)
+        for dia in range(options['dias']):
+            registros = RegistroDiario.objects.bulk_create([
+                RegistroDiario(usuario=usuario, cantidad=Decimal('1'),
+                               alimento=alimentos_por_usuario[usuario.id][(dia * 3 + k) % options['alimentos']])
+                for usuario in usuarios for k in range(options['registros_por_dia'])
+                if options['alimentos']
+            ], batch_size=1000)
+            # fecha es auto_now_add: se ajusta después de insertar para simular el historial
+            RegistroDiario.objects.filter(pk__in=[registro.pk for registro in registros]).update(
+                fecha=date.today() - timedelta(days=dia)
+            )
+        for usuario in usuarios:
+            reconstruir_ingestas(usuario_id=usuario.id)
+
+    def cliente(self, options):
+        return ClienteHttp(options['url']) if options['url'] else ClienteLocal()
+
+    # Cada muestra es (nombre, duración, error): error es None si la petición respondió bien, 'HTTP <estado>' si
+    # respondió con un error o el tipo y el mensaje de la excepción si falló, para que el reporte diga por qué.
+    def medir(self, muestras, nombre, funcion, *args):
+        inicio = time.perf_counter()
+        try:
+            estado = funcion(*args)
+            error = f'HTTP {estado}' if estado >= 400 else None
+        except Exception as excepcion:
+            error = f'{type(excepcion).__name__}: {excepcion}'
+        muestras.append((nombre, time.perf_counter() - inicio, error))
+
+    def flujo_usuario(self, options, username, alimentos):
+        muestras = []
+        cliente = self.cliente(options)
+        try:
+            self.medir(muestras, 'login', cliente.post, reverse('login'), {'username': username, 'password': CLAVE})
+            for iteracion in range(options['iteraciones']):
+                if alimentos:
+                    datos = {'alimento': alimentos[iteracion % len(alimentos)], 'cantidad': '1'}
+                    self.medir(muestras, 'registro_diario', cliente.post, reverse('registro_diario'), datos)
+                self.medir(muestras, 'analisis_nutricional', cliente.get, reverse('analisis_nutricional'))
+                self.medir(muestras, 'sugerencias_alimentos', cliente.get, reverse('sugerencias_alimentos'))
+                self.medir(muestras, 'api_alimentos', cliente.get, reverse('alimento-list'))
+        finally:
+            close_old_connections()
+        return muestras
+
+    def flujo_admin(self, options, username):
+        muestras = []
+        cliente = self.cliente(options)
+        try:
+            self.medir(muestras, 'login', cliente.post, reverse('login'), {'username': username, 'password': CLAVE})
+            for _ in range(options['iteraciones']):
+                self.medir(muestras, 'vista_analisis', cliente.get, reverse('analisis-consumo'))
+                self.medir(muestras, 'reporte_excesos', cliente.get, reverse('reporte_excesos'))
+        finally:
+            close_old_connections()
+        return muestras
+
+    def reporte(self, options, muestras, duracion_total):
+        resultados = {}
+        total_peticiones = 0
+        for nombre, valores in sorted(muestras.items()):
+            duraciones = [duracion * 1000 for duracion, _ in valores]
+            errores = Counter(error for _, error in valores if error)
+            total_peticiones += len(valores)
+            resultados[nombre] = {
+                'peticiones': len(valores),
+                'errores': sum(errores.values()),
+                # Los errores más frecuentes con su cantidad, p. ej. {'HTTP 500': 3, 'ConnectionError: ...': 1}
+                'detalle_errores': dict(errores.most_common(ERRORES_POR_URL)),
+                'rps': round(len(valores) / duracion_total, 2) if duracion_total else None,
+                'media_ms': round(sum(duraciones) / len(duraciones), 2),
+                'p50_ms': round(percentil(duraciones, 50), 2),
+                'p95_ms': round(percentil(duraciones, 95), 2),
+                'p99_ms': round(percentil(duraciones, 99), 2),
+            }
+        return {
+            'configuracion': {
+                clave: options[clave] for clave in
+                ['usuarios', 'alimentos', 'nutrientes', 'dias', 'registros_por_dia', 'hilos', 'iteraciones', 'url']
+            },
+            'duracion_s': round(duracion_total, 3),
+            'peticiones': total_peticiones,
+            'rps': round(total_peticiones / duracion_total, 2) if duracion_total else None,
+            'urls': resultados,
+        }
@@ -0,0 +1,78 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.models import Alimento
+from base.storage import hash_contenido, nombre_por_contenido
+from base.versiones import AMBITO_ALIMENTOS, ambito_usuario, incrementar_versiones
+
+
+class Command(BaseCommand):
+    help = ('Migra las imágenes de alimentos al almacenamiento por contenido: renombra cada archivo a su hash, '
+            'hace que los alimentos con imágenes idénticas compartan un único archivo y elimina las copias.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Sólo informa lo que haría, sin modificar nada')
+        parser.add_argument('--huerfanos', action='store_true',
+                            help='Elimina también los archivos de la carpeta de imágenes que ningún alimento usa')
+
+    def handle(self, *args, **options):
+        campo = Alimento._meta.get_field('imagen')
+        storage = campo.storage
+        simular = options['simular']
+
+        destinos = {}
+        nombres = Alimento.objects.exclude(imagen='').exclude(imagen__isnull=True).values_list('imagen', flat=True)
+        for nombre in set(nombres):
+            if not storage.exists(nombre):
+                self.stderr.write(f'No existe el archivo {nombre}')
+                continue
+            with storage.open(nombre) as archivo:
+                destinos[nombre] = nombre_por_contenido(nombre, hash_contenido(archivo))
+        renombrar = {origen: destino for origen, destino in destinos.items() if origen != destino}
+
+        if not simular:
+            for origen, destino in renombrar.items():
+                if not storage.exists(destino):
+                    with storage.open(origen) as archivo:
+                        storage.save(destino, archivo)
+            with transaction.atomic():
+                alimentos = list(Alimento.objects.filter(imagen__in=renombrar).only(
+                    'id', 'usuario_id', 'imagen', 'imagen_derivados'
+                ))
+                for alimento in alimentos:
+                    origen = alimento.imagen.name
+                    if alimento.imagen_derivados.get('origen') == origen:
+                        alimento.imagen_derivados['origen'] = renombrar[origen]
+                    alimento.imagen = renombrar[origen]
+                # bulk_update no envía señales: los archivos anteriores se eliminan abajo y las versiones (las URLs de
+                # las imágenes cambian en los listados y la API) se incrementan aquí
+                Alimento.objects.bulk_update(alimentos, ['imagen', 'imagen_derivados'])
+                if alimentos:
+                    incrementar_versiones(AMBITO_ALIMENTOS, *{ambito_usuario(alimento.usuario_id)
+                                                              for alimento in alimentos})
+
+        candidatos = set(renombrar)
+        if options['huerfanos']:
+            carpeta = campo.upload_to.rstrip('/')
+            _, archivos = storage.listdir(carpeta)
+            candidatos |= {os.path.join(carpeta, archivo) for archivo in archivos} - set(destinos.values())
+
+        en_uso = set() if simular else set(
+            Alimento.objects.filter(imagen__in=candidatos).values_list('imagen', flat=True)
+        )
+        eliminados = 0
+        liberados = 0
+        for nombre in sorted(candidatos - en_uso):
+            liberados += storage.size(nombre)
+            eliminados += 1
+            if simular:
+                self.stdout.write(f'Se eliminaría {nombre}')
+            else:
+                storage.delete(nombre)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(destinos)} imágenes en uso, {len(set(destinos.values()))} archivos únicos; '
+            f'{eliminados} archivos {"a eliminar" if simular else "eliminados"} ({liberados / 1024:.0f} KB).'
+        ))
@@ -0,0 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+
+from base.imagenes_service import generar_derivados_en_hilo, necesita_derivados
+from base.models import Alimento
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas WebP/JPEG de las imágenes de alimentos que aún no las tienen (o de todas con --todas).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true', help='Vuelve a codificar también las miniaturas existentes')
+        parser.add_argument('--hilos', type=int, default=4, help='Imágenes procesadas en paralelo')
+
+    def handle(self, *args, **options):
+        alimentos = Alimento.objects.exclude(imagen='').exclude(imagen__isnull=True).only('id', 'imagen', 'imagen_derivados')
+        pendientes = [
+            alimento.id for alimento in alimentos.iterator()
+            if options['todas'] or necesita_derivados(alimento)
+        ]
+        with ThreadPoolExecutor(max_workers=options['hilos']) as ejecutor:
+            list(ejecutor.map(partial(generar_derivados_en_hilo, forzar=options['todas']), pendientes))
+        self.stdout.write(self.style.SUCCESS(f'Miniaturas generadas para {len(pendientes)} alimentos.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from base.trabajos_service import limpiar_trabajos
+
+
+class Command(BaseCommand):
+    help = ('Elimina los trabajos en segundo plano terminados hace más de --dias días (por defecto '
+            'TRABAJOS_RETENCION_DIAS) y da por abandonados los que siguen activos tras TRABAJOS_TIEMPO_MAXIMO.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None, help='Días que se conservan los trabajos terminados')
+
+    def handle(self, *args, **options):
+        eliminados = limpiar_trabajos(options['dias'])
+        self.stdout.write(self.style.SUCCESS(f'Trabajos eliminados: {eliminados}.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from base.analisis_service import AnalisisConsumoService
+
+
+class Command(BaseCommand):
+    help = 'Calcula el análisis de consumo por grupos y lo deja en caché antes de la primera petición.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha-inicio', default=None, help='Fecha inicial (YYYY-MM-DD)')
+        parser.add_argument('--fecha-fin', default=None, help='Fecha final (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        resultados, evaluacion = AnalisisConsumoService().precalentar(options['fecha_inicio'], options['fecha_fin'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Análisis precalentado para {len(resultados)} grupos: {evaluacion['grupo_mas_riesgo']}"
+        ))
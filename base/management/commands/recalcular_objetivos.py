@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.models import PerfilNutricional
+from base.utils import VERSION_FORMULA
+
+
+class Command(BaseCommand):
+    help = ('Recalcula en lotes el BMR y los objetivos diarios guardados en PerfilNutricional. Por defecto sólo los '
+            'calculados con una versión anterior de las fórmulas (VERSION_FORMULA en base/utils.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true', help='Recalcula todos los perfiles')
+        parser.add_argument('--tamano-lote', type=int, default=500)
+
+    def handle(self, *args, **options):
+        perfiles = PerfilNutricional.objects.order_by('pk')
+        if not options['todos']:
+            perfiles = perfiles.exclude(version_formula=VERSION_FORMULA)
+
+        total = 0
+        ultimo = 0
+        while True:
+            # Paginación por clave: cada lote se lee y se guarda en su propia transacción
+            lote = list(perfiles.filter(pk__gt=ultimo)[:options['tamano_lote']])
+            if not lote:
+                break
+            for perfil in lote:
+                perfil.actualizar_objetivos()
+            with transaction.atomic():
+                PerfilNutricional.objects.bulk_update(lote, PerfilNutricional.CAMPOS_OBJETIVOS)
+            total += len(lote)
+            ultimo = lote[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Objetivos recalculados para {total} perfiles (versión {VERSION_FORMULA}).'))
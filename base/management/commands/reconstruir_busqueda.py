@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from base.busqueda_service import reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye y compacta el índice de texto completo de alimentos (necesario sólo tras cargas con SQL directo).'
+
+    def handle(self, *args, **options):
+        reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS('Índice de búsqueda de alimentos reconstruido.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.ingesta_service import reconstruir_ingestas
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye la tabla de totales diarios (IngestaDiaria) a partir de los registros diarios.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, default=None, help='ID del usuario a reconstruir')
+        parser.add_argument('--desde', default=None, help='Fecha inicial (YYYY-MM-DD)')
+        parser.add_argument('--hasta', default=None, help='Fecha final (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = reconstruir_ingestas(options['usuario'], options['desde'], options['hasta'])
+        self.stdout.write(self.style.SUCCESS(f"{total} totales diarios reconstruidos."))
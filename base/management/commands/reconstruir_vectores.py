@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.recomendacion_service import reconstruir_vectores
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los vectores nutricionales que usan las sugerencias de alimentos (por ejemplo, tras una carga masiva).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, default=None, help='ID del usuario cuyos alimentos se recalculan')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = reconstruir_vectores(options['usuario'])
+        self.stdout.write(self.style.SUCCESS(f"{total} vectores nutricionales recalculados."))
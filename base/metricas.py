@@ -0,0 +1,162 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+
+from django.template.backends.django import DjangoTemplates, Template
+
+# Límites (en segundos) de los buckets de los histogramas, como los de los clientes de Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIJO = 'nutricion'
+# Métodos que se registran con su nombre; el resto se agrupa como OTHER para que un cliente no pueda crear series
+# sin límite enviando métodos inventados
+METODOS_HTTP = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'})
+
+# Medición de la solicitud en curso. Es un objeto mutable: sync_to_async copia el contexto al hilo en el que corren
+# las consultas de las vistas async, y lo que se acumula ahí se ve desde el middleware.
+_medicion = ContextVar('medicion', default=None)
+
+
+class Medicion:
+    __slots__ = ('inicio', 'consultas', 'sql', 'plantillas')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.sql = 0.0
+        self.plantillas = 0.0
+
+
+def iniciar_medicion():
+    medicion = Medicion()
+    return medicion, _medicion.set(medicion)
+
+
+def terminar_medicion(token):
+    _medicion.reset(token)
+
+
+# execute_wrapper que se instala en cada conexión (ver signals.py): suma las consultas y su duración a la medición
+# de la solicitud en curso. Fuera de una solicitud medida no hace nada más que ejecutar la consulta.
+def medir_consulta(execute, sql, params, many, context):
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.sql += time.perf_counter() - inicio
+        medicion.consultas += 1
+
+
+def instalar_en_conexion(conexion):
+    # connection_created se emite en cada reconexión del mismo wrapper (CONN_MAX_AGE): no instalar dos veces
+    if medir_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(medir_consulta)
+
+
+class _PlantillaMedida(Template):
+    def render(self, context=None, request=None):
+        medicion = _medicion.get()
+        if medicion is None:
+            return super().render(context, request)
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicion.plantillas += time.perf_counter() - inicio
+
+
+# Motor de plantillas de Django que mide el tiempo de render de cada plantilla pedida por una vista (render,
+# TemplateResponse). Los {% include %} y {% extends %} se resuelven dentro del motor y quedan incluidos en la
+# plantilla que los usa, sin contarse dos veces.
+class DjangoTemplatesMedidas(DjangoTemplates):
+    def from_string(self, template_code):
+        return _PlantillaMedida(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return _PlantillaMedida(super().get_template(template_name).template, self)
+
+
+class Histograma:
+    __slots__ = ('cuentas', 'suma', 'total')
+
+    def __init__(self):
+        self.cuentas = [0] * (len(BUCKETS) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect_left(BUCKETS, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+# Métricas acumuladas del proceso por (vista, método). Cada worker tiene las suyas: Prometheus las suma al
+# recolectar de todos.
+class RegistroMetricas:
+    def __init__(self):
+        self._lock = Lock()
+        self._series = {}
+
+    def registrar(self, vista, metodo, medicion, duracion):
+        if metodo not in METODOS_HTTP:
+            metodo = 'OTHER'
+        with self._lock:
+            serie = self._series.get((vista, metodo))
+            if serie is None:
+                serie = self._series[(vista, metodo)] = {
+                    'duracion': Histograma(), 'sql': Histograma(), 'plantillas': Histograma(), 'consultas': 0,
+                }
+            serie['duracion'].observar(duracion)
+            serie['sql'].observar(medicion.sql)
+            serie['plantillas'].observar(medicion.plantillas)
+            serie['consultas'] += medicion.consultas
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+
+    # Las métricas en el formato de texto de Prometheus (versión 0.0.4)
+    def exportar(self):
+        with self._lock:
+            series = {
+                clave: {
+                    nombre: (valor if isinstance(valor, int) else (list(valor.cuentas), valor.suma, valor.total))
+                    for nombre, valor in serie.items()
+                }
+                for clave, serie in self._series.items()
+            }
+        lineas = []
+        histogramas = [
+            ('duracion', 'solicitud_segundos', 'Duración de las solicitudes por vista.'),
+            ('sql', 'sql_segundos', 'Tiempo en consultas SQL por solicitud.'),
+            ('plantillas', 'plantillas_segundos', 'Tiempo de render de plantillas por solicitud.'),
+        ]
+        for campo, nombre, ayuda in histogramas:
+            metrica = f'{PREFIJO}_{nombre}'
+            lineas += [f'# HELP {metrica} {ayuda}', f'# TYPE {metrica} histogram']
+            for (vista, metodo), serie in sorted(series.items()):
+                cuentas, suma, total = serie[campo]
+                etiquetas = f'vista="{_escapar(vista)}",metodo="{_escapar(metodo)}"'
+                acumulado = 0
+                for limite, cuenta in zip(BUCKETS, cuentas):
+                    acumulado += cuenta
+                    lineas.append(f'{metrica}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+                lineas.append(f'{metrica}_bucket{{{etiquetas},le="+Inf"}} {total}')
+                lineas.append(f'{metrica}_sum{{{etiquetas}}} {suma}')
+                lineas.append(f'{metrica}_count{{{etiquetas}}} {total}')
+        metrica = f'{PREFIJO}_consultas_sql_total'
+        lineas += [f'# HELP {metrica} Consultas SQL ejecutadas por vista.', f'# TYPE {metrica} counter']
+        for (vista, metodo), serie in sorted(series.items()):
+            lineas.append(f'{metrica}{{vista="{_escapar(vista)}",metodo="{_escapar(metodo)}"}} {serie["consultas"]}')
+        return '\n'.join(lineas) + '\n'
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registro = RegistroMetricas()
+
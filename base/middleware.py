@@ -0,0 +1,248 @@
+import mimetypes
+import os
+import re
+import time
+import zlib
+from collections import namedtuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.middleware.gzip import GZipMiddleware
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import compress_string
+from django.views.static import was_modified_since
+
+from base.metricas import iniciar_medicion, registro, terminar_medicion
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+VISTA_SIN_RUTA = 'sin_ruta'
+
+# Respuestas más cortas no vale la pena comprimirlas
+LONGITUD_MINIMA_COMPRESION = 200
+NIVEL_GZIP = 6
+# Calidad de brotli para contenido dinámico: comprime mejor que gzip 6 a una velocidad parecida
+CALIDAD_BROTLI = 5
+TIPOS_COMPRIMIBLES = re.compile(r'^(text/|application/(json|javascript|xml|x-ndjson)|image/svg\+xml)')
+ACEPTA_BROTLI = re.compile(r'\bbr\b')
+ACEPTA_GZIP = re.compile(r'\bgzip\b')
+
+# Los nombres con hash nunca cambian de contenido: se pueden cachear un año sin volver a preguntar
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+Estatico = namedtuple('Estatico', ['ruta', 'tipo', 'modificado', 'variantes', 'inmutable'])
+
+
+# Mide cada solicitud: consultas SQL y su duración, render de plantillas y tiempo total. Lo devuelve en la cabecera
+# Server-Timing y lo acumula en los histogramas por vista de base/metricas.py (expuestos en /super/metricas/).
+# Funciona con vistas sync y async. En respuestas en streaming el total llega hasta que la vista devuelve la
+# respuesta, no hasta que se termina de enviar. Con METRICAS_ACTIVAS = False no se instala.
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICAS_ACTIVAS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        medicion, token = iniciar_medicion()
+        try:
+            response = self.get_response(request)
+        finally:
+            terminar_medicion(token)
+        return self.registrar(request, response, medicion)
+
+    async def __acall__(self, request):
+        medicion, token = iniciar_medicion()
+        try:
+            response = await self.get_response(request)
+        finally:
+            terminar_medicion(token)
+        return self.registrar(request, response, medicion)
+
+    def registrar(self, request, response, medicion):
+        duracion = time.perf_counter() - medicion.inicio
+        resolver_match = request.resolver_match
+        vista = resolver_match.view_name if resolver_match is not None else VISTA_SIN_RUTA
+        registro.registrar(vista, request.method, medicion, duracion)
+        response['Server-Timing'] = (
+            f'db;dur={medicion.sql * 1000:.1f};desc="{medicion.consultas} consultas", '
+            f'tpl;dur={medicion.plantillas * 1000:.1f}, '
+            f'total;dur={duracion * 1000:.1f}'
+        )
+        return response
+
+
+# Compresor incremental: (comprimir, vaciar, terminar). `vaciar` entrega lo comprimido hasta ahora sin cerrar el
+# flujo, para que cada fragmento de una respuesta en streaming llegue al cliente sin esperar al siguiente.
+def _compresor(codificacion):
+    if codificacion == 'br':
+        compresor = brotli.Compressor(quality=CALIDAD_BROTLI)
+        return compresor.process, compresor.flush, compresor.finish
+    compresor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compresor.compress, lambda: compresor.flush(zlib.Z_SYNC_FLUSH), compresor.flush
+
+
+def _comprimir_fragmentos(fragmentos, codificacion):
+    comprimir, vaciar, terminar = _compresor(codificacion)
+    for fragmento in fragmentos:
+        datos = comprimir(fragmento) + vaciar()
+        if datos:
+            yield datos
+    yield terminar()
+
+
+async def _acomprimir_fragmentos(fragmentos, codificacion):
+    comprimir, vaciar, terminar = _compresor(codificacion)
+    async for fragmento in fragmentos:
+        datos = comprimir(fragmento) + vaciar()
+        if datos:
+            yield datos
+    yield terminar()
+
+
+# Comprime las respuestas de texto (HTML, JSON, CSV, NDJSON...) con brotli si el cliente lo acepta y
+# COMPRESION_BROTLI está activo (requiere instalar brotli), o con gzip. Las respuestas en streaming se comprimen
+# fragmento a fragmento sin perder el envío progresivo. Las respuestas completas en gzip usan la misma mitigación
+# de BREACH que GZipMiddleware (nombre de archivo aleatorio en la cabecera).
+class CompresionMiddleware(GZipMiddleware):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.brotli = getattr(settings, 'COMPRESION_BROTLI', False)
+        if self.brotli and brotli is None:
+            raise ImproperlyConfigured('COMPRESION_BROTLI = True requiere instalar brotli')
+
+    def codificacion(self, request):
+        aceptadas = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if self.brotli and ACEPTA_BROTLI.search(aceptadas):
+            return 'br'
+        if ACEPTA_GZIP.search(aceptadas):
+            return 'gzip'
+        return None
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < LONGITUD_MINIMA_COMPRESION:
+            return response
+        if response.has_header('Content-Encoding') or not TIPOS_COMPRIMIBLES.match(response.get('Content-Type', '')):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        codificacion = self.codificacion(request)
+        if codificacion is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _acomprimir_fragmentos(response.streaming_content, codificacion)
+            else:
+                response.streaming_content = _comprimir_fragmentos(response.streaming_content, codificacion)
+            del response.headers['Content-Length']
+        else:
+            if codificacion == 'br':
+                comprimido = brotli.compress(response.content, quality=CALIDAD_BROTLI)
+            else:
+                comprimido = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+            if len(comprimido) >= len(response.content):
+                return response
+            response.content = comprimido
+            response.headers['Content-Length'] = str(len(comprimido))
+
+        # Un ETag fuerte no puede identificar otra representación: pasa a débil, como en GZipMiddleware
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = codificacion
+        return response
+
+
+# Sirve los archivos de STATIC_ROOT generados por collectstatic (base/storage.py) sin pasar por el resto de los
+# middlewares ni por las URLs. Elige la variante precomprimida (.br o .gz) que acepte el cliente. Los nombres con
+# hash del manifiesto se cachean como inmutables, así las recargas no vuelven a pedirlos; los nombres originales
+# usan ESTATICOS_MAX_AGE y responden 304 a If-Modified-Since. En desarrollo (DEBUG) no se instala: runserver sirve
+# los estáticos directamente desde las apps.
+class EstaticosMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DEBUG or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        self.prefijo = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else '/' + settings.STATIC_URL
+        self.raiz = settings.STATIC_ROOT
+        self.inmutables = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        self.max_age = getattr(settings, 'ESTATICOS_MAX_AGE', 60)
+        # Sólo se guardan los archivos encontrados: la cantidad está acotada por lo que hay en STATIC_ROOT
+        self.archivos = {}
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        return self.responder(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.responder(request) or await self.get_response(request)
+
+    def estatico(self, nombre):
+        estatico = self.archivos.get(nombre)
+        if estatico is not None:
+            return estatico
+        try:
+            ruta = safe_join(self.raiz, nombre)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(ruta):
+            return None
+        variantes = {
+            codificacion: ruta + extension
+            for codificacion, extension in (('br', '.br'), ('gzip', '.gz'))
+            if os.path.isfile(ruta + extension)
+        }
+        tipo = mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+        estatico = self.archivos[nombre] = Estatico(ruta, tipo, os.stat(ruta).st_mtime, variantes,
+                                                    nombre in self.inmutables)
+        return estatico
+
+    def responder(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefijo):
+            return None
+        estatico = self.estatico(request.path_info[len(self.prefijo):])
+        if estatico is None:
+            return None
+
+        if not estatico.inmutable and not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                                                             int(estatico.modificado)):
+            return HttpResponseNotModified()
+        aceptadas = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        codificacion = None
+        if 'br' in estatico.variantes and ACEPTA_BROTLI.search(aceptadas):
+            codificacion = 'br'
+        elif 'gzip' in estatico.variantes and ACEPTA_GZIP.search(aceptadas):
+            codificacion = 'gzip'
+
+        response = FileResponse(open(estatico.variantes.get(codificacion, estatico.ruta), 'rb'),
+                                content_type=estatico.tipo, filename=os.path.basename(estatico.ruta))
+        if codificacion:
+            response.headers['Content-Encoding'] = codificacion
+        if estatico.variantes:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        response.headers['Last-Modified'] = http_date(estatico.modificado)
+        response.headers['Cache-Control'] = CACHE_INMUTABLE if estatico.inmutable else f'public, max-age={self.max_age}'
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('calorias', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('proteinas', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('carbohidratos', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('grasas', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('micronutrientes', models.JSONField(default=dict)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ingestadiaria',
+            constraint=models.UniqueConstraint(fields=('usuario', 'fecha'), name='ingesta_diaria_usuario_fecha'),
+        ),
+    ]
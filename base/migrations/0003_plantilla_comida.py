@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_ingesta_diaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantillaComida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlantillaComidaAlimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('alimento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.alimento')),
+                ('plantilla', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='base.plantillacomida')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='plantillacomida',
+            name='alimentos',
+            field=models.ManyToManyField(through='base.PlantillaComidaAlimento', to='base.alimento'),
+        ),
+    ]
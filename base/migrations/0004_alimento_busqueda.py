@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Índice de texto completo FTS5 sobre Alimento.nombre y descripcion, con contenido externo (no duplica el texto)
+# y sincronizado por triggers, de modo que también cubre bulk_create, update() y eliminaciones en cascada.
+# unicode61 con remove_diacritics 2 hace la búsqueda insensible a mayúsculas y acentos; los índices de prefijo
+# de 2 a 8 caracteres resuelven el autocompletado sin combinar las listas de todos los términos con ese prefijo.
+CREAR = [
+    """
+    CREATE VIRTUAL TABLE base_alimento_busqueda USING fts5(
+        nombre, descripcion,
+        content='base_alimento', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6 7 8'
+    )
+    """,
+    """
+    CREATE TRIGGER base_alimento_busqueda_ai AFTER INSERT ON base_alimento BEGIN
+        INSERT INTO base_alimento_busqueda(rowid, nombre, descripcion)
+        VALUES (new.id, new.nombre, new.descripcion);
+    END
+    """,
+    """
+    CREATE TRIGGER base_alimento_busqueda_ad AFTER DELETE ON base_alimento BEGIN
+        INSERT INTO base_alimento_busqueda(base_alimento_busqueda, rowid, nombre, descripcion)
+        VALUES ('delete', old.id, old.nombre, old.descripcion);
+    END
+    """,
+    """
+    CREATE TRIGGER base_alimento_busqueda_au AFTER UPDATE OF nombre, descripcion ON base_alimento BEGIN
+        INSERT INTO base_alimento_busqueda(base_alimento_busqueda, rowid, nombre, descripcion)
+        VALUES ('delete', old.id, old.nombre, old.descripcion);
+        INSERT INTO base_alimento_busqueda(rowid, nombre, descripcion)
+        VALUES (new.id, new.nombre, new.descripcion);
+    END
+    """,
+    "INSERT INTO base_alimento_busqueda(base_alimento_busqueda) VALUES ('rebuild')",
+]
+
+ELIMINAR = [
+    'DROP TRIGGER IF EXISTS base_alimento_busqueda_ai',
+    'DROP TRIGGER IF EXISTS base_alimento_busqueda_ad',
+    'DROP TRIGGER IF EXISTS base_alimento_busqueda_au',
+    'DROP TABLE IF EXISTS base_alimento_busqueda',
+]
+
+
+def _ejecutar(sentencias):
+    def ejecutar(apps, schema_editor):
+        # En otros motores la búsqueda usa el respaldo con icontains de base/busqueda_service.py
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sentencia in sentencias:
+            schema_editor.execute(sentencia)
+    return ejecutar
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_plantilla_comida'),
+    ]
+
+    operations = [
+        migrations.RunPython(_ejecutar(CREAR), _ejecutar(ELIMINAR)),
+    ]
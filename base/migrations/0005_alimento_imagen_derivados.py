@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_alimento_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alimento',
+            name='imagen_derivados',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
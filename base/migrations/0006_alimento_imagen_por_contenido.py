@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:14
+
+import base.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_alimento_imagen_derivados'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alimento',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=base.storage.almacenamiento_imagenes, upload_to='alimentos_imagenes/'),
+        ),
+    ]
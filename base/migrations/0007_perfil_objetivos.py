@@ -0,0 +1,76 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+CAMPOS_OBJETIVOS = ['bmr', 'calorias_objetivo', 'proteinas_objetivo', 'carbohidratos_objetivo', 'grasas_objetivo',
+                    'version_formula']
+# Copia de las fórmulas de base/utils.py en su versión 1: la migración no debe cambiar si cambian las fórmulas (los
+# perfiles se ponen al día con `manage.py recalcular_objetivos`, que compara version_formula).
+VERSION_FORMULA = 1
+FACTORES_ACTIVIDAD = {'ligera': 1.375, 'moderada': 1.55, 'intensa': 1.725, 'muy intensa': 1.9}
+
+
+def _objetivos(perfil):
+    peso = float(perfil.peso)
+    altura = float(perfil.altura) * 100
+    bmr = (10 * peso) + (6.25 * altura) - (5 * perfil.edad) + (5 if perfil.sexo == 'Hombre' else -161)
+    bmr = round(bmr, 2)
+    calorias = bmr * FACTORES_ACTIVIDAD.get(perfil.nivel_actividad, 1.2)
+    return {
+        'bmr': bmr,
+        'calorias_objetivo': round(calorias, 2),
+        'proteinas_objetivo': round((calorias * 0.15) / 4, 2),
+        'carbohidratos_objetivo': round((calorias * 0.55) / 4, 2),
+        'grasas_objetivo': round((calorias * 0.3) / 9, 2),
+        'version_formula': VERSION_FORMULA,
+    }
+
+
+def calcular_objetivos_existentes(apps, schema_editor):
+    PerfilNutricional = apps.get_model('base', 'PerfilNutricional')
+    perfiles = list(PerfilNutricional.objects.all())
+    for perfil in perfiles:
+        for campo, valor in _objetivos(perfil).items():
+            setattr(perfil, campo, valor)
+    PerfilNutricional.objects.bulk_update(perfiles, CAMPOS_OBJETIVOS, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_alimento_imagen_por_contenido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilnutricional',
+            name='bmr',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='perfilnutricional',
+            name='calorias_objetivo',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='perfilnutricional',
+            name='carbohidratos_objetivo',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='perfilnutricional',
+            name='grasas_objetivo',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='perfilnutricional',
+            name='proteinas_objetivo',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='perfilnutricional',
+            name='version_formula',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_objetivos_existentes, migrations.RunPython.noop),
+    ]
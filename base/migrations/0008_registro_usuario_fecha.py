@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_perfil_objetivos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registrodiario',
+            index=models.Index(fields=['usuario', 'fecha'], name='registro_usuario_fecha'),
+        ),
+    ]
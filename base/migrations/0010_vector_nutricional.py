@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_trabajo_analisis'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorNutricional',
+            fields=[
+                ('alimento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vector', serialize=False, to='base.alimento')),
+                ('calorias', models.FloatField()),
+                ('proteinas', models.FloatField()),
+                ('carbohidratos', models.FloatField()),
+                ('grasas', models.FloatField()),
+                ('micronutrientes', models.JSONField(default=dict)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
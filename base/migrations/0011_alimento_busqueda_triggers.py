@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# 0005 y 0006 rehacen base_alimento en SQLite (AddField/AlterField copian la tabla) y con eso se pierden los triggers
+# de 0004: los alimentos creados o editados después no se indexaban. Se vuelven a crear y se reconstruye el índice.
+# El SQL se copia aquí (no se importa de base/busqueda_service.py) para que la migración no cambie si cambia el
+# código; base/signals.py además los repone tras cada migrate (asegurar_indice_busqueda).
+CREAR = [
+    """
+    CREATE TRIGGER IF NOT EXISTS base_alimento_busqueda_ai AFTER INSERT ON base_alimento BEGIN
+        INSERT INTO base_alimento_busqueda(rowid, nombre, descripcion)
+        VALUES (new.id, new.nombre, new.descripcion);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS base_alimento_busqueda_ad AFTER DELETE ON base_alimento BEGIN
+        INSERT INTO base_alimento_busqueda(base_alimento_busqueda, rowid, nombre, descripcion)
+        VALUES ('delete', old.id, old.nombre, old.descripcion);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS base_alimento_busqueda_au AFTER UPDATE OF nombre, descripcion ON base_alimento BEGIN
+        INSERT INTO base_alimento_busqueda(base_alimento_busqueda, rowid, nombre, descripcion)
+        VALUES ('delete', old.id, old.nombre, old.descripcion);
+        INSERT INTO base_alimento_busqueda(rowid, nombre, descripcion)
+        VALUES (new.id, new.nombre, new.descripcion);
+    END
+    """,
+    "INSERT INTO base_alimento_busqueda(base_alimento_busqueda) VALUES ('rebuild')",
+]
+
+
+def crear(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sentencia in CREAR:
+        schema_editor.execute(sentencia)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_vector_nutricional'),
+    ]
+
+    operations = [
+        # Al revertir no se eliminan: 0004 los necesita y 0005/0006 no los tocan al deshacerse
+        migrations.RunPython(crear, migrations.RunPython.noop),
+    ]
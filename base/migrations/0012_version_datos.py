@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_alimento_busqueda_triggers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDatos',
+            fields=[
+                ('ambito', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+                ('modificado', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:40
+
+from django.db import migrations
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+
+MACRONUTRIENTES = ['calorias', 'proteinas', 'carbohidratos', 'grasas']
+
+
+# Los macronutrientes de IngestaDiaria pasan a multiplicarse por la cantidad registrada, como los micronutrientes
+# (ver _ingestas en base/ingesta_service.py): se recalculan los totales guardados, usuario por usuario, con una
+# consulta agrupada por fecha y bulk_update. Las versiones de esos usuarios se incrementan para que no se sigan usando
+# los análisis y planes cacheados con los totales anteriores (copia fija de incrementar_versiones).
+def ponderar_por_cantidad(apps, schema_editor):
+    IngestaDiaria = apps.get_model('base', 'IngestaDiaria')
+    RegistroDiario = apps.get_model('base', 'RegistroDiario')
+    VersionDatos = apps.get_model('base', 'VersionDatos')
+
+    ahora = timezone.now()
+    usuarios = list(IngestaDiaria.objects.order_by('usuario_id').values_list('usuario_id', flat=True).distinct())
+    for usuario_id in usuarios:
+        totales = {
+            fila['fecha']: fila
+            for fila in RegistroDiario.objects.filter(usuario_id=usuario_id).values('fecha').annotate(**{
+                macro: Sum(F(f'alimento__{macro}') * F('cantidad'), output_field=DecimalField())
+                for macro in MACRONUTRIENTES
+            }).order_by()
+        }
+        ingestas = list(IngestaDiaria.objects.filter(usuario_id=usuario_id))
+        for ingesta in ingestas:
+            fila = totales.get(ingesta.fecha, {})
+            for macro in MACRONUTRIENTES:
+                setattr(ingesta, macro, fila.get(macro) or 0)
+        IngestaDiaria.objects.bulk_update(ingestas, MACRONUTRIENTES, batch_size=1000)
+
+        ambito = f'usuario:{usuario_id}'
+        VersionDatos.objects.bulk_create([VersionDatos(ambito=ambito, version=0, modificado=ahora)],
+                                         ignore_conflicts=True)
+        VersionDatos.objects.filter(ambito=ambito).update(version=F('version') + 1, modificado=ahora)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_version_datos'),
+    ]
+
+    operations = [
+        migrations.RunPython(ponderar_por_cantidad, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from datetime import date
 
+from base.storage import almacenamiento_imagenes
+
 NIVEL_ACTIVIDAD_CHOICES = [
     ('sedentario', 'Sedentario'),
     ('ligero', 'Ligero'),
@@ -22,6 +25,11 @@ class Nutriente(models.Model):
     def __str__(self):
         return self.nombre
 
+    def delete(self, *args, **kwargs):
+        from base.ingesta_service import diferir_recalculo
+        with transaction.atomic(), diferir_recalculo():
+            return super().delete(*args, **kwargs)
+
 class Alimento(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)  # Added this line to associate each food item with a user.
     nombre = models.CharField(max_length=255)
@@ -30,12 +38,26 @@ class Alimento(models.Model):
     carbohidratos = models.DecimalField(max_digits=6, decimal_places=2)
     grasas = models.DecimalField(max_digits=6, decimal_places=2)
     descripcion = models.TextField(null=True, blank=True)
-    imagen = models.ImageField(upload_to='alimentos_imagenes/', null=True, blank=True)
+    # Los archivos se guardan por su hash de contenido: subidas idénticas comparten un único archivo
+    imagen = models.ImageField(upload_to='alimentos_imagenes/', storage=almacenamiento_imagenes, null=True, blank=True)
+    # Miniaturas WebP/JPEG de la imagen generadas en segundo plano (ver imagenes_service)
+    imagen_derivados = models.JSONField(default=dict, blank=True, editable=False)
     nutrientes = models.ManyToManyField(Nutriente, through='AlimentoNutriente')  # Relación ManyToMany agregada
 
     def __str__(self):
         return self.nombre
 
+    def save(self, *args, **kwargs):
+        # Las señales que actualizan IngestaDiaria se ejecutan dentro de la misma transacción que el guardado
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # Los registros y nutrientes eliminados en cascada se recalculan una sola vez al final
+        from base.ingesta_service import diferir_recalculo
+        with transaction.atomic(), diferir_recalculo():
+            return super().delete(*args, **kwargs)
+
 # Modelo intermedio AlimentoNutriente
 class AlimentoNutriente(models.Model):
     alimento = models.ForeignKey(Alimento, on_delete=models.CASCADE)
@@ -46,6 +68,10 @@ class AlimentoNutriente(models.Model):
     def __str__(self):
         return f"{self.alimento.nombre} - {self.nutriente.nombre}"
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class PerfilNutricional(models.Model):
     usuario = models.OneToOneField(User, on_delete=models.CASCADE)
     edad = models.PositiveIntegerField()
@@ -53,17 +79,151 @@ class PerfilNutricional(models.Model):
     peso = models.DecimalField(max_digits=6, decimal_places=2)
     altura = models.DecimalField(max_digits=6, decimal_places=2)
     nivel_actividad = models.CharField(max_length=50, choices=NIVEL_ACTIVIDAD_CHOICES)
+    # Objetivos diarios calculados con base/utils.py al guardar el perfil, para usarlos directamente en consultas SQL
+    bmr = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
+    calorias_objetivo = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False, db_index=True)
+    proteinas_objetivo = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
+    carbohidratos_objetivo = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
+    grasas_objetivo = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False)
+    version_formula = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    CAMPOS_OBJETIVOS = ['bmr', 'calorias_objetivo', 'proteinas_objetivo', 'carbohidratos_objetivo', 'grasas_objetivo',
+                        'version_formula']
 
     def __str__(self):
         return self.usuario.username
 
+    def actualizar_objetivos(self):
+        from base.utils import calcular_objetivos
+        for campo, valor in calcular_objetivos(self).items():
+            setattr(self, campo, valor)
+
+    def save(self, *args, **kwargs):
+        self.actualizar_objetivos()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(self.CAMPOS_OBJETIVOS)
+        super().save(*args, **kwargs)
+
+    # Necesidades diarias guardadas, en el formato de calcular_necesidades_nutricionales.
+    def necesidades_nutricionales(self):
+        return {
+            'calorias': float(self.calorias_objetivo),
+            'proteinas': float(self.proteinas_objetivo),
+            'carbohidratos': float(self.carbohidratos_objetivo),
+            'grasas': float(self.grasas_objetivo),
+        }
+
 class RegistroDiario(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     alimento = models.ForeignKey(Alimento, on_delete=models.CASCADE)
     fecha = models.DateField(auto_now_add=True)
     cantidad = models.DecimalField(max_digits=6, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Historial por usuario ordenado por fecha (reporte de excesos, exportaciones, ingestas por día)
+            models.Index(fields=['usuario', 'fecha'], name='registro_usuario_fecha'),
+        ]
+
     def __str__(self):
         return f"{self.usuario.username} - {self.alimento.nombre} - {self.fecha}"
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+# Totales diarios de ingesta por usuario, mantenidos por las señales de base/signals.py cada vez que cambia un
+# RegistroDiario, un Alimento o sus nutrientes. Permite obtener el análisis del día con una sola consulta.
+class IngestaDiaria(models.Model):
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    calorias = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    proteinas = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    carbohidratos = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    grasas = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    micronutrientes = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'fecha'], name='ingesta_diaria_usuario_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.fecha}"
+
+# Vector nutricional precalculado de un alimento (ver base/recomendacion_service.py): macronutrientes y la suma de
+# cada micronutriente por nombre en una sola fila, para puntuar alimentos sin unir AlimentoNutriente en cada pedido.
+# Se elimina cuando cambia el alimento o sus nutrientes y se vuelve a calcular al confirmarse el cambio (o en la
+# siguiente recomendación que lo necesite).
+class VectorNutricional(models.Model):
+    alimento = models.OneToOneField(Alimento, on_delete=models.CASCADE, primary_key=True, related_name='vector')
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    calorias = models.FloatField()
+    proteinas = models.FloatField()
+    carbohidratos = models.FloatField()
+    grasas = models.FloatField()
+    micronutrientes = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"Vector de {self.alimento_id}"
 
+# Comida guardada por el usuario (por ejemplo, "Desayuno habitual") para registrar varios alimentos de una vez.
+class PlantillaComida(models.Model):
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    nombre = models.CharField(max_length=255)
+    alimentos = models.ManyToManyField(Alimento, through='PlantillaComidaAlimento')
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.nombre}"
+
+class PlantillaComidaAlimento(models.Model):
+    plantilla = models.ForeignKey(PlantillaComida, on_delete=models.CASCADE, related_name='items')
+    alimento = models.ForeignKey(Alimento, on_delete=models.CASCADE)
+    cantidad = models.DecimalField(max_digits=6, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.plantilla.nombre} - {self.alimento.nombre}"
+
+ESTADO_TRABAJO_CHOICES = [
+    ('pendiente', 'Pendiente'),
+    ('en_curso', 'En curso'),
+    ('completado', 'Completado'),
+    ('error', 'Error'),
+    ('cancelado', 'Cancelado'),
+]
+ESTADOS_TRABAJO_ACTIVOS = ['pendiente', 'en_curso']
+
+# Trabajo en segundo plano (ver base/trabajos_service.py): guarda la tarea pedida, sus parámetros, su estado y el
+# resultado en JSON. `clave` identifica tarea + parámetros: sólo puede haber un trabajo activo por clave, así que
+# pedidos idénticos simultáneos comparten el mismo trabajo.
+class TrabajoAnalisis(models.Model):
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict)
+    clave = models.CharField(max_length=64, db_index=True)
+    estado = models.CharField(max_length=20, choices=ESTADO_TRABAJO_CHOICES, default='pendiente')
+    resultado = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    solicitado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['clave'], condition=models.Q(estado__in=ESTADOS_TRABAJO_ACTIVOS),
+                                    name='trabajo_activo_por_clave'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.estado})"
+
+# Contador de versión de un ámbito de datos (ver base/versiones.py): `version` se incrementa con cada cambio y
+# `modificado` guarda cuándo. En la base, y no en la caché del proceso, para que todos los workers vean los mismos
+# valores. Un ámbito sin fila todavía no cambió.
+class VersionDatos(models.Model):
+    ambito = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    modificado = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.ambito} v{self.version}"
@@ -0,0 +1,121 @@
+import heapq
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+
+from base.models import Alimento
+from base.recomendacion_service import aporte, deficits, vectores_de_usuario
+from base.versiones import AMBITO_CATALOGO, ambito_usuario, versiones
+
+ALIMENTOS_POR_PLAN = 5
+MAXIMO_ALIMENTOS_POR_PLAN = 10
+# Las cantidades se eligen en pasos de media porción, hasta PORCIONES_MAXIMAS por alimento
+PASO_PORCION = 0.5
+PORCIONES_MAXIMAS = 3
+# Margen sobre las calorías que le faltan al usuario que el plan puede usar
+TOLERANCIA_CALORIAS = 1.05
+
+
+# Ganancia de agregar un paso de porción de un alimento con los aportes indicados (por componente, en el orden de
+# `pendientes`): fracción de cada necesidad pendiente que cubre, sin contar lo que exceda lo que falta.
+def _ganancia(aportes, pendientes, necesidades):
+    return sum(min(cantidad * PASO_PORCION, pendiente) / necesidad
+               for cantidad, pendiente, necesidad in zip(aportes, pendientes, necesidades) if pendiente > 0)
+
+
+# Elige cantidades de los alimentos (vectores) para cubrir lo pendiente ({componente: (déficit, necesidad)}) sin
+# pasar de `calorias_maximas`. Búsqueda voraz: en cada paso agrega media porción del alimento que más cubre.
+# Los aportes de cada alimento se leen una sola vez en tuplas ordenadas por componente. Como lo pendiente sólo
+# disminuye, la ganancia de un alimento nunca aumenta: se guardan en un heap con la última ganancia calculada y sólo
+# se recalcula la del primero; si sigue siendo la mayor es el mejor sin mirar al resto (evaluación perezosa). Los
+# que ya no aportan, no caben en las calorías restantes o alcanzaron su máximo se descartan para siempre, y al
+# completar `max_alimentos` sólo quedan los ya elegidos (poda).
+# Se detiene al no haber mejoras, al completar `max_alimentos` con porciones máximas o al agotar `tiempo_maximo`
+# segundos; en ese caso `completo` es False.
+def resolver_plan(vectores, faltantes, calorias_maximas, max_alimentos, tiempo_maximo):
+    limite = time.perf_counter() + tiempo_maximo
+    componentes = list(faltantes)
+    pendientes = [faltantes[componente][0] for componente in componentes]
+    necesidades = [faltantes[componente][1] for componente in componentes]
+    cantidades = {}
+    heap = []
+    for vector in vectores:
+        aportes = tuple(aporte(vector, componente) for componente in componentes)
+        ganancia = _ganancia(aportes, pendientes, necesidades)
+        if ganancia > 0:
+            heap.append((-ganancia, vector.alimento_id, vector.calorias, aportes))
+    heapq.heapify(heap)
+
+    while heap and any(pendiente > 0 for pendiente in pendientes):
+        if time.perf_counter() > limite:
+            return cantidades, False
+        _, alimento_id, calorias, aportes = heapq.heappop(heap)
+        cantidad = cantidades.get(alimento_id, 0)
+        if not cantidad and len(cantidades) >= max_alimentos:
+            continue
+        if cantidad + PASO_PORCION > PORCIONES_MAXIMAS or calorias * PASO_PORCION > calorias_maximas:
+            continue
+        ganancia = _ganancia(aportes, pendientes, necesidades)
+        if ganancia <= 0:
+            continue
+        if heap and ganancia < -heap[0][0]:
+            heapq.heappush(heap, (-ganancia, alimento_id, calorias, aportes))
+            continue
+
+        cantidades[alimento_id] = cantidad + PASO_PORCION
+        calorias_maximas -= calorias * PASO_PORCION
+        pendientes = [pendiente - cantidad_aporte * PASO_PORCION
+                      for pendiente, cantidad_aporte in zip(pendientes, aportes)]
+        heapq.heappush(heap, (-ganancia, alimento_id, calorias, aportes))
+        if not cantidad and len(cantidades) == max_alimentos:
+            heap = [entrada for entrada in heap if entrada[1] in cantidades]
+            heapq.heapify(heap)
+    return cantidades, True
+
+
+# Plan de comidas para cubrir lo que le falta hoy al usuario (calorías, macronutrientes y micronutrientes de
+# NECESIDADES_MICRONUTRIENTES_ESPECIFICOS) con alimentos de su catálogo. El resultado se cachea con la versión de
+# los datos del usuario y del catálogo de nutrientes (base/versiones.py): se reutiliza hasta que cambia su diario,
+# su perfil o sus alimentos.
+def plan_de_comidas(usuario, analisis, necesidades, max_alimentos=ALIMENTOS_POR_PLAN):
+    version_usuario, version_catalogo = versiones(ambito_usuario(usuario.id), AMBITO_CATALOGO)
+    clave = f'plan_comidas:{usuario.id}:{version_usuario}:{version_catalogo}:{date.today()}:{max_alimentos}'
+    plan = cache.get(clave)
+    if plan is None:
+        plan = _calcular_plan(usuario, analisis, necesidades, max_alimentos)
+        cache.set(clave, plan, getattr(settings, 'PLAN_COMIDAS_CACHE_TIMEOUT', 3600))
+    return plan
+
+
+def _calcular_plan(usuario, analisis, necesidades, max_alimentos):
+    faltantes = deficits(analisis, necesidades)
+    calorias_restantes = necesidades['calorias'] - analisis['calorias_consumidas']
+    if calorias_restantes > 0:
+        faltantes['calorias'] = (calorias_restantes, necesidades['calorias'])
+
+    vectores = {vector.alimento_id: vector for vector in vectores_de_usuario(usuario)}
+    inicio = time.perf_counter()
+    cantidades, completo = resolver_plan(
+        vectores.values(), faltantes, max(calorias_restantes, 0) * TOLERANCIA_CALORIAS, max_alimentos,
+        getattr(settings, 'PLAN_COMIDAS_TIEMPO_MAXIMO', 0.2),
+    )
+    milisegundos = round((time.perf_counter() - inicio) * 1000, 2)
+
+    nombres = dict(Alimento.objects.filter(id__in=list(cantidades)).values_list('id', 'nombre'))
+    aportado = {
+        componente: round(sum(aporte(vectores[alimento_id], componente) * cantidad
+                              for alimento_id, cantidad in cantidades.items()), 2)
+        for componente in faltantes
+    }
+    return {
+        'items': [
+            {'alimento': alimento_id, 'nombre': nombres.get(alimento_id), 'cantidad': cantidad}
+            for alimento_id, cantidad in cantidades.items()
+        ],
+        'faltante': {componente: round(deficit, 2) for componente, (deficit, _) in faltantes.items()},
+        'aportado': aportado,
+        'completo': completo,
+        'milisegundos': milisegundos,
+    }
@@ -0,0 +1,130 @@
+import heapq
+
+from django.db import transaction
+from django.db.models import F, Prefetch, Sum
+
+from base.catalogo_nutrientes import catalogo_nutrientes
+from base.cohortes import MACRONUTRIENTES
+from base.models import Alimento, AlimentoNutriente, VectorNutricional
+from base.utils import NECESIDADES_MICRONUTRIENTES_ESPECIFICOS
+
+SUGERENCIAS_POR_PEDIDO = 5
+# Alimentos por consulta al recalcular vectores (límite de parámetros de SQLite)
+ALIMENTOS_POR_LOTE = 500
+# Macronutrientes que se buscan cubrir; las calorías sólo penalizan lo que exceda el déficit
+MACROS_DEFICIT = ['proteinas', 'carbohidratos', 'grasas']
+
+
+def _vectores(alimento_ids):
+    alimentos = Alimento.objects.filter(id__in=alimento_ids).values_list('id', 'usuario_id', *MACRONUTRIENTES)
+    micronutrientes = {}
+    filas = AlimentoNutriente.objects.filter(alimento_id__in=alimento_ids).values(
+        'alimento_id', 'nutriente_id'
+    ).annotate(total=Sum('cantidad')).order_by().values_list('alimento_id', 'nutriente_id', 'total')
+    for alimento_id, nutriente_id, total in filas:
+        micronutrientes.setdefault(alimento_id, {})[nutriente_id] = float(total)
+    micronutrientes = {alimento_id: catalogo_nutrientes.por_nombre(por_id)
+                       for alimento_id, por_id in micronutrientes.items()}
+    return [
+        VectorNutricional(
+            alimento_id=alimento_id, usuario_id=usuario_id, micronutrientes=micronutrientes.get(alimento_id, {}),
+            **{macro: float(valor) for macro, valor in zip(MACRONUTRIENTES, macros)}
+        )
+        for alimento_id, usuario_id, *macros in alimentos
+    ]
+
+
+# Calcula (o recalcula) los vectores de los alimentos indicados con dos consultas y un upsert por lote de
+# ALIMENTOS_POR_LOTE. Los ids de alimentos que ya no existen se ignoran. Devuelve los vectores guardados.
+def actualizar_vectores(alimento_ids):
+    alimento_ids = list(alimento_ids)
+    guardados = []
+    for inicio in range(0, len(alimento_ids), ALIMENTOS_POR_LOTE):
+        vectores = _vectores(alimento_ids[inicio:inicio + ALIMENTOS_POR_LOTE])
+        VectorNutricional.objects.bulk_create(
+            vectores, update_conflicts=True, unique_fields=['alimento'],
+            update_fields=['usuario', 'micronutrientes', *MACRONUTRIENTES],
+        )
+        guardados += vectores
+    return guardados
+
+
+# Invalida los vectores de los alimentos indicados y programa su recálculo para cuando se confirme la transacción.
+# El borrado inmediato nunca deja un vector desactualizado (ni uno que apunte a un alimento que se está eliminando
+# en cascada); si el recálculo no llega a ejecutarse, recomendar_alimentos lo hace la próxima vez que lo necesite.
+def invalidar_vectores(alimento_ids):
+    alimento_ids = list(alimento_ids)
+    VectorNutricional.objects.filter(alimento_id__in=alimento_ids).delete()
+    programar_vectores(alimento_ids)
+
+
+def programar_vectores(alimento_ids):
+    alimento_ids = list(alimento_ids)
+    transaction.on_commit(lambda: actualizar_vectores(alimento_ids))
+
+
+def reconstruir_vectores(usuario_id=None):
+    alimentos = Alimento.objects.all()
+    if usuario_id is not None:
+        alimentos = alimentos.filter(usuario_id=usuario_id)
+    return len(actualizar_vectores(alimentos.order_by('id').values_list('id', flat=True)))
+
+
+# Vectores de todos los alimentos del usuario, recalculando antes los que estén invalidados.
+def vectores_de_usuario(usuario):
+    vectores = list(VectorNutricional.objects.filter(usuario=usuario))
+    faltan = list(Alimento.objects.filter(usuario=usuario, vector__isnull=True).values_list('id', flat=True))
+    if faltan:
+        vectores += actualizar_vectores(faltan)
+    return vectores
+
+
+# Lo que le falta al usuario para cubrir sus necesidades del día, con la necesidad de cada componente para
+# normalizar: {componente: (déficit, necesidad)}. Sólo incluye los componentes con déficit.
+def deficits(analisis, necesidades):
+    faltantes = {}
+    for macro in MACROS_DEFICIT:
+        deficit = necesidades[macro] - analisis[f'{macro}_consumidas']
+        if deficit > 0:
+            faltantes[macro] = (deficit, necesidades[macro])
+    consumidos = analisis['micronutrientes_consumidos']
+    for nombre, necesidad in NECESIDADES_MICRONUTRIENTES_ESPECIFICOS.items():
+        deficit = necesidad - consumidos.get(nombre, 0)
+        if deficit > 0:
+            faltantes[nombre] = (deficit, necesidad)
+    return faltantes
+
+
+# Cantidad de un componente (macronutriente, calorías o micronutriente por nombre) en una porción del alimento.
+def aporte(vector, componente):
+    if componente in MACRONUTRIENTES:
+        return getattr(vector, componente)
+    return vector.micronutrientes.get(componente, 0)
+
+
+# Puntaje de un alimento (una porción) frente a los déficits: suma de la fracción de cada necesidad que cubre, sin
+# contar lo que exceda el déficit, menos la fracción de calorías que supere las que aún le faltan al usuario.
+def puntaje(vector, faltantes, calorias_restantes, calorias_necesarias):
+    cubierto = 0.0
+    for componente, (deficit, necesidad) in faltantes.items():
+        cubierto += min(aporte(vector, componente), deficit) / necesidad
+    exceso = max(vector.calorias - calorias_restantes, 0)
+    return cubierto - exceso / calorias_necesarias if calorias_necesarias else cubierto
+
+
+# Los `k` alimentos del usuario que mejor cubren sus déficits del día, con sus nutrientes precargados. Lee los
+# vectores precalculados del usuario (recalculando antes los que estén invalidados) y elige los k mejores con un heap
+# acotado en vez de ordenar todos los candidatos.
+def recomendar_alimentos(usuario, analisis, necesidades, k=SUGERENCIAS_POR_PEDIDO):
+    vectores = vectores_de_usuario(usuario)
+    faltantes = deficits(analisis, necesidades)
+    calorias_restantes = max(necesidades['calorias'] - analisis['calorias_consumidas'], 0)
+    mejores = heapq.nlargest(
+        k, vectores, key=lambda vector: puntaje(vector, faltantes, calorias_restantes, necesidades['calorias'])
+    )
+    orden = [vector.alimento_id for vector in mejores]
+    alimentos = Alimento.objects.filter(id__in=orden).prefetch_related(
+        Prefetch('alimentonutriente_set', queryset=AlimentoNutriente.objects.select_related('nutriente'))
+    )
+    por_id = {alimento.id: alimento for alimento in alimentos}
+    return [por_id[alimento_id] for alimento_id in orden if alimento_id in por_id]
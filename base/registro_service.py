@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.db import transaction
+
+from base.ingesta_service import recalcular_ingesta
+from base.models import IngestaDiaria, RegistroDiario
+from base.versiones import ambito_usuario, incrementar_al_confirmar
+
+
+# Registra en una sola transacción todos los alimentos de una comida (lista de (alimento_id, cantidad)) con un único
+# bulk_create, y recalcula una sola vez los totales del día. Devuelve el IngestaDiaria actualizado.
+# La propiedad de los alimentos debe validarse antes (ver RegistroComidaSerializer).
+def registrar_comida(usuario, items):
+    with transaction.atomic():
+        RegistroDiario.objects.bulk_create([
+            RegistroDiario(usuario=usuario, alimento_id=alimento_id, cantidad=cantidad)
+            for alimento_id, cantidad in items
+        ])
+        # bulk_create no envía señales, por eso el total del día y la versión se actualizan explícitamente
+        recalcular_ingesta(usuario.id, date.today())
+        incrementar_al_confirmar(ambito_usuario(usuario.id))
+    return IngestaDiaria.objects.filter(usuario=usuario, fecha=date.today()).first()
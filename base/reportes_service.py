@@ -0,0 +1,48 @@
+from django.db.models import DecimalField, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from base.basedatos import lecturas_analiticas
+from base.models import RegistroDiario
+
+# Límite diario de calorías del reporte de excesos para usuarios que aún no tienen perfil nutricional
+LIMITE_CALORIAS_SIN_PERFIL = 2000
+EXCESOS_POR_PAGINA = 50
+
+
+# Días en que cada usuario superó su objetivo de calorías, en una sola consulta agrupada por (usuario, fecha) con un
+# HAVING contra el objetivo guardado en su perfil (o LIMITE_CALORIAS_SIN_PERFIL si aún no tiene perfil).
+# El nombre de usuario y el límite son iguales en todo el grupo: se leen con Max para que el GROUP BY quede sólo en
+# (usuario_id, fecha) y lo resuelva el índice registro_usuario_fecha, sin ordenar todo el historial.
+def consultar_excesos(desde=None, hasta=None, usuario=None):
+    registros = RegistroDiario.objects.all()
+    if desde:
+        registros = registros.filter(fecha__gte=desde)
+    if hasta:
+        registros = registros.filter(fecha__lte=hasta)
+    if usuario is not None:
+        registros = registros.filter(usuario=usuario)
+    return registros.values('usuario_id', 'fecha').annotate(
+        usuario__username=Max('usuario__username'),
+        total_calorias=Sum(F('alimento__calorias') * F('cantidad'), output_field=DecimalField()),
+        limite_calorias=Max(Coalesce('usuario__perfilnutricional__calorias_objetivo',
+                                     Value(LIMITE_CALORIAS_SIN_PERFIL), output_field=DecimalField())),
+    ).filter(total_calorias__gt=F('limite_calorias')).order_by('usuario_id', 'fecha')
+
+
+# Cursor de la página siguiente: el último (usuario_id, fecha) mostrado, como "usuario_id:AAAA-MM-DD".
+def cursor_exceso(exceso):
+    return f"{exceso['usuario_id']}:{exceso['fecha'].isoformat()}"
+
+
+# Página de excesos por keyset sobre (usuario_id, fecha): en vez de OFFSET, la página continúa después del último
+# grupo de la anterior (`despues`, una tupla (usuario_id, fecha)), así el costo de cada página no depende de
+# cuántas se hayan recorrido. Devuelve los excesos de la página y el cursor de la siguiente (o None si es la última).
+# Se lee de la réplica de análisis.
+@lecturas_analiticas()
+def pagina_excesos(excesos, despues=None, tamano=EXCESOS_POR_PAGINA):
+    if despues is not None:
+        usuario_id, fecha = despues
+        excesos = excesos.filter(Q(usuario_id__gt=usuario_id) | Q(usuario_id=usuario_id, fecha__gt=fecha))
+    pagina = list(excesos[:tamano + 1])
+    siguiente = cursor_exceso(pagina[tamano - 1]) if len(pagina) > tamano else None
+    return pagina[:tamano], siguiente
@@ -1,14 +1,131 @@
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
-from .models import Alimento, Nutriente
+from rest_framework.permissions import SAFE_METHODS
+from .imagenes_service import FORMATOS, tamanos_vigentes
+from .models import Alimento, AlimentoNutriente, Nutriente, IngestaDiaria, PlantillaComida, PlantillaComidaAlimento
+
+# Devuelve los campos pedidos con ?fields=a,b,c, o None si no se restringieron. Sólo se aplica a lecturas: en una
+# escritura quitaría campos obligatorios del serializer y se guardaría el modelo sin ellos.
+def campos_solicitados(request):
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return {campo.strip() for campo in fields.split(',') if campo.strip()}
+
+# Permite pedir sólo algunos campos con ?fields=id,nombre (sparse fieldsets). Los campos no pedidos no se serializan.
+class CamposDinamicosMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        campos = campos_solicitados(self.context.get('request'))
+        if campos is not None:
+            for campo in set(self.fields) - campos:
+                self.fields.pop(campo)
 
 class NutrienteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Nutriente
         fields = '__all__'
 
-class AlimentoSerializer(serializers.ModelSerializer):
-    nutrientes = NutrienteSerializer(many=True, read_only=True)
+# Nutriente de un alimento con la cantidad y la unidad guardadas en AlimentoNutriente.
+class AlimentoNutrienteSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='nutriente.id')
+    nombre = serializers.CharField(source='nutriente.nombre')
+    tipo = serializers.CharField(source='nutriente.tipo')
+
+    class Meta:
+        model = AlimentoNutriente
+        fields = ['id', 'nombre', 'tipo', 'cantidad', 'unidad']
+
+class AlimentoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    nutrientes = AlimentoNutrienteSerializer(source='alimentonutriente_set', many=True, read_only=True)
+    imagenes = serializers.SerializerMethodField()
 
     class Meta:
         model = Alimento
-        fields = '__all__'
+        exclude = ['imagen_derivados']
+        read_only_fields = ['usuario']
+
+    # URLs de las miniaturas por formato y altura, p. ej. {'webp': {'50': url, '100': url, '400': url}, 'jpeg': {...}}.
+    # Vacío mientras no se hayan generado; la imagen original sigue en el campo imagen.
+    def get_imagenes(self, alimento):
+        tamanos = tamanos_vigentes(alimento)
+        request = self.context.get('request')
+        imagenes = {}
+        for formato in FORMATOS:
+            for altura, tamano in tamanos.items():
+                url = default_storage.url(tamano[formato])
+                imagenes.setdefault(formato, {})[altura] = request.build_absolute_uri(url) if request else url
+        return imagenes
+
+class IngestaDiariaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestaDiaria
+        fields = ['fecha', 'calorias', 'proteinas', 'carbohidratos', 'grasas', 'micronutrientes']
+
+# Un alimento de una comida. El alimento se recibe como id y su propiedad se valida para toda la lista
+# con una sola consulta en validar_alimentos_del_usuario.
+class ItemComidaSerializer(serializers.Serializer):
+    alimento = serializers.IntegerField()
+    # Una cantidad de 0 crearía un registro vacío
+    cantidad = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal('0.01'))
+
+def validar_alimentos_del_usuario(items, usuario):
+    ids = {item['alimento'] for item in items}
+    propios = set(Alimento.objects.filter(usuario=usuario, id__in=ids).values_list('id', flat=True))
+    ajenos = sorted(ids - propios)
+    if ajenos:
+        raise serializers.ValidationError(f"Alimentos inexistentes o de otro usuario: {ajenos}")
+    return items
+
+class RegistroComidaSerializer(serializers.Serializer):
+    items = ItemComidaSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_items(self, items):
+        return validar_alimentos_del_usuario(items, self.context['request'].user)
+
+class PlantillaComidaSerializer(serializers.ModelSerializer):
+    items = ItemComidaSerializer(many=True, allow_empty=False, max_length=100)
+
+    class Meta:
+        model = PlantillaComida
+        fields = ['id', 'nombre', 'items']
+
+    def validate_items(self, items):
+        return validar_alimentos_del_usuario(items, self.context['request'].user)
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'nombre': instance.nombre,
+            'items': [
+                {'alimento': item.alimento_id, 'cantidad': str(item.cantidad)} for item in instance.items.all()
+            ],
+        }
+
+    def _guardar_items(self, plantilla, items):
+        PlantillaComidaAlimento.objects.bulk_create([
+            PlantillaComidaAlimento(plantilla=plantilla, alimento_id=item['alimento'], cantidad=item['cantidad'])
+            for item in items
+        ])
+
+    @transaction.atomic
+    def create(self, validated_data):
+        items = validated_data.pop('items')
+        plantilla = PlantillaComida.objects.create(usuario=self.context['request'].user, **validated_data)
+        self._guardar_items(plantilla, items)
+        return plantilla
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        items = validated_data.pop('items', None)
+        instance.nombre = validated_data.get('nombre', instance.nombre)
+        instance.save()
+        if items is not None:
+            instance.items.all().delete()
+            self._guardar_items(instance, items)
+        return instance
@@ -0,0 +1,243 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from base.basedatos import configurar_sqlite
+from base.busqueda_service import asegurar_indice
+from base.catalogo_nutrientes import catalogo_nutrientes
+from base.imagenes_service import (
+    liberar_derivados, liberar_imagen, necesita_derivados, programar_derivados, rutas_derivados,
+)
+
+from base.ingesta_service import (
+    recalcular_ingesta, recalcular_ingestas, recalcular_ingestas_de_alimento, recalcular_ingestas_de_nutriente,
+)
+from base.metricas import instalar_en_conexion
+from base.models import Alimento, AlimentoNutriente, Nutriente, PerfilNutricional, RegistroDiario
+from base.recomendacion_service import invalidar_vectores, programar_vectores
+from base.versiones import (AMBITO_ALIMENTOS, AMBITO_CATALOGO, ambito_usuario, incrementar_al_confirmar,
+                            incrementar_versiones)
+
+
+# Mantenimiento de IngestaDiaria: cada cambio en un registro, un alimento o sus nutrientes recalcula
+# los totales de los días afectados dentro de la misma transacción.
+
+@receiver(pre_save, sender=RegistroDiario)
+def recordar_clave_anterior_registro(sender, instance, raw=False, **kwargs):
+    instance._clave_ingesta_anterior = None
+    if not raw and instance.pk and not instance._state.adding:
+        instance._clave_ingesta_anterior = RegistroDiario.objects.filter(pk=instance.pk).values_list(
+            'usuario_id', 'fecha'
+        ).first()
+
+
+@receiver(post_save, sender=RegistroDiario)
+def actualizar_ingesta_registro(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    clave_anterior = getattr(instance, '_clave_ingesta_anterior', None)
+    if clave_anterior and clave_anterior != (instance.usuario_id, instance.fecha):
+        recalcular_ingesta(*clave_anterior)
+    recalcular_ingesta(instance.usuario_id, instance.fecha)
+
+
+def _eliminado_con_usuario(origin):
+    return getattr(origin, 'model', type(origin)) is User
+
+
+@receiver(post_delete, sender=RegistroDiario)
+def actualizar_ingesta_registro_eliminado(sender, instance, origin=None, **kwargs):
+    if not _eliminado_con_usuario(origin):
+        recalcular_ingesta(instance.usuario_id, instance.fecha)
+
+
+@receiver(post_save, sender=Alimento)
+def actualizar_ingestas_alimento(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        recalcular_ingestas_de_alimento(instance.pk)
+
+
+@receiver(post_save, sender=AlimentoNutriente)
+@receiver(post_delete, sender=AlimentoNutriente)
+def actualizar_ingestas_alimento_nutriente(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _eliminado_con_usuario(origin):
+        recalcular_ingestas_de_alimento(instance.alimento_id)
+
+
+# Al eliminar un usuario sus IngestaDiaria se eliminan en cascada, así que los registros y nutrientes eliminados con él
+# no se recalculan uno por uno. Sólo cambian los días de otros usuarios que registraron alimentos suyos: se buscan
+# antes de eliminar y se recalculan juntos al final (post_delete del usuario llega después del de sus dependientes).
+@receiver(pre_delete, sender=User)
+def recordar_ingestas_de_otros_usuarios(sender, instance, **kwargs):
+    instance._claves_ingesta_cascada = set(
+        RegistroDiario.objects.filter(alimento__usuario_id=instance.pk).exclude(usuario_id=instance.pk).values_list(
+            'usuario_id', 'fecha'
+        ).distinct()
+    )
+
+
+@receiver(post_delete, sender=User)
+def actualizar_ingestas_usuario_eliminado(sender, instance, **kwargs):
+    recalcular_ingestas(getattr(instance, '_claves_ingesta_cascada', ()))
+
+
+@receiver(post_save, sender=Nutriente)
+def actualizar_ingestas_nutriente(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        # Los micronutrientes se guardan por nombre: el catálogo en memoria se descarta antes de recalcular, sin
+        # esperar a versionar_catalogo (registrado después), para que un cambio de nombre ya use el nombre nuevo.
+        catalogo_nutrientes.invalidar()
+        recalcular_ingestas_de_nutriente(instance.pk)
+
+
+# Vectores nutricionales de las sugerencias: cada cambio en un alimento, sus nutrientes o el nombre de un nutriente
+# invalida los vectores afectados (se recalculan al confirmarse el cambio).
+
+@receiver(post_save, sender=Alimento)
+def invalidar_vector_alimento(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        programar_vectores([instance.pk])
+    else:
+        invalidar_vectores([instance.pk])
+
+
+@receiver(post_save, sender=AlimentoNutriente)
+def invalidar_vector_alimento_nutriente(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidar_vectores([instance.alimento_id])
+
+
+@receiver(post_delete, sender=AlimentoNutriente)
+def invalidar_vector_alimento_nutriente_eliminado(sender, instance, origin=None, **kwargs):
+    # Las eliminaciones en cascada se invalidan de una vez: las de un nutriente en pre_delete de Nutriente, y las de
+    # un alimento (o su usuario) no lo necesitan porque el vector se elimina con el alimento
+    if getattr(origin, 'model', type(origin)) is AlimentoNutriente:
+        invalidar_vectores([instance.alimento_id])
+
+
+@receiver(post_save, sender=Nutriente)
+def invalidar_vectores_nutriente(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        invalidar_vectores(AlimentoNutriente.objects.filter(nutriente=instance).values_list('alimento_id', flat=True))
+
+
+@receiver(pre_delete, sender=Nutriente)
+def invalidar_vectores_nutriente_eliminado(sender, instance, **kwargs):
+    invalidar_vectores(AlimentoNutriente.objects.filter(nutriente=instance).values_list('alimento_id', flat=True))
+
+
+# Miniaturas de las imágenes de alimentos: se generan en segundo plano cuando cambia la imagen
+# y se eliminan junto con el último alimento que usa la misma imagen.
+
+@receiver(post_save, sender=Alimento)
+def programar_miniaturas_alimento(sender, instance, raw=False, **kwargs):
+    if not raw and necesita_derivados(instance):
+        programar_derivados(instance)
+
+
+@receiver(post_delete, sender=Alimento)
+def eliminar_miniaturas_alimento(sender, instance, **kwargs):
+    derivados = instance.imagen_derivados
+    if rutas_derivados(derivados):
+        transaction.on_commit(lambda: liberar_derivados(derivados))
+
+
+# Archivos de imagen compartidos: al reemplazar la imagen o eliminar el alimento, el archivo anterior sólo se borra
+# si ningún otro alimento lo referencia. El nombre cargado se recuerda en post_init para no consultar en cada guardado.
+
+def _nombre_imagen(instance):
+    imagen = instance.__dict__.get('imagen')
+    return getattr(imagen, 'name', imagen) or None
+
+
+@receiver(post_init, sender=Alimento)
+def recordar_imagen_alimento(sender, instance, **kwargs):
+    instance._imagen_anterior = _nombre_imagen(instance)
+
+
+@receiver(post_save, sender=Alimento)
+def liberar_imagen_reemplazada(sender, instance, raw=False, **kwargs):
+    anterior = getattr(instance, '_imagen_anterior', None)
+    actual = _nombre_imagen(instance)
+    if not raw and anterior and anterior != actual:
+        transaction.on_commit(lambda: liberar_imagen(anterior))
+    instance._imagen_anterior = actual
+
+
+@receiver(post_delete, sender=Alimento)
+def liberar_imagen_alimento(sender, instance, **kwargs):
+    nombre = _nombre_imagen(instance)
+    if nombre:
+        transaction.on_commit(lambda: liberar_imagen(nombre))
+
+
+# Versiones de los datos de cada usuario (base/versiones.py) para los resultados cacheados que dependen de ellos,
+# como el plan de comidas, y para los ETag de las vistas con condicional_por_version. Los cambios en los alimentos
+# incrementan además la versión de los alimentos de todos los usuarios.
+
+@receiver(post_save, sender=RegistroDiario)
+@receiver(post_delete, sender=RegistroDiario)
+@receiver(post_save, sender=PerfilNutricional)
+@receiver(post_delete, sender=PerfilNutricional)
+def versionar_datos_usuario(sender, instance, raw=False, **kwargs):
+    if not raw:
+        incrementar_al_confirmar(ambito_usuario(instance.usuario_id))
+
+
+@receiver(post_save, sender=Alimento)
+@receiver(post_delete, sender=Alimento)
+def versionar_alimento(sender, instance, raw=False, **kwargs):
+    if not raw:
+        incrementar_al_confirmar(ambito_usuario(instance.usuario_id), AMBITO_ALIMENTOS)
+
+
+@receiver(post_save, sender=AlimentoNutriente)
+@receiver(post_delete, sender=AlimentoNutriente)
+def versionar_alimento_nutriente(sender, instance, raw=False, origin=None, **kwargs):
+    # En las eliminaciones en cascada ya se incrementa la versión del usuario (alimento) o la del catálogo (nutriente)
+    if raw or getattr(origin, 'model', type(origin)) in (Alimento, User, Nutriente):
+        return
+    alimento_id = instance.alimento_id
+
+    def incrementar():
+        usuario_id = Alimento.objects.filter(pk=alimento_id).values_list('usuario_id', flat=True).first()
+        if usuario_id is None:
+            incrementar_versiones(AMBITO_ALIMENTOS)
+        else:
+            incrementar_versiones(AMBITO_ALIMENTOS, ambito_usuario(usuario_id))
+    transaction.on_commit(incrementar)
+
+
+@receiver(post_save, sender=Nutriente)
+@receiver(post_delete, sender=Nutriente)
+def versionar_catalogo(sender, instance, raw=False, **kwargs):
+    if not raw:
+        incrementar_al_confirmar(AMBITO_CATALOGO)
+        catalogo_nutrientes.invalidar()
+
+
+# El catálogo de nutrientes en memoria comprueba su versión una vez por petición
+@receiver(request_started)
+def revisar_catalogo_nutrientes(sender, **kwargs):
+    catalogo_nutrientes.nueva_peticion()
+
+
+# Cada conexión nueva pasa sus consultas por la medición por solicitud (base/middleware.py) y, si es SQLite, recibe
+# los PRAGMAs de SQLITE_PRAGMAS.
+@receiver(connection_created)
+def preparar_conexion(sender, connection, **kwargs):
+    configurar_sqlite(connection)
+    instalar_en_conexion(connection)
+
+
+# Las migraciones que rehacen base_alimento en SQLite borran los triggers del índice de búsqueda: se reponen
+# después de cada migrate, así una migración futura no vuelve a dejar alimentos sin indexar.
+@receiver(post_migrate)
+def asegurar_indice_busqueda(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'base':
+        asegurar_indice(using)
@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TAMANO_BLOQUE = 64 * 1024
+# Estáticos que se guardan también precomprimidos (.gz, y .br si brotli está instalado). Imágenes y fuentes woff ya
+# vienen comprimidas.
+EXTENSIONES_COMPRIMIBLES = ('.css', '.js', '.map', '.svg', '.txt', '.html', '.json', '.xml', '.ico', '.ttf', '.eot',
+                            '.otf', '.scss')
+# Una variante comprimida que no ahorra al menos esta fracción no se guarda
+AHORRO_MINIMO = 0.05
+
+
+def hash_contenido(archivo):
+    digest = hashlib.sha256()
+    for bloque in archivo.chunks(TAMANO_BLOQUE):
+        digest.update(bloque)
+    archivo.seek(0)
+    return digest.hexdigest()
+
+
+def nombre_por_contenido(nombre, digest):
+    carpeta = os.path.dirname(nombre)
+    extension = os.path.splitext(nombre)[1].lower()
+    return os.path.join(carpeta, f'{digest}{extension}')
+
+
+# Almacenamiento direccionado por contenido: cada archivo se guarda como <carpeta>/<sha256><extensión>, de modo que
+# subir dos veces la misma imagen reutiliza el mismo archivo en vez de crear una copia renombrada. Como un archivo
+# puede estar compartido por varios alimentos, no se elimina directamente: ver liberar_imagen en imagenes_service.
+@deconstructible
+class AlmacenamientoPorContenido(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # El nombre definitivo se decide en _save a partir del contenido
+        return name
+
+    def _save(self, name, content):
+        name = nombre_por_contenido(name, hash_contenido(content))
+        if self.exists(name):
+            return name
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            # Otro proceso guardó el mismo contenido al mismo tiempo
+            return name
+
+
+def almacenamiento_imagenes():
+    return AlmacenamientoPorContenido()
+
+
+def _precomprimir(ruta):
+    with open(ruta, 'rb') as archivo:
+        contenido = archivo.read()
+    variantes = [('.gz', lambda datos: gzip.compress(datos, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variantes.append(('.br', lambda datos: brotli.compress(datos, quality=11)))
+    for extension, comprimir in variantes:
+        comprimido = comprimir(contenido)
+        if len(comprimido) <= len(contenido) * (1 - AHORRO_MINIMO):
+            with open(ruta + extension, 'wb') as archivo:
+                archivo.write(comprimido)
+
+
+# Estáticos con el hash del contenido en el nombre (css/style.css -> css/style.1a2b3c4d5e6f.css) y, al lado de cada
+# archivo de texto, sus versiones .gz y .br para servirlas sin comprimir en cada pedido (ver EstaticosMiddleware).
+# Sólo se reescriben las referencias url() e @import de los CSS: los sourceMappingURL apuntan a mapas que no se
+# distribuyen (bootstrap.css.map) y harían fallar collectstatic.
+class EstaticosComprimidos(ManifestStaticFilesStorage):
+    patterns = (
+        ('*.css', ManifestStaticFilesStorage.patterns[0][1][:2]),
+    )
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for nombre in {*paths, *self.hashed_files.values()}:
+            if nombre.lower().endswith(EXTENSIONES_COMPRIMIBLES):
+                _precomprimir(self.path(nombre))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Sin collectstatic (o un archivo que no pasó por él) se usa el nombre original, que
+            # EstaticosMiddleware sirve con una caché corta.
+            return name
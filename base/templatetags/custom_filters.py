@@ -1,7 +1,27 @@
 from django import template
+from django.utils.html import format_html
+
+from base.imagenes_service import srcset
 
 register = template.Library()
 
 @register.filter(name='subtract')
 def subtract(value, arg):
     return value - arg
+
+# Imagen de un alimento mostrada a la altura indicada: usa las miniaturas WebP (con JPEG de respaldo) en 1x y 2x,
+# o la imagen original mientras las miniaturas no estén generadas.
+@register.simple_tag
+def imagen_alimento(alimento, altura=50):
+    if not alimento.imagen:
+        return ''
+    webp = srcset(alimento, altura, 'webp')
+    if webp is None:
+        return format_html('<img src="{}" alt="{}" height="{}" loading="lazy">',
+                           alimento.imagen.url, alimento.nombre, altura)
+    jpeg = srcset(alimento, altura, 'jpeg')
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}" alt="{}" height="{}" loading="lazy" decoding="async"></picture>',
+        webp, jpeg.split(' ', 1)[0], jpeg, alimento.nombre, altura
+    )
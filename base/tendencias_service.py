@@ -0,0 +1,89 @@
+import math
+
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from base.basedatos import lecturas_analiticas
+from base.catalogo_nutrientes import catalogo_nutrientes
+from base.cohortes import MACRONUTRIENTES
+from base.models import IngestaDiaria, RegistroDiario
+
+# Agrupaciones de las series: función que lleva cada fecha al inicio de su periodo (los días quedan como están)
+AGRUPACIONES = {'dia': None, 'semana': TruncWeek, 'mes': TruncMonth}
+PUNTOS_POR_DEFECTO = 120
+MAXIMO_PUNTOS = 1000
+
+
+def _periodo(agrupacion):
+    truncar = AGRUPACIONES[agrupacion]
+    return F('fecha') if truncar is None else truncar('fecha')
+
+
+# Totales por periodo entre `desde` y `hasta`, ordenados: [(periodo, días con registros, macros, micronutrientes)].
+# Dos consultas agrupadas en la base, sin importar la longitud del rango: los macronutrientes salen de los totales
+# diarios (IngestaDiaria) y los micronutrientes de los registros, igual que se arma IngestaDiaria (cantidad del
+# nutriente por cantidad registrada, por nutriente_id y con los nombres del catálogo en memoria).
+def _totales_por_periodo(usuario_id, desde, hasta, agrupacion):
+    filas = IngestaDiaria.objects.filter(usuario_id=usuario_id, fecha__range=(desde, hasta)).values(
+        periodo=_periodo(agrupacion)
+    ).annotate(
+        dias=Count('id'), **{macro: Sum(macro, output_field=FloatField()) for macro in MACRONUTRIENTES}
+    ).order_by('periodo')
+    micronutrientes = {}
+    registros = RegistroDiario.objects.filter(
+        usuario_id=usuario_id, fecha__range=(desde, hasta), alimento__alimentonutriente__isnull=False
+    ).values(
+        periodo=_periodo(agrupacion), nutriente_id=F('alimento__alimentonutriente__nutriente_id')
+    ).annotate(
+        total=Sum(F('alimento__alimentonutriente__cantidad') * F('cantidad'), output_field=FloatField())
+    ).order_by()
+    for fila in registros:
+        micronutrientes.setdefault(fila['periodo'], {})[fila['nutriente_id']] = fila['total']
+    micronutrientes = {periodo: catalogo_nutrientes.por_nombre(totales) for periodo, totales in micronutrientes.items()}
+    return [
+        (fila['periodo'], fila['dias'], {macro: fila[macro] or 0.0 for macro in MACRONUTRIENTES},
+         micronutrientes.get(fila['periodo'], {}))
+        for fila in filas
+    ]
+
+
+# Une periodos consecutivos de a `tamano` para no pasar de max_puntos. Se suman totales y días, así el promedio del
+# punto pondera cada periodo por sus días con registros.
+def _reducir(periodos, tamano):
+    reducidos = []
+    for inicio in range(0, len(periodos), tamano):
+        grupo = periodos[inicio:inicio + tamano]
+        macros = {macro: sum(periodo[2][macro] for periodo in grupo) for macro in MACRONUTRIENTES}
+        micronutrientes = {}
+        for periodo in grupo:
+            for nombre, total in periodo[3].items():
+                micronutrientes[nombre] = micronutrientes.get(nombre, 0.0) + total
+        reducidos.append((grupo[0][0], sum(periodo[1] for periodo in grupo), macros, micronutrientes))
+    return reducidos
+
+
+# Series de calorías, macronutrientes y micronutrientes del usuario entre `desde` y `hasta` agrupadas por día, semana
+# o mes. Cada punto tiene el inicio de su periodo, los días con registros y el promedio diario de esos días. Si hay
+# más periodos que `max_puntos` se unen periodos consecutivos (`periodos_por_punto`). Los periodos sin registros no
+# aparecen. Se lee de la réplica de análisis, si está configurada.
+@lecturas_analiticas()
+def tendencias(usuario_id, desde, hasta, agrupacion='dia', max_puntos=PUNTOS_POR_DEFECTO):
+    periodos = _totales_por_periodo(usuario_id, desde, hasta, agrupacion)
+    tamano = max(1, math.ceil(len(periodos) / max_puntos))
+    if tamano > 1:
+        periodos = _reducir(periodos, tamano)
+    return {
+        'desde': desde,
+        'hasta': hasta,
+        'agrupacion': agrupacion,
+        'periodos_por_punto': tamano,
+        'puntos': [
+            {
+                'periodo': periodo,
+                'dias': dias,
+                **{macro: round(macros[macro] / dias, 2) for macro in MACRONUTRIENTES},
+                'micronutrientes': {nombre: round(total / dias, 2) for nombre, total in sorted(micronutrientes.items())},
+            }
+            for periodo, dias, macros, micronutrientes in periodos
+        ],
+    }
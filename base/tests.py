@@ -0,0 +1,1623 @@
+import gzip
+import importlib.util
+import math
+import os
+import tempfile
+from collections import namedtuple
+import uuid
+import hashlib
+import json
+from datetime import date, timedelta
+from functools import partial
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.templatetags.static import static
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .analisis_service import AnalisisConsumoService, analisis_consumo, evaluar_grupos
+from .catalogo_nutrientes import catalogo_nutrientes
+from .basedatos import ALIAS_ANALITICA, RouterAnalitica, alias_analitica, lecturas_analiticas
+from .busqueda_service import asegurar_indice, autocompletar_alimentos, filtrar_alimentos
+from .cohortes import DIMENSION_SEXO, DIMENSIONES_POR_DEFECTO, DimensionEdad, agregar_por_cohortes
+from .imagenes_service import generar_derivados, srcset, tamanos_vigentes
+from .ingesta_service import reconstruir_ingestas
+from .metricas import registro as registro_metricas
+from .plantillas import minificar_html
+from .models import (
+    Alimento, AlimentoNutriente, IngestaDiaria, Nutriente, PerfilNutricional, PlantillaComida, PlantillaComidaAlimento,
+    RegistroDiario, TrabajoAnalisis, VectorNutricional,
+)
+from .plan_service import plan_de_comidas, resolver_plan
+from .registro_service import registrar_comida
+from .reportes_service import LIMITE_CALORIAS_SIN_PERFIL, consultar_excesos, pagina_excesos
+from .recomendacion_service import deficits, reconstruir_vectores, recomendar_alimentos, vectores_de_usuario
+from .tendencias_service import tendencias
+from .trabajos_service import TAREAS, cancelar_trabajo, ejecutar_trabajo, encolar_trabajo, limpiar_trabajos
+from .utils import VERSION_FORMULA, construir_analisis
+from .versiones import (
+    AMBITO_ALIMENTOS, AMBITO_CATALOGO, ambito_usuario, incrementar_al_confirmar, incrementar_versiones, versiones,
+)
+
+CLAVE = 'clave-segura-123'
+
+# usuario: 'normal', 'admin' o None (anónimo); url: función que recibe el caso de prueba y devuelve la URL.
+Ruta = namedtuple('Ruta', ['nombre', 'usuario', 'metodo', 'url', 'datos', 'presupuesto', 'json'], defaults=[False])
+
+
+def _datos_alimento(prueba):
+    return {'nombre': 'Nuevo', 'calorias': '120', 'proteinas': '4', 'carbohidratos': '20', 'grasas': '2'}
+
+
+def _datos_registro(prueba):
+    return {'alimento': prueba.alimento.id, 'cantidad': '1.5'}
+
+
+def _datos_perfil(prueba):
+    return {'edad': 31, 'sexo': 'Mujer', 'peso': '60', 'altura': '1.65', 'nivel_actividad': 'moderado'}
+
+
+def _datos_nutriente(prueba):
+    return {'nombre': 'Vitamina K', 'tipo': 'vitamina'}
+
+
+def _datos_alimento_nutriente(prueba):
+    return {'nutriente': prueba.nutrientes[0].id, 'cantidad': '2', 'unidad': 'mg'}
+
+
+def _datos_comida(prueba):
+    alimentos = Alimento.objects.filter(usuario=prueba.usuario).order_by('id')[:5]
+    return {'items': [{'alimento': alimento.id, 'cantidad': '1.5'} for alimento in alimentos]}
+
+
+def _datos_plantilla(prueba):
+    return dict(_datos_comida(prueba), nombre='Desayuno')
+
+
+def _datos_login(prueba):
+    return {'username': prueba.usuario.username, 'password': CLAVE}
+
+
+RUTAS = [
+    Ruta('login', None, 'get', lambda t: reverse('login'), None, 0),
+    Ruta('login', None, 'post', lambda t: reverse('login'), _datos_login, 9),
+    Ruta('registro', None, 'get', lambda t: reverse('registro'), None, 0),
+    Ruta('logout', 'normal', 'post', lambda t: reverse('logout'), None, 4),
+    Ruta('main_page', 'normal', 'get', lambda t: reverse('main_page'), None, 2),
+    Ruta('agregar_alimento', 'normal', 'get', lambda t: reverse('agregar_alimento'), None, 2),
+    Ruta('agregar_alimento', 'normal', 'post', lambda t: reverse('agregar_alimento'), _datos_alimento, 5),
+    Ruta('registro_diario', 'normal', 'get', lambda t: reverse('registro_diario'), None, 3),
+    Ruta('registro_diario', 'normal', 'post', lambda t: reverse('registro_diario'), _datos_registro, 14),
+    Ruta('perfil_nutricional', 'normal', 'get', lambda t: reverse('perfil_nutricional'), None, 3),
+    Ruta('perfil_nutricional', 'normal', 'post', lambda t: reverse('perfil_nutricional'), _datos_perfil, 4),
+    Ruta('analisis_nutricional', 'normal', 'get', lambda t: reverse('analisis_nutricional'), None, 5),
+    Ruta('reporte_excesos', 'admin', 'get', lambda t: reverse('reporte_excesos'), None, 3),
+    Ruta('reporte_excesos', 'admin', 'get',
+         lambda t: reverse('reporte_excesos') + f'?usuario={t.usuario.username}&desde=2000-01-01', None, 4),
+    Ruta('reporte_excesos', 'admin', 'get',
+         lambda t: reverse('reporte_excesos') + f'?despues={t.usuario.id}:2000-01-01', None, 3),
+    Ruta('exportar_historial', 'normal', 'get', lambda t: reverse('exportar_historial'), None, 3),
+    Ruta('exportar_historial', 'normal', 'get',
+         lambda t: reverse('exportar_historial') + '?formato=ndjson&desde=2024-01-01', None, 3),
+    Ruta('exportar_historial_todos', 'admin', 'get', lambda t: reverse('exportar_historial_todos'), None, 3),
+    Ruta('exportar_excesos', 'admin', 'get', lambda t: reverse('exportar_excesos'), None, 3),
+    Ruta('listar_alimentos', 'normal', 'get', lambda t: reverse('listar_alimentos'), None, 4),
+    Ruta('editar_alimento', 'normal', 'get',
+         lambda t: reverse('editar_alimento', args=[t.alimento.id]), None, 3),
+    Ruta('editar_alimento', 'normal', 'post',
+         lambda t: reverse('editar_alimento', args=[t.alimento.id]), _datos_alimento, 14),
+    Ruta('eliminar_alimento', 'normal', 'get',
+         lambda t: reverse('eliminar_alimento', args=[t.alimento.id]), None, 3),
+    Ruta('eliminar_alimento', 'normal', 'post',
+         lambda t: reverse('eliminar_alimento', args=[t.alimento_desechable().id]), None, 26),
+    Ruta('sugerencias_alimentos', 'normal', 'get', lambda t: t.sugerencias_con_vectores(), None, 8),
+    Ruta('sugerencias_alimentos', 'normal', 'get', lambda t: t.sugerencias_con_vector_invalidado(), None, 12),
+    Ruta('lista_usuarios_inactivos', 'admin', 'get', lambda t: reverse('lista_usuarios_inactivos'), None, 3),
+    Ruta('analisis-consumo', 'admin', 'get', lambda t: t.analisis_sin_trabajos(), None, 7),
+    Ruta('analisis-consumo', 'admin', 'get', lambda t: t.analisis_en_cache(), None, 2),
+    Ruta('estado_trabajo_analisis', 'admin', 'get',
+         lambda t: reverse('estado_trabajo_analisis', args=[t.trabajo().id]), None, 3),
+    Ruta('cancelar_trabajo_analisis', 'admin', 'post',
+         lambda t: reverse('cancelar_trabajo_analisis', args=[t.trabajo().id]), None, 5),
+    Ruta('metricas', 'admin', 'get', lambda t: reverse('metricas'), None, 2),
+    Ruta('listar_todos_alimentos', 'admin', 'get', lambda t: reverse('listar_todos_alimentos'), None, 3),
+    Ruta('agregar_nutriente_a_alimento', 'admin', 'get',
+         lambda t: reverse('agregar_nutriente_a_alimento', args=[t.alimento.id]), None, 4),
+    Ruta('agregar_nutriente_a_alimento', 'admin', 'post',
+         lambda t: reverse('agregar_nutriente_a_alimento', args=[t.alimento.id]), _datos_alimento_nutriente, 16),
+    Ruta('agregar_nutriente', 'admin', 'get', lambda t: reverse('agregar_nutriente'), None, 2),
+    Ruta('agregar_nutriente', 'admin', 'post', lambda t: reverse('agregar_nutriente'), _datos_nutriente, 3),
+    Ruta('listar_nutrientes', 'admin', 'get', lambda t: reverse('listar_nutrientes'), None, 3),
+    Ruta('editar_nutriente', 'admin', 'get',
+         lambda t: reverse('editar_nutriente', args=[t.nutrientes[0].id]), None, 3),
+    Ruta('editar_nutriente', 'admin', 'post',
+         lambda t: reverse('editar_nutriente', args=[t.nutriente_desechable().id]), _datos_nutriente, 14),
+    Ruta('eliminar_nutriente', 'admin', 'get',
+         lambda t: reverse('eliminar_nutriente', args=[t.nutrientes[0].id]), None, 3),
+    Ruta('eliminar_nutriente', 'admin', 'post',
+         lambda t: reverse('eliminar_nutriente', args=[t.nutriente_desechable().id]), None, 20),
+    Ruta('editar_nutriente_de_alimento', 'admin', 'get',
+         lambda t: reverse('editar_nutriente_de_alimento', args=[t.alimento.id, t.relacion().id]), None, 5),
+    Ruta('editar_nutriente_de_alimento', 'admin', 'post',
+         lambda t: reverse('editar_nutriente_de_alimento', args=[t.alimento.id, t.relacion().id]),
+         _datos_alimento_nutriente, 17),
+    Ruta('eliminar_nutriente_de_alimento', 'admin', 'get',
+         lambda t: reverse('eliminar_nutriente_de_alimento', args=[t.alimento.id, t.relacion().id]), None, 5),
+    Ruta('eliminar_nutriente_de_alimento', 'admin', 'post',
+         lambda t: reverse('eliminar_nutriente_de_alimento', args=[t.alimento.id, t.relacion().id]), None, 13),
+    Ruta('api-root', 'normal', 'get', lambda t: reverse('api-root'), None, 2),
+    Ruta('alimento-list', 'normal', 'get', lambda t: reverse('alimento-list'), None, 5),
+    Ruta('alimento-list', 'normal', 'get', lambda t: reverse('alimento-list') + '?fields=id,nombre', None, 4),
+    Ruta('alimento-list', 'normal', 'get', lambda t: reverse('alimento-list') + '?search=alim', None, 5),
+    Ruta('alimento-autocompletar', 'normal', 'get',
+         lambda t: reverse('alimento-autocompletar') + '?q=alim', None, 3),
+    Ruta('alimento-list', 'normal', 'post', lambda t: reverse('alimento-list'), _datos_alimento, 6),
+    Ruta('alimento-detail', 'normal', 'get',
+         lambda t: reverse('alimento-detail', args=[t.alimento.id]), None, 5),
+    Ruta('api_analisis_nutricional', 'normal', 'get', lambda t: reverse('api_analisis_nutricional'), None, 4),
+    Ruta('api_plan_comidas', 'normal', 'get', lambda t: t.plan_sin_cache(), None, 8),
+    Ruta('api_plan_comidas', 'normal', 'get', lambda t: t.plan_en_cache(), None, 5),
+    Ruta('api_ingestas', 'normal', 'get', lambda t: reverse('api_ingestas') + '?desde=2000-01-01', None, 3),
+    Ruta('api_tendencias', 'normal', 'get',
+         lambda t: reverse('api_tendencias') + '?desde=2000-01-01&agrupacion=semana', None, 6),
+    Ruta('registrar_comida', 'normal', 'post', lambda t: reverse('registrar_comida'), _datos_comida, 14, True),
+    Ruta('plantilla-list', 'normal', 'get', lambda t: reverse('plantilla-list'), None, 4),
+    Ruta('plantilla-list', 'normal', 'post', lambda t: reverse('plantilla-list'), _datos_plantilla, 8, True),
+    Ruta('plantilla-detail', 'normal', 'get',
+         lambda t: reverse('plantilla-detail', args=[t.plantilla().id]), None, 4),
+    Ruta('plantilla-registrar', 'normal', 'post',
+         lambda t: reverse('plantilla-registrar', args=[t.plantilla().id]), None, 15),
+]
+
+
+# Siembra un volumen realista de usuarios, alimentos, nutrientes y registros diarios y comprueba que cada vista
+# de base/urls.py y del router de la API se mantiene por debajo de un número fijo de consultas SQL, que no
+# depende de la cantidad de filas. Si una vista excede su presupuesto, el fallo lista las consultas ejecutadas.
+class PresupuestoConsultasTests(TestCase):
+    USUARIOS = 8
+    ALIMENTOS_POR_USUARIO = 15
+    NUTRIENTES = 10
+    NUTRIENTES_POR_ALIMENTO = 4
+    DIAS = 20
+    REGISTROS_POR_DIA = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.nutrientes = Nutriente.objects.bulk_create([
+            Nutriente(nombre=f'Nutriente {i}', tipo='vitamina' if i % 2 else 'mineral')
+            for i in range(cls.NUTRIENTES)
+        ])
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', CLAVE)
+        cls.usuario = cls.sembrar_usuarios(cls.USUARIOS)[0]
+        cls.alimento = Alimento.objects.filter(usuario=cls.usuario).order_by('id').first()
+        cls.plantilla()
+
+    @classmethod
+    def sembrar_usuarios(cls, cantidad):
+        inicio = User.objects.count()
+        clave = make_password(CLAVE)
+        usuarios = User.objects.bulk_create([
+            User(username=f'usuario{inicio + i}', password=clave) for i in range(cantidad)
+        ])
+        perfiles = [
+            PerfilNutricional(usuario=usuario, edad=18 + (i * 7) % 50, sexo='Hombre' if i % 2 else 'Mujer',
+                              peso=Decimal('70'), altura=Decimal('1.70'), nivel_actividad='moderado')
+            for i, usuario in enumerate(usuarios)
+        ]
+        # bulk_create no llama a save(): los objetivos se calculan antes de insertar
+        for perfil in perfiles:
+            perfil.actualizar_objetivos()
+        PerfilNutricional.objects.bulk_create(perfiles)
+        alimentos = Alimento.objects.bulk_create([
+            Alimento(usuario=usuario, nombre=f'Alimento {usuario.id}-{j}', calorias=Decimal(50 + j * 10),
+                     proteinas=Decimal(j % 10), carbohidratos=Decimal(j % 20), grasas=Decimal(j % 5),
+                     descripcion='Alimento de prueba')
+            for usuario in usuarios for j in range(cls.ALIMENTOS_POR_USUARIO)
+        ])
+        AlimentoNutriente.objects.bulk_create([
+            AlimentoNutriente(alimento=alimento, nutriente=cls.nutrientes[(i + k) % len(cls.nutrientes)],
+                              cantidad=Decimal('1.5'), unidad='mg')
+            for i, alimento in enumerate(alimentos) for k in range(cls.NUTRIENTES_POR_ALIMENTO)
+        ])
+        alimentos_por_usuario = {}
+        for alimento in alimentos:
+            alimentos_por_usuario.setdefault(alimento.usuario_id, []).append(alimento)
+        for dia in range(cls.DIAS):
+            registros = RegistroDiario.objects.bulk_create([
+                RegistroDiario(usuario=usuario, cantidad=Decimal('1'),
+                               alimento=alimentos_por_usuario[usuario.id][(dia + k) % cls.ALIMENTOS_POR_USUARIO])
+                for usuario in usuarios for k in range(cls.REGISTROS_POR_DIA)
+            ])
+            RegistroDiario.objects.filter(pk__in=[registro.pk for registro in registros]).update(
+                fecha=date.today() - timedelta(days=dia)
+            )
+        reconstruir_ingestas()
+        return usuarios
+
+    def setUp(self):
+        cache.clear()
+        # El catálogo de nutrientes se carga una vez por proceso: los presupuestos miden el estado estable
+        catalogo_nutrientes.nutrientes()
+
+    def alimento_desechable(self):
+        alimento = Alimento.objects.create(usuario=self.usuario, nombre='Desechable', calorias=10, proteinas=1,
+                                           carbohidratos=1, grasas=1)
+        for nutriente in self.nutrientes[:self.NUTRIENTES_POR_ALIMENTO]:
+            AlimentoNutriente.objects.create(alimento=alimento, nutriente=nutriente, cantidad=1, unidad='mg')
+        for _ in range(self.REGISTROS_POR_DIA):
+            RegistroDiario.objects.create(usuario=self.usuario, alimento=alimento, cantidad=1)
+        return alimento
+
+    def nutriente_desechable(self):
+        nutriente = Nutriente.objects.create(nombre='Desechable', tipo='mineral')
+        for alimento in Alimento.objects.filter(usuario=self.usuario)[:self.ALIMENTOS_POR_USUARIO]:
+            AlimentoNutriente.objects.create(alimento=alimento, nutriente=nutriente, cantidad=1, unidad='mg')
+        return nutriente
+
+    def relacion(self):
+        return AlimentoNutriente.objects.create(alimento=self.alimento, nutriente=self.nutrientes[-1],
+                                                cantidad=1, unidad='mg')
+
+    def sugerencias_con_vectores(self):
+        reconstruir_vectores(self.usuario.id)
+        return reverse('sugerencias_alimentos')
+
+    def sugerencias_con_vector_invalidado(self):
+        reconstruir_vectores(self.usuario.id)
+        VectorNutricional.objects.filter(alimento=self.alimento).delete()
+        return reverse('sugerencias_alimentos')
+
+    def plan_sin_cache(self):
+        # El plan se mide con calorías por cubrir: se descartan los registros de hoy que agregaron otras rutas
+        hoy = RegistroDiario.objects.filter(usuario=self.usuario, fecha=date.today()).order_by('id')
+        RegistroDiario.objects.filter(pk__in=list(hoy.values_list('pk', flat=True))[self.REGISTROS_POR_DIA:]).delete()
+        cache.clear()
+        reconstruir_vectores(self.usuario.id)
+        return reverse('api_plan_comidas')
+
+    def plan_en_cache(self):
+        url = self.plan_sin_cache() + '?max_alimentos=3'
+        self.client.get(url)
+        return url
+
+    def analisis_sin_trabajos(self):
+        # Cada pedido encola su propio trabajo (en TestCase no se ejecuta: on_commit no se dispara)
+        cache.clear()
+        TrabajoAnalisis.objects.all().delete()
+        return reverse('analisis-consumo')
+
+    def analisis_en_cache(self):
+        AnalisisConsumoService().precalentar()
+        return reverse('analisis-consumo')
+
+    def trabajo(self):
+        return TrabajoAnalisis.objects.create(tipo='analisis_consumo', clave=uuid.uuid4().hex)
+
+    @classmethod
+    def plantilla(cls):
+        plantilla = PlantillaComida.objects.create(usuario=cls.usuario, nombre='Almuerzo')
+        PlantillaComidaAlimento.objects.bulk_create([
+            PlantillaComidaAlimento(plantilla=plantilla, alimento=alimento, cantidad=1)
+            for alimento in Alimento.objects.filter(usuario=cls.usuario)[:5]
+        ])
+        return plantilla
+
+    def assertConsultasMaximas(self, maximo, funcion, *args, **kwargs):
+        with CaptureQueriesContext(connection) as contexto:
+            respuesta = funcion(*args, **kwargs)
+        if len(contexto) > maximo:
+            consultas = '\n'.join(
+                f"{i}. {consulta['sql']}" for i, consulta in enumerate(contexto.captured_queries, start=1)
+            )
+            self.fail(f"Se ejecutaron {len(contexto)} consultas (presupuesto: {maximo}):\n{consultas}")
+        return respuesta, len(contexto)
+
+    # Las respuestas en streaming consultan la base mientras se envían: se leen completas dentro del presupuesto
+    @staticmethod
+    def consumir(metodo, *args, **kwargs):
+        respuesta = metodo(*args, **kwargs)
+        if respuesta.streaming:
+            respuesta.contenido = b''.join(respuesta.streaming_content)
+        return respuesta
+
+    def solicitar(self, ruta):
+        self.client.logout()
+        if ruta.usuario == 'normal':
+            self.client.force_login(self.usuario)
+        elif ruta.usuario == 'admin':
+            self.client.force_login(self.admin)
+        url = ruta.url(self)
+        datos = ruta.datos(self) if ruta.datos else None
+        metodo = getattr(self.client, ruta.metodo)
+        extra = {'content_type': 'application/json'} if ruta.json else {}
+        respuesta, consultas = self.assertConsultasMaximas(ruta.presupuesto, self.consumir, metodo, url, datos, **extra)
+        self.assertLess(respuesta.status_code, 400, f"{ruta.metodo.upper()} {url} -> {respuesta.status_code}")
+        return consultas
+
+    def test_rutas_dentro_del_presupuesto(self):
+        for ruta in RUTAS:
+            with self.subTest(ruta=ruta.nombre, metodo=ruta.metodo):
+                self.solicitar(ruta)
+
+    def test_consultas_no_crecen_con_los_datos(self):
+        antes = {}
+        for ruta in RUTAS:
+            with self.subTest(ruta=ruta.nombre, metodo=ruta.metodo):
+                antes[ruta] = self.solicitar(ruta)
+
+        self.sembrar_usuarios(self.USUARIOS)
+        cache.clear()
+        catalogo_nutrientes.nutrientes()
+
+        for ruta in RUTAS:
+            with self.subTest(ruta=ruta.nombre, metodo=ruta.metodo):
+                self.assertEqual(self.solicitar(ruta), antes.get(ruta))
+
+    def test_todas_las_rutas_tienen_presupuesto(self):
+        from .urls import urlpatterns, router
+
+        nombres = {patron.name for patron in urlpatterns if getattr(patron, 'name', None)}
+        nombres |= {url.name for url in router.urls if url.name}
+        self.assertLessEqual(nombres, {ruta.nombre for ruta in RUTAS})
+
+
+# El backend NumPy del análisis de consumo debe devolver lo mismo que las consultas agrupadas en SQL.
+@skipUnless(importlib.util.find_spec('numpy'), 'numpy no está instalado')
+class AnalisisConsumoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        zinc = Nutriente.objects.create(nombre='Zinc', tipo='mineral')
+        usuarios = {}
+        perfiles = [('ana', 25, 'Mujer'), ('beto', 25, 'Hombre'), ('carla', 40, 'Mujer'), ('dani', None, None)]
+        for nombre, edad, sexo in perfiles:
+            usuarios[nombre] = User.objects.create(username=nombre)
+            if edad:
+                PerfilNutricional.objects.create(usuario=usuarios[nombre], edad=edad, sexo=sexo, peso=60,
+                                                 altura=Decimal('1.65'), nivel_actividad='moderado')
+        pan = Alimento.objects.create(usuario=usuarios['ana'], nombre='Pan', calorias=200, proteinas=5,
+                                      carbohidratos=40, grasas=2)
+        lentejas = Alimento.objects.create(usuario=usuarios['ana'], nombre='Lentejas', calorias=100, proteinas=8,
+                                           carbohidratos=15, grasas=1)
+        espinaca = Alimento.objects.create(usuario=usuarios['carla'], nombre='Espinaca', calorias=20, proteinas=3,
+                                           carbohidratos=4, grasas=0)
+        AlimentoNutriente.objects.create(alimento=lentejas, nutriente=hierro, cantidad=3, unidad='mg')
+        AlimentoNutriente.objects.create(alimento=espinaca, nutriente=hierro, cantidad=2, unidad='mg')
+        AlimentoNutriente.objects.create(alimento=espinaca, nutriente=zinc, cantidad=1, unidad='mg')
+        for usuario, alimento, cantidad, fecha in [('ana', pan, 2, date(2024, 1, 1)),
+                                                   ('ana', lentejas, 1, date(2024, 1, 10)),
+                                                   ('carla', lentejas, 3, date(2024, 1, 1)),
+                                                   ('carla', espinaca, 1, date(2024, 1, 1)),
+                                                   # Sin perfil: no entra en ninguna cohorte
+                                                   ('dani', pan, 5, date(2024, 1, 1))]:
+            registro = RegistroDiario.objects.create(usuario=usuarios[usuario], alimento=alimento, cantidad=cantidad)
+            RegistroDiario.objects.filter(pk=registro.pk).update(fecha=fecha)
+
+    def test_promedios_por_usuario_de_cada_cohorte(self):
+        # Menores de 30: ana (pan×2 + lentejas×1) y beto (sin registros).
+        # Mayores de 30: carla (lentejas×3 + espinaca).
+        esperado = {
+            'menores_30': {'calorias': 250, 'proteinas': 9, 'carbohidratos': 47.5, 'grasas': 2.5,
+                           'nutrientes': {'Hierro': 1.5}, 'diversidad_nutrientes': 0.5},
+            'mayores_30': {'calorias': 320, 'proteinas': 27, 'carbohidratos': 49, 'grasas': 3,
+                           'nutrientes': {'Hierro': 11, 'Zinc': 1}, 'diversidad_nutrientes': 2},
+        }
+        for backend in ['sql', 'numpy']:
+            with self.subTest(backend=backend), override_settings(ANALISIS_CONSUMO_BACKEND=backend):
+                self.assertEqual(analisis_consumo(), esperado)
+                desde = analisis_consumo(fecha_inicio='2024-01-05')
+                self.assertEqual(desde['menores_30']['calorias'], 50)
+                self.assertEqual(desde['mayores_30']['calorias'], 0)
+
+    def test_evaluacion_de_las_cohortes_por_defecto(self):
+        self.assertEqual(evaluar_grupos(analisis_consumo()), {
+            'grupo_mas_riesgo': 'El grupo de mayores de 30',
+            'razones': ['mayor consumo calórico', 'mayor consumo de proteinas en mayores de 30',
+                        'mayor consumo de carbohidratos en mayores de 30', 'mayor consumo de grasas en mayores de 30',
+                        'menor diversidad de nutrientes en menores de 30.'],
+        })
+
+    def test_se_calcula_en_el_primer_uso_y_se_reutiliza_de_la_cache(self):
+        cache.clear()
+        servicio = AnalisisConsumoService()
+        self.assertIsNone(async_to_sync(servicio.aen_cache)())
+        resultados, evaluacion = servicio.obtener()
+        self.assertEqual(resultados['menores_30']['calorias'], 250)
+        with self.assertNumQueries(0):
+            self.assertEqual(servicio.obtener(), (resultados, evaluacion))
+
+        # Cada rango de fechas tiene su entrada; invalidar descarta la del rango indicado
+        self.assertEqual(servicio.obtener('2024-01-05')[0]['menores_30']['calorias'], 50)
+        Alimento.objects.filter(nombre='Pan').update(calorias=100)
+        self.assertEqual(servicio.obtener()[0]['menores_30']['calorias'], 250)
+        servicio.invalidar()
+        self.assertEqual(servicio.obtener()[0]['menores_30']['calorias'], 150)
+
+    def test_comando_precalentar_analisis(self):
+        cache.clear()
+        salida = StringIO()
+        call_command('precalentar_analisis', fecha_inicio='2024-01-05', stdout=salida)
+        self.assertIn('Análisis precalentado para 2 grupos: El grupo de menores de 30', salida.getvalue())
+        resultados, _ = async_to_sync(AnalisisConsumoService().aen_cache)('2024-01-05')
+        self.assertEqual(resultados['menores_30']['calorias'], 50)
+        self.assertIsNone(async_to_sync(AnalisisConsumoService().aen_cache)())
+
+    def test_evaluacion_con_otras_dimensiones(self):
+        dimensiones = (DimensionEdad((30,)), DIMENSION_SEXO)
+        resultados = analisis_consumo(dimensiones=dimensiones)
+        self.assertEqual(resultados['menores_30__Mujer']['calorias'], 500)
+        self.assertEqual(resultados['menores_30__Hombre']['calorias'], 0)
+        evaluacion = AnalisisConsumoService(dimensiones=dimensiones).calcular()['evaluacion']
+        self.assertEqual(evaluacion['grupo_mas_riesgo'], 'El grupo de menores de 30, Mujer')
+        self.assertIn('mayor consumo de proteinas en mayores de 30, Mujer', evaluacion['razones'])
+
+
+class CohortesNumpyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        nutrientes = [Nutriente.objects.create(nombre=f'Nutriente {i}', tipo='mineral') for i in range(3)]
+        for i in range(6):
+            usuario = User.objects.create(username=f'cohorte{i}')
+            if i < 5:
+                PerfilNutricional.objects.create(usuario=usuario, edad=20 + i * 6, sexo='Hombre' if i % 2 else 'Mujer',
+                                                 peso=70, altura=Decimal('1.70'), nivel_actividad='moderado')
+            for j in range(3):
+                alimento = Alimento.objects.create(usuario=usuario, nombre=f'Alimento {i}-{j}', calorias=100 + j,
+                                                   proteinas=j, carbohidratos=2 * j, grasas=Decimal('0.5'))
+                for nutriente in nutrientes[:j]:
+                    AlimentoNutriente.objects.create(alimento=alimento, nutriente=nutriente, cantidad=Decimal('1.25'),
+                                                     unidad='mg')
+                RegistroDiario.objects.create(usuario=usuario, alimento=alimento, cantidad=Decimal(j + 1))
+
+    def assertResultadosIguales(self, esperado, obtenido):
+        self.assertEqual(set(esperado), set(obtenido))
+        for cohorte, grupo in esperado.items():
+            otro = obtenido[cohorte]
+            self.assertEqual(set(grupo['nutrientes']), set(otro['nutrientes']))
+            pares = [(clave, valor, otro[clave]) for clave, valor in grupo.items() if clave != 'nutrientes']
+            pares += [(nombre, valor, otro['nutrientes'][nombre]) for nombre, valor in grupo['nutrientes'].items()]
+            for nombre, valor_esperado, valor_obtenido in pares:
+                self.assertTrue(math.isclose(valor_esperado, valor_obtenido, abs_tol=1e-9),
+                                f'{cohorte} {nombre}: {valor_esperado} != {valor_obtenido}')
+
+    def test_mismo_resultado_que_sql(self):
+        from .cohortes_numpy import agregar_por_cohortes as agregar_numpy
+
+        for dimensiones in [DIMENSIONES_POR_DEFECTO, (DimensionEdad((25, 35)), DIMENSION_SEXO)]:
+            with self.subTest(dimensiones=[dimension.clave() for dimension in dimensiones]):
+                esperado = agregar_por_cohortes(dimensiones)
+                self.assertResultadosIguales(esperado, agregar_numpy(dimensiones))
+                self.assertResultadosIguales(esperado, agregar_numpy(dimensiones, tamano_bloque=2))
+
+    def test_lee_de_la_replica_dentro_de_lecturas_analiticas(self):
+        from . import cohortes_numpy
+
+        # La réplica es la misma conexión que 'default' (un espejo en memoria no vería los datos de la prueba): se
+        # comprueba a qué alias van las lecturas en bloque
+        connections[ALIAS_ANALITICA] = connections['default']
+        self.addCleanup(connections.__delitem__, ALIAS_ANALITICA)
+        usados = []
+
+        class Conexiones:
+            def __getitem__(self, alias):
+                usados.append(alias)
+                return connections[alias]
+
+        esperado = agregar_por_cohortes()
+        with mock.patch('base.basedatos.alias_analitica', return_value=ALIAS_ANALITICA), \
+                mock.patch.object(cohortes_numpy, 'connections', Conexiones()):
+            with lecturas_analiticas():
+                self.assertResultadosIguales(esperado, cohortes_numpy.agregar_por_cohortes())
+            self.assertEqual(set(usados), {ALIAS_ANALITICA})
+            usados.clear()
+            cohortes_numpy.agregar_por_cohortes()
+            self.assertEqual(set(usados), {'default'})
+
+
+class TrabajosAnalisisTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        usuario = User.objects.create(username='trabajos')
+        PerfilNutricional.objects.create(usuario=usuario, edad=40, sexo='Mujer', peso=60, altura=Decimal('1.60'),
+                                         nivel_actividad='ligero')
+        alimento = Alimento.objects.create(usuario=usuario, nombre='Avena', calorias=380, proteinas=13,
+                                           carbohidratos=67, grasas=7)
+        RegistroDiario.objects.create(usuario=usuario, alimento=alimento, cantidad=1)
+
+    def test_pedidos_identicos_comparten_trabajo(self):
+        trabajo = encolar_trabajo('analisis_consumo', {'fecha_inicio': None, 'fecha_fin': None})
+        self.assertEqual(encolar_trabajo('analisis_consumo', {'fecha_fin': None, 'fecha_inicio': None}), trabajo)
+        otro = encolar_trabajo('analisis_consumo', {'fecha_inicio': '2024-01-01', 'fecha_fin': None})
+        self.assertNotEqual(otro, trabajo)
+
+    def test_ejecutar_guarda_el_resultado_y_se_reutiliza(self):
+        trabajo = encolar_trabajo('analisis_consumo')
+        resultado = ejecutar_trabajo(trabajo.id)
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'completado')
+        self.assertEqual(set(trabajo.resultado), {'resultados', 'evaluacion'})
+        self.assertEqual(trabajo.resultado['evaluacion'], resultado['evaluacion'])
+        self.assertEqual(encolar_trabajo('analisis_consumo'), trabajo)
+
+    def test_trabajo_cancelado_no_se_ejecuta(self):
+        trabajo = encolar_trabajo('analisis_consumo')
+        self.assertTrue(cancelar_trabajo(trabajo.id))
+        self.assertIsNone(ejecutar_trabajo(trabajo.id))
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'cancelado')
+        self.assertIsNone(trabajo.resultado)
+        self.assertNotEqual(encolar_trabajo('analisis_consumo'), trabajo)
+
+    def test_solo_el_trabajo_completado_deja_el_resultado_en_cache(self):
+        cache.clear()
+        servicio = AnalisisConsumoService()
+        trabajo = encolar_trabajo('analisis_consumo')
+
+        # Cancelado mientras corre: el resultado no se guarda ni en el trabajo ni en la caché
+        tarea = TAREAS['analisis_consumo']
+
+        def cancelar_durante(**parametros):
+            cancelar_trabajo(trabajo.id)
+            return tarea(**parametros)
+
+        with mock.patch.dict(TAREAS, {'analisis_consumo': cancelar_durante}):
+            self.assertIsNone(ejecutar_trabajo(trabajo.id))
+        self.assertIsNone(async_to_sync(servicio.aen_cache)())
+
+        otro = encolar_trabajo('analisis_consumo')
+        resultado = ejecutar_trabajo(otro.id)
+        self.assertEqual(async_to_sync(servicio.aen_cache)(), (resultado['resultados'], resultado['evaluacion']))
+
+    def test_vista_rechaza_fechas_no_validas(self):
+        User.objects.create_superuser('admin', 'admin@example.com', CLAVE)
+        self.client.login(username='admin', password=CLAVE)
+        for parametros in ({'fecha_inicio': 'abc'}, {'fecha_fin': '2024-02-30'}, {'fecha_inicio': '01/02/2024'}):
+            with self.subTest(parametros=parametros):
+                self.assertEqual(self.client.get(reverse('analisis-consumo'), parametros).status_code, 400)
+        self.assertFalse(TrabajoAnalisis.objects.exists())
+        respuesta = self.client.get(reverse('analisis-consumo'), {'fecha_inicio': '2024-01-01', 'fecha_fin': ''})
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_limpiar_elimina_terminados_viejos_y_abandona_activos(self):
+        terminado = encolar_trabajo('analisis_consumo')
+        cancelar_trabajo(terminado.id)
+        activo = encolar_trabajo('analisis_consumo', {'fecha_inicio': '2024-01-01'})
+        reciente = encolar_trabajo('analisis_consumo', {'fecha_inicio': '2024-02-01'})
+        TrabajoAnalisis.objects.filter(pk=terminado.id).update(creado=timezone.now() - timedelta(days=30))
+        TrabajoAnalisis.objects.filter(pk=activo.id).update(creado=timezone.now() - timedelta(hours=1))
+        self.assertEqual(limpiar_trabajos(), 1)
+        activo.refresh_from_db()
+        reciente.refresh_from_db()
+        self.assertEqual(activo.estado, 'error')
+        self.assertEqual(reciente.estado, 'pendiente')
+        self.assertFalse(TrabajoAnalisis.objects.filter(pk=terminado.id).exists())
+
+
+class RecomendacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create(username='recomendaciones')
+        cls.perfil = PerfilNutricional.objects.create(usuario=cls.usuario, edad=30, sexo='Hombre', peso=80,
+                                                      altura=Decimal('1.80'), nivel_actividad='moderado')
+        cls.calcio = Nutriente.objects.create(nombre='Calcio', tipo='mineral')
+        cls.pollo = Alimento.objects.create(usuario=cls.usuario, nombre='Pollo', calorias=165, proteinas=31,
+                                            carbohidratos=0, grasas=4)
+        cls.arroz = Alimento.objects.create(usuario=cls.usuario, nombre='Arroz', calorias=130, proteinas=3,
+                                            carbohidratos=28, grasas=0)
+        cls.torta = Alimento.objects.create(usuario=cls.usuario, nombre='Torta', calorias=3500, proteinas=5,
+                                            carbohidratos=50, grasas=30)
+
+    def analisis(self, **consumido):
+        necesidades = self.perfil.necesidades_nutricionales()
+        totales = {'calorias': 0.0, 'proteinas': 0.0, 'carbohidratos': 0.0, 'grasas': 0.0, **consumido}
+        return construir_analisis(totales['calorias'], totales['proteinas'], totales['carbohidratos'],
+                                  totales['grasas'], {}, necesidades), necesidades
+
+    def test_prioriza_lo_que_falta_y_penaliza_el_exceso_de_calorias(self):
+        # Sin déficit de carbohidratos: el arroz sólo aporta proteínas y la torta excede las calorías del día
+        analisis, necesidades = self.analisis(carbohidratos=self.perfil.necesidades_nutricionales()['carbohidratos'])
+        sugerencias = recomendar_alimentos(self.usuario, analisis, necesidades, k=2)
+        self.assertEqual([alimento.nombre for alimento in sugerencias], ['Pollo', 'Arroz'])
+
+    def test_los_cambios_de_nutrientes_actualizan_el_vector(self):
+        reconstruir_vectores(self.usuario.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            AlimentoNutriente.objects.create(alimento=self.arroz, nutriente=self.calcio, cantidad=900, unidad='mg')
+        self.assertEqual(VectorNutricional.objects.get(alimento=self.arroz).micronutrientes, {'Calcio': 900.0})
+
+        # Con los macronutrientes cubiertos sólo cuenta el calcio que falta
+        analisis, necesidades = self.analisis(proteinas=500, carbohidratos=500, grasas=500)
+        self.assertEqual(recomendar_alimentos(self.usuario, analisis, necesidades, k=1), [self.arroz])
+
+    def test_plan_cubre_lo_que_falta_sin_pasarse_de_calorias(self):
+        analisis, necesidades = self.analisis()
+        faltantes = deficits(analisis, necesidades)
+        faltantes['calorias'] = (necesidades['calorias'], necesidades['calorias'])
+        cantidades, completo = resolver_plan(vectores_de_usuario(self.usuario), faltantes, 1000, 2, 1)
+        self.assertTrue(completo)
+        self.assertLessEqual(len(cantidades), 2)
+        self.assertNotIn(self.torta.id, cantidades)
+        calorias = {self.pollo.id: 165, self.arroz.id: 130}
+        self.assertLessEqual(sum(calorias[alimento] * cantidad for alimento, cantidad in cantidades.items()), 1000)
+
+        _, completo = resolver_plan(vectores_de_usuario(self.usuario), faltantes, 1000, 2, 0)
+        self.assertFalse(completo)
+
+    def test_plan_cacheado_hasta_que_cambia_el_diario(self):
+        cache.clear()
+        analisis, necesidades = self.analisis()
+        plan = plan_de_comidas(self.usuario, analisis, necesidades)
+        self.assertTrue(plan['items'])
+        # Sólo la lectura de las versiones
+        with self.assertNumQueries(1):
+            self.assertEqual(plan_de_comidas(self.usuario, analisis, necesidades), plan)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroDiario.objects.create(usuario=self.usuario, alimento=self.pollo, cantidad=1)
+        with self.assertNumQueries(4):
+            plan_de_comidas(self.usuario, analisis, necesidades)
+
+
+class MetricasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', CLAVE)
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+
+    def setUp(self):
+        registro_metricas.reiniciar()
+
+    def test_server_timing_cuenta_las_consultas_de_la_vista(self):
+        self.client.login(username='admin', password=CLAVE)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('listar_nutrientes'))
+        cabecera = respuesta['Server-Timing']
+        self.assertIn(f'desc="{len(consultas)} consultas"', cabecera)
+        self.assertIn('tpl;dur=', cabecera)
+        self.assertIn('total;dur=', cabecera)
+
+    def test_histogramas_por_vista_solo_para_superusuarios(self):
+        self.client.login(username='admin', password=CLAVE)
+        self.client.get(reverse('listar_nutrientes'))
+        self.client.get(reverse('listar_nutrientes'))
+        texto = self.client.get(reverse('metricas')).content.decode()
+        self.assertIn('nutricion_solicitud_segundos_count{vista="listar_nutrientes",metodo="GET"} 2', texto)
+        self.assertIn('nutricion_solicitud_segundos_bucket{vista="listar_nutrientes",metodo="GET",le="+Inf"} 2', texto)
+
+        self.client.login(username='normal', password=CLAVE)
+        self.assertEqual(self.client.get(reverse('metricas')).status_code, 302)
+
+    def test_metodos_no_estandar_se_agrupan(self):
+        self.client.login(username='admin', password=CLAVE)
+        for metodo in ('BREW', 'X"Y', 'PROPFIND'):
+            self.client.generic(metodo, reverse('listar_nutrientes'))
+        texto = self.client.get(reverse('metricas')).content.decode()
+        self.assertIn('nutricion_solicitud_segundos_count{vista="listar_nutrientes",metodo="OTHER"} 3', texto)
+        self.assertNotIn('BREW', texto)
+
+
+class CompresionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        alimentos = Alimento.objects.bulk_create([
+            Alimento(usuario=cls.usuario, nombre=f'Alimento {i}', calorias=100, proteinas=5, carbohidratos=10, grasas=2)
+            for i in range(30)
+        ])
+        RegistroDiario.objects.bulk_create([
+            RegistroDiario(usuario=cls.usuario, alimento=alimento, cantidad=1) for alimento in alimentos * 40
+        ])
+
+    def setUp(self):
+        self.client.login(username='normal', password=CLAVE)
+
+    def test_paginas_en_gzip(self):
+        plano = self.client.get(reverse('listar_alimentos'))
+        comprimido = self.client.get(reverse('listar_alimentos'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(comprimido['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', comprimido['Vary'])
+        self.assertLess(len(comprimido.content), len(plano.content) / 3)
+        self.assertEqual(gzip.decompress(comprimido.content), plano.content)
+
+    def test_streaming_en_gzip_por_fragmentos(self):
+        plano = b''.join(self.client.get(reverse('exportar_historial')).streaming_content)
+        respuesta = self.client.get(reverse('exportar_historial'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        fragmentos = list(respuesta.streaming_content)
+        # cada fragmento de filas se envía comprimido en cuanto se genera, sin esperar al resto
+        self.assertGreater(len(fragmentos), 3)
+        self.assertEqual(gzip.decompress(b''.join(fragmentos)), plano)
+
+    @skipUnless(importlib.util.find_spec('brotli'), 'brotli no está instalado')
+    def test_brotli_si_el_cliente_lo_acepta(self):
+        import brotli
+        with self.settings(COMPRESION_BROTLI=True):
+            plano = self.client.get(reverse('listar_alimentos'))
+            respuesta = self.client.get(reverse('listar_alimentos'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(respuesta['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(respuesta.content), plano.content)
+
+    def test_minificar_conserva_pre_scripts_y_etiquetas(self):
+        fuente = (
+            '<html>\n    <!-- cabecera -->\n    <head>  \n\n\n        <title>x</title>\n    </head>\n'
+            '    <!--{% if user %}-->\n    <pre>\n    a\n\n    b</pre>\n'
+            '    <script>\n        var a = 1 // uno\n        var b = 2\n    </script>\n</html>\n'
+        )
+        self.assertEqual(minificar_html(fuente), (
+            '<html>\n<head>\n<title>x</title>\n</head>\n<!--{% if user %}-->\n<pre>\n    a\n\n    b</pre>\n'
+            '<script>\nvar a = 1 // uno\nvar b = 2\n</script>\n</html>'
+        ))
+
+
+class EstaticosTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directorio = tempfile.TemporaryDirectory()
+        cls.enterClassContext(override_settings(STATIC_ROOT=cls.directorio.name))
+        call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin', 'rest_framework'])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.directorio.cleanup()
+
+    def test_nombre_con_hash_precomprimido_e_inmutable(self):
+        url = static('css/style.css')
+        self.assertRegex(url, r'^/static/css/style\.[0-9a-f]{12}\.css$')
+        respuesta = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        self.assertEqual(respuesta['Cache-Control'], 'public, max-age=31536000, immutable')
+        contenido = gzip.decompress(b''.join(respuesta.streaming_content)).decode()
+        # las referencias del CSS también apuntan a nombres con hash
+        self.assertRegex(contenido, r'url\("\.\./images/hero-bg\.[0-9a-f]{12}\.jpg"\)')
+
+    def test_nombre_original_con_cache_corta_y_304(self):
+        respuesta = self.client.get('/static/css/style.css')
+        self.assertEqual(respuesta['Cache-Control'], 'public, max-age=60')
+        self.assertNotIn('Content-Encoding', respuesta)
+        respuesta = self.client.get('/static/css/style.css', HTTP_IF_MODIFIED_SINCE=respuesta['Last-Modified'])
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+
+
+class BaseDatosTests(TestCase):
+    def test_lecturas_analiticas_van_a_la_replica_y_las_escrituras_a_default(self):
+        router = RouterAnalitica()
+        self.assertIsNone(router.db_for_read(RegistroDiario))
+        with lecturas_analiticas():
+            self.assertEqual(router.db_for_read(RegistroDiario), alias_analitica())
+            self.assertEqual(router.db_for_write(RegistroDiario), 'default')
+        self.assertIsNone(router.db_for_read(RegistroDiario))
+        self.assertFalse(router.allow_migrate(ALIAS_ANALITICA, 'base'))
+
+    def test_pragmas_sqlite_en_cada_conexion(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('sólo SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64000)
+
+
+class GetCondicionalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        cls.otro = User.objects.create_user('otro', password=CLAVE)
+        PerfilNutricional.objects.create(usuario=cls.usuario, edad=30, sexo='Mujer', peso=60,
+                                         altura=Decimal('1.65'), nivel_actividad='moderado')
+        cls.alimento = Alimento.objects.create(usuario=cls.usuario, nombre='Pan', calorias=250, proteinas=8,
+                                               carbohidratos=50, grasas=2)
+        cls.ajeno = Alimento.objects.create(usuario=cls.otro, nombre='Queso', calorias=350, proteinas=25,
+                                            carbohidratos=1, grasas=28)
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='normal', password=CLAVE)
+
+    def revalidar(self, url, respuesta):
+        # Sólo la sesión, el usuario y las versiones: ni la vista ni el render llegan a ejecutarse
+        with self.assertNumQueries(3):
+            return self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+
+    def test_304_sin_consultas_hasta_que_cambian_los_datos(self):
+        for url in (reverse('listar_alimentos'), reverse('analisis_nutricional'), reverse('alimento-list'),
+                    reverse('alimento-detail', args=[self.alimento.id])):
+            with self.subTest(url=url):
+                respuesta = self.client.get(url)
+                self.assertEqual(respuesta.status_code, 200)
+                self.assertIn('no-cache', respuesta['Cache-Control'])
+                self.assertIn('Last-Modified', respuesta)
+                self.assertEqual(self.revalidar(url, respuesta).status_code, 304)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    AlimentoNutriente.objects.create(alimento=self.alimento, unidad='mg', cantidad=1,
+                                                     nutriente=Nutriente.objects.create(nombre=url, tipo='mineral'))
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 200)
+
+    def test_el_etag_depende_del_usuario_y_de_sus_datos(self):
+        url = reverse('analisis_nutricional')
+        respuesta = self.client.get(url)
+        # Los cambios de otro usuario no invalidan la página
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroDiario.objects.create(usuario=self.otro, alimento=self.ajeno, cantidad=1)
+        self.assertEqual(self.revalidar(url, respuesta).status_code, 304)
+        # registrar_comida usa bulk_create, sin señales
+        with self.captureOnCommitCallbacks(execute=True):
+            registrar_comida(self.usuario, [(self.alimento.id, 1)])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 200)
+
+        self.client.login(username='otro', password=CLAVE)
+        url = reverse('alimento-list')
+        respuesta = self.client.get(url)
+        self.client.login(username='normal', password=CLAVE)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 200)
+
+    def test_las_versiones_no_dependen_de_la_cache_del_proceso(self):
+        url = reverse('listar_alimentos')
+        respuesta = self.client.get(url)
+        # Otro worker (u otra caché local) ve las mismas versiones
+        cache.clear()
+        self.assertEqual(self.revalidar(url, respuesta).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Alimento.objects.filter(pk=self.alimento.pk).update(nombre='Pan integral')
+            incrementar_al_confirmar(AMBITO_ALIMENTOS)
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 200)
+
+    def test_el_etag_depende_de_los_parametros(self):
+        url = reverse('api_tendencias')
+        respuesta = self.client.get(url, {'desde': '2024-01-01', 'agrupacion': 'semana'})
+        self.assertEqual(self.revalidar(f'{url}?agrupacion=semana&desde=2024-01-01', respuesta).status_code, 304)
+        otra = self.client.get(url, {'desde': '2024-01-01', 'agrupacion': 'mes'}, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(otra.status_code, 200)
+        self.assertNotEqual(otra['ETag'], respuesta['ETag'])
+
+
+class TendenciasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        cls.lentejas = Alimento.objects.create(usuario=cls.usuario, nombre='Lentejas', calorias=200, proteinas=10,
+                                               carbohidratos=30, grasas=1)
+        AlimentoNutriente.objects.create(alimento=cls.lentejas, nutriente=hierro, cantidad=3, unidad='mg')
+        # Lunes 2024-01-01 a domingo 2024-01-14, con una porción el primer día de cada semana y dos el resto
+        cls.desde = date(2024, 1, 1)
+        for dia in range(14):
+            registro = RegistroDiario.objects.create(usuario=cls.usuario, alimento=cls.lentejas,
+                                                     cantidad=1 if dia % 7 == 0 else 2)
+            RegistroDiario.objects.filter(pk=registro.pk).update(fecha=cls.desde + timedelta(days=dia))
+        reconstruir_ingestas()
+
+    def test_promedios_por_semana(self):
+        # Con el catálogo de nutrientes ya revisado: sólo las dos consultas agrupadas
+        catalogo_nutrientes.nutrientes()
+        with self.assertNumQueries(2):
+            serie = tendencias(self.usuario.id, self.desde, self.desde + timedelta(days=730), 'semana')
+        self.assertEqual([punto['periodo'] for punto in serie['puntos']], [date(2024, 1, 1), date(2024, 1, 8)])
+        punto = serie['puntos'][0]
+        self.assertEqual(punto['dias'], 7)
+        # Como en IngestaDiaria, todo se multiplica por la cantidad: (1 + 6 * 2) porciones en 7 días
+        self.assertEqual(punto['calorias'], round(200 * 13 / 7, 2))
+        self.assertEqual(punto['micronutrientes'], {'Hierro': round(3 * 13 / 7, 2)})
+
+    def test_reduce_a_max_puntos(self):
+        serie = tendencias(self.usuario.id, self.desde, self.desde + timedelta(days=13), 'dia', max_puntos=5)
+        self.assertEqual(serie['periodos_por_punto'], 3)
+        self.assertEqual([punto['dias'] for punto in serie['puntos']], [3, 3, 3, 3, 2])
+        self.assertEqual(serie['puntos'][0]['micronutrientes'], {'Hierro': round(3 * 5 / 3, 2)})
+
+    def test_api_valida_los_parametros(self):
+        self.client.login(username='normal', password=CLAVE)
+        url = reverse('api_tendencias')
+        respuesta = self.client.get(url, {'desde': '2024-01-01', 'hasta': '2024-01-31', 'agrupacion': 'mes'})
+        self.assertEqual(respuesta.json()['puntos'][0]['dias'], 14)
+        self.assertEqual(self.client.get(url, {'agrupacion': 'hora'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'max_puntos': '0'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'desde': '2024-02-01', 'hasta': '2024-01-01'}).status_code, 400)
+
+
+class CatalogoNutrientesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        cls.otro = Nutriente.objects.create(nombre='Selenio', tipo='mineral')
+
+    def test_se_carga_una_vez_y_se_recarga_al_cambiar_la_version(self):
+        catalogo_nutrientes.nueva_peticion()
+        info = catalogo_nutrientes.info(self.hierro.id)
+        self.assertEqual((info.nombre, info.tipo, info.necesidad), ('Hierro', 'mineral', 18.0))
+        self.assertIsNone(catalogo_nutrientes.info(self.otro.id).necesidad)
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogo_nutrientes.por_nombre({self.hierro.id: 1.5, self.otro.id: 2}),
+                             {'Hierro': 1.5, 'Selenio': 2})
+
+        # Otro worker cambia el nutriente: aquí sólo se ve la versión nueva, desde la petición siguiente
+        Nutriente.objects.filter(pk=self.otro.pk).update(nombre='Zinc')
+        incrementar_versiones(AMBITO_CATALOGO)
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogo_nutrientes.info(self.otro.id).nombre, 'Selenio')
+        catalogo_nutrientes.nueva_peticion()
+        with self.assertNumQueries(2):
+            self.assertEqual(catalogo_nutrientes.info(self.otro.id).nombre, 'Zinc')
+        # Sin cambios basta con leer la versión
+        catalogo_nutrientes.nueva_peticion()
+        with self.assertNumQueries(1):
+            self.assertEqual(catalogo_nutrientes.info(self.otro.id).nombre, 'Zinc')
+
+    def test_cambiar_un_nutriente_descarta_el_catalogo_del_proceso(self):
+        catalogo_nutrientes.nutrientes()
+        with self.captureOnCommitCallbacks(execute=True):
+            Nutriente.objects.filter(pk=self.otro.pk).get().delete()
+        self.assertIsNone(catalogo_nutrientes.info(self.otro.id))
+
+    def test_renombrar_un_nutriente_actualiza_las_ingestas(self):
+        usuario = User.objects.create_user('normal', password=CLAVE)
+        lentejas = Alimento.objects.create(usuario=usuario, nombre='Lentejas', calorias=200, proteinas=10,
+                                           carbohidratos=30, grasas=1)
+        AlimentoNutriente.objects.create(alimento=lentejas, nutriente=self.hierro, cantidad=3, unidad='mg')
+        RegistroDiario.objects.create(usuario=usuario, alimento=lentejas, cantidad=1)
+        catalogo_nutrientes.nutrientes()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hierro.nombre = 'Zinc'
+            self.hierro.save()
+        self.assertEqual(IngestaDiaria.objects.get(usuario=usuario).micronutrientes, {'Zinc': 3.0})
+
+    def test_un_id_desconocido_fuerza_la_recarga(self):
+        catalogo_nutrientes.nutrientes()
+        nuevo = Nutriente.objects.bulk_create([Nutriente(nombre='Yodo', tipo='mineral')])[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(catalogo_nutrientes.por_nombre({nuevo.id: 3}), {'Yodo': 3})
+
+
+class ObjetivosPerfilTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        cls.sin_perfil = User.objects.create_user('otro', password=CLAVE)
+
+    def perfil(self, usuario=None, **datos):
+        datos = {'edad': 30, 'sexo': 'Mujer', 'peso': 60, 'altura': Decimal('1.65'), 'nivel_actividad': 'moderado',
+                 **datos}
+        return PerfilNutricional.objects.create(usuario=usuario or self.usuario, **datos)
+
+    def objetivos(self, perfil):
+        perfil.refresh_from_db()
+        return [float(getattr(perfil, campo)) for campo in PerfilNutricional.CAMPOS_OBJETIVOS]
+
+    def test_guardar_calcula_y_guarda_los_objetivos(self):
+        perfil = self.perfil()
+        # BMR = 10 × 60 + 6,25 × 165 − 5 × 30 − 161; calorías = BMR × 1,2 repartidas 15/55/30 %
+        self.assertEqual(self.objetivos(perfil), [1320.25, 1584.3, 59.41, 217.84, 52.81, VERSION_FORMULA])
+
+        # También con update_fields, aunque no incluya los objetivos
+        perfil.peso = 70
+        perfil.save(update_fields=['peso'])
+        self.assertEqual(self.objetivos(perfil)[:2], [1420.25, 1704.3])
+
+    def test_reporte_de_excesos_usa_el_objetivo_de_cada_usuario(self):
+        self.perfil()
+        alimento = Alimento.objects.create(usuario=self.usuario, nombre='Guiso', calorias=800, proteinas=30,
+                                           carbohidratos=80, grasas=30)
+        # 1600 kcal: supera el objetivo del perfil (1584,3) pero no el límite sin perfil (2000)
+        for usuario in (self.usuario, self.sin_perfil):
+            RegistroDiario.objects.create(usuario=usuario, alimento=alimento, cantidad=2)
+        excesos = consultar_excesos()
+        self.assertEqual([(exceso['usuario_id'], float(exceso['limite_calorias'])) for exceso in excesos],
+                         [(self.usuario.id, 1584.3)])
+
+        RegistroDiario.objects.create(usuario=self.sin_perfil, alimento=alimento, cantidad=1)
+        self.assertEqual([(exceso['usuario_id'], float(exceso['limite_calorias'])) for exceso in consultar_excesos()],
+                         [(self.usuario.id, 1584.3), (self.sin_perfil.id, LIMITE_CALORIAS_SIN_PERFIL)])
+
+    def test_recalcular_objetivos_solo_los_de_otra_version(self):
+        viejo = self.perfil()
+        actual = self.perfil(self.sin_perfil, sexo='Hombre', peso=80, altura=Decimal('1.80'), edad=40)
+        PerfilNutricional.objects.filter(pk=viejo.pk).update(calorias_objetivo=1, version_formula=VERSION_FORMULA - 1)
+        PerfilNutricional.objects.filter(pk=actual.pk).update(calorias_objetivo=1)
+
+        salida = StringIO()
+        call_command('recalcular_objetivos', stdout=salida)
+        self.assertIn('Objetivos recalculados para 1 perfiles', salida.getvalue())
+        objetivos = self.objetivos(viejo)
+        self.assertEqual((objetivos[1], objetivos[-1]), (1584.3, VERSION_FORMULA))
+        self.assertEqual(self.objetivos(actual)[1], 1)
+
+        call_command('recalcular_objetivos', '--todos', stdout=StringIO())
+        # BMR = 10 × 80 + 6,25 × 180 − 5 × 40 + 5 = 1730
+        self.assertEqual(self.objetivos(actual)[:2], [1730, 2076])
+
+
+class ReporteExcesosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password=CLAVE)
+        cls.usuarios = [User.objects.create_user(f'usuario{i}', password=CLAVE) for i in range(3)]
+        cls.desde = date(2024, 1, 1)
+        for usuario in cls.usuarios:
+            alimento = Alimento.objects.create(usuario=usuario, nombre='Banquete', calorias=1100, proteinas=40,
+                                               carbohidratos=100, grasas=60)
+            # Tres días con 2200 kcal (superan el límite sin perfil) y uno con 1100
+            for dia, cantidad in enumerate([2, 2, 1, 2]):
+                registro = RegistroDiario.objects.create(usuario=usuario, alimento=alimento, cantidad=cantidad)
+                RegistroDiario.objects.filter(pk=registro.pk).update(fecha=cls.desde + timedelta(days=dia))
+
+    def claves(self, excesos):
+        return [(exceso['usuario__username'], exceso['fecha'].day) for exceso in excesos]
+
+    def test_paginas_por_keyset_sin_repetir_ni_saltear(self):
+        vistos = []
+        despues = None
+        while True:
+            pagina, siguiente = pagina_excesos(consultar_excesos(), despues, tamano=2)
+            vistos += self.claves(pagina)
+            if siguiente is None:
+                break
+            usuario_id, fecha = siguiente.split(':')
+            despues = (int(usuario_id), date.fromisoformat(fecha))
+        self.assertEqual(vistos, [(usuario.username, dia) for usuario in self.usuarios for dia in (1, 2, 4)])
+        self.assertEqual(float(pagina[-1]['total_calorias']), 2200)
+
+    def test_vista_filtra_y_enlaza_la_pagina_siguiente(self):
+        self.client.login(username='admin', password=CLAVE)
+        respuesta = self.client.get(reverse('reporte_excesos'), {'usuario': 'usuario1', 'desde': '2024-01-02'})
+        self.assertEqual(self.claves(respuesta.context['registros_excesos']), [('usuario1', 2), ('usuario1', 4)])
+        self.assertIsNone(respuesta.context['siguiente'])
+
+        with mock.patch('base.views.pagina_excesos', partial(pagina_excesos, tamano=2)):
+            respuesta = self.client.get(reverse('reporte_excesos'), {'hasta': '2024-01-02'})
+            self.assertEqual(self.claves(respuesta.context['registros_excesos']), [('usuario0', 1), ('usuario0', 2)])
+            siguiente = respuesta.context['siguiente']
+            self.assertIn('hasta=2024-01-02', siguiente)
+            respuesta = self.client.get(reverse('reporte_excesos') + '?' + siguiente)
+        self.assertEqual(self.claves(respuesta.context['registros_excesos']), [('usuario1', 1), ('usuario1', 2)])
+
+        self.assertEqual(self.client.get(reverse('reporte_excesos'), {'usuario': 'nadie'}).context['registros_excesos'],
+                         [])
+        self.assertEqual(self.client.get(reverse('reporte_excesos'), {'despues': 'x'}).status_code, 400)
+
+
+class VistasAsyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        cls.sin_perfil = User.objects.create_user('otro', password=CLAVE)
+        PerfilNutricional.objects.create(usuario=cls.usuario, edad=30, sexo='Mujer', peso=60, altura=Decimal('1.65'),
+                                         nivel_actividad='moderado')
+        hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        lentejas = Alimento.objects.create(usuario=cls.usuario, nombre='Lentejas', calorias=200, proteinas=10,
+                                           carbohidratos=30, grasas=1)
+        AlimentoNutriente.objects.create(alimento=lentejas, nutriente=hierro, cantidad=3, unidad='mg')
+        cls.hace_tres_dias = date.today() - timedelta(days=3)
+        RegistroDiario.objects.create(usuario=cls.usuario, alimento=lentejas, cantidad=2)
+        anterior = RegistroDiario.objects.create(usuario=cls.usuario, alimento=lentejas, cantidad=1)
+        RegistroDiario.objects.filter(pk=anterior.pk).update(fecha=cls.hace_tres_dias)
+        reconstruir_ingestas()
+
+    def test_requieren_sesion(self):
+        respuesta = self.client.get(reverse('analisis_nutricional'))
+        self.assertRedirects(respuesta, f"{reverse('login')}?next={reverse('analisis_nutricional')}",
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('api_analisis_nutricional')).status_code, 403)
+        # El análisis por grupos es sólo para superusuarios
+        self.client.login(username='normal', password=CLAVE)
+        self.assertEqual(self.client.get(reverse('analisis-consumo')).status_code, 302)
+
+    def test_analisis_del_dia_en_html_y_json(self):
+        self.client.login(username='normal', password=CLAVE)
+        analisis = self.client.get(reverse('analisis_nutricional')).context['analisis']
+        self.assertEqual((analisis['calorias_consumidas'], analisis['calorias_necesarias']), (400, 1584.3))
+        self.assertEqual(analisis['micronutrientes_consumidos'], {'Hierro': 6.0})
+
+        datos = self.client.get(reverse('api_analisis_nutricional')).json()
+        self.assertEqual(datos['fecha'], date.today().isoformat())
+        self.assertEqual(datos['necesidades']['calorias'], 1584.3)
+        self.assertEqual(datos['analisis']['calorias_consumidas'], 400)
+
+        self.client.login(username='otro', password=CLAVE)
+        self.assertEqual(self.client.get(reverse('analisis_nutricional')).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api_analisis_nutricional')).status_code, 404)
+
+    def test_analisis_por_grupos_pendiente_y_luego_desde_la_cache(self):
+        cache.clear()
+        User.objects.create_superuser('admin', password=CLAVE)
+        self.client.login(username='admin', password=CLAVE)
+        # Sin resultado en la caché se encola un trabajo y se responde con su estado
+        respuesta = self.client.get(reverse('analisis-consumo'))
+        self.assertEqual(respuesta.context['trabajo'].estado, 'pendiente')
+        AnalisisConsumoService().precalentar()
+        datos = self.client.get(reverse('analisis-consumo')).context['datos_graficos']
+        # Todo el historial del único perfil (30 años): 2 + 1 porciones de lentejas
+        self.assertEqual((datos['menores_30']['calorias'], datos['mayores_30']['calorias']), (0, 600))
+        self.assertEqual(datos['mayores_30']['nutrientes'], {'Hierro': 9.0})
+
+    def test_ingestas_del_mas_reciente_al_mas_antiguo(self):
+        self.client.login(username='normal', password=CLAVE)
+        ingestas = self.client.get(reverse('api_ingestas')).json()['results']
+        self.assertEqual([(ingesta['fecha'], ingesta['calorias']) for ingesta in ingestas],
+                         [(date.today().isoformat(), '400.00'), (self.hace_tres_dias.isoformat(), '200.00')])
+        filtradas = self.client.get(reverse('api_ingestas'), {'hasta': self.hace_tres_dias.isoformat()}).json()
+        self.assertEqual([ingesta['fecha'] for ingesta in filtradas['results']], [self.hace_tres_dias.isoformat()])
+        self.assertEqual(self.client.get(reverse('api_ingestas'), {'desde': '2024-02-30'}).status_code, 400)
+
+
+class IngestaDiariaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        cls.hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        cls.pan = Alimento.objects.create(usuario=cls.usuario, nombre='Pan', calorias=250, proteinas=8,
+                                          carbohidratos=50, grasas=2)
+        cls.lentejas = Alimento.objects.create(usuario=cls.usuario, nombre='Lentejas', calorias=200, proteinas=10,
+                                               carbohidratos=30, grasas=1)
+        AlimentoNutriente.objects.create(alimento=cls.lentejas, nutriente=cls.hierro, cantidad=3, unidad='mg')
+
+    def ingesta(self, usuario=None, fecha=None):
+        return IngestaDiaria.objects.filter(usuario=usuario or self.usuario, fecha=fecha or date.today()).first()
+
+    def assertIngesta(self, calorias, micronutrientes, **filtro):
+        ingesta = self.ingesta(**filtro)
+        self.assertEqual((float(ingesta.calorias), ingesta.micronutrientes), (calorias, micronutrientes))
+
+    def test_crear_editar_y_eliminar_registros(self):
+        pan = RegistroDiario.objects.create(usuario=self.usuario, alimento=self.pan, cantidad=1)
+        self.assertIngesta(250, {})
+        lentejas = RegistroDiario.objects.create(usuario=self.usuario, alimento=self.lentejas, cantidad=2)
+        self.assertIngesta(650, {'Hierro': 6.0})
+
+        lentejas.cantidad = Decimal('0.5')
+        lentejas.save()
+        self.assertIngesta(350, {'Hierro': 1.5})
+
+        # Cambiar la fecha mueve el registro de un día al otro
+        ayer = date.today() - timedelta(days=1)
+        lentejas.fecha = ayer
+        lentejas.save()
+        self.assertIngesta(250, {})
+        self.assertIngesta(100, {'Hierro': 1.5}, fecha=ayer)
+
+        pan.delete()
+        self.assertIsNone(self.ingesta())
+        self.assertIsNotNone(self.ingesta(fecha=ayer))
+
+    def test_cambios_en_alimentos_y_nutrientes(self):
+        RegistroDiario.objects.create(usuario=self.usuario, alimento=self.lentejas, cantidad=2)
+        self.lentejas.calorias = 150
+        self.lentejas.save()
+        self.assertIngesta(300, {'Hierro': 6.0})
+
+        relacion = self.lentejas.alimentonutriente_set.get()
+        relacion.cantidad = 4
+        relacion.save()
+        self.assertIngesta(300, {'Hierro': 8.0})
+        zinc = Nutriente.objects.create(nombre='Zinc', tipo='mineral')
+        AlimentoNutriente.objects.create(alimento=self.lentejas, nutriente=zinc, cantidad=1, unidad='mg')
+        self.assertIngesta(300, {'Hierro': 8.0, 'Zinc': 2.0})
+        relacion.delete()
+        self.assertIngesta(300, {'Zinc': 2.0})
+
+        zinc.delete()
+        self.assertIngesta(300, {})
+        self.lentejas.delete()
+        self.assertIsNone(self.ingesta())
+
+    def test_eliminar_un_usuario_recalcula_una_vez_los_dias_de_otros(self):
+        otro = User.objects.create_user('otro', password=CLAVE)
+        ajeno = Alimento.objects.create(usuario=otro, nombre='Queso', calorias=300, proteinas=20, carbohidratos=1,
+                                        grasas=25)
+        AlimentoNutriente.objects.create(alimento=ajeno, nutriente=self.hierro, cantidad=1, unidad='mg')
+        RegistroDiario.objects.bulk_create([
+            RegistroDiario(usuario=otro, alimento=alimento, cantidad=1) for alimento in [ajeno, self.pan] * 10
+        ])
+        RegistroDiario.objects.create(usuario=self.usuario, alimento=self.pan, cantidad=1)
+        RegistroDiario.objects.create(usuario=self.usuario, alimento=ajeno, cantidad=2)
+        reconstruir_ingestas()
+        self.assertIngesta(850, {'Hierro': 2.0})
+
+        with CaptureQueriesContext(connection) as contexto:
+            otro.delete()
+        self.assertIngesta(250, {})
+        self.assertFalse(IngestaDiaria.objects.filter(usuario_id=otro.id).exists())
+        # Un solo recálculo (sus dos consultas agrupadas), no uno por cada registro eliminado
+        recalculos = [consulta for consulta in contexto.captured_queries if 'SUM(' in consulta['sql']]
+        self.assertEqual(len(recalculos), 2)
+
+    def test_comando_reconstruir_ingestas(self):
+        otro = User.objects.create_user('otro', password=CLAVE)
+        for usuario in (self.usuario, otro):
+            RegistroDiario.objects.create(usuario=usuario, alimento=self.lentejas, cantidad=2)
+        IngestaDiaria.objects.update(calorias=0, micronutrientes={})
+
+        call_command('reconstruir_ingestas', usuario=self.usuario.id, stdout=StringIO())
+        self.assertIngesta(400, {'Hierro': 6.0})
+        self.assertIngesta(0, {}, usuario=otro)
+
+        salida = StringIO()
+        call_command('reconstruir_ingestas', stdout=salida)
+        self.assertIn('2 totales diarios reconstruidos', salida.getvalue())
+        self.assertIngesta(400, {'Hierro': 6.0}, usuario=otro)
+
+
+class RegistroComidaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        cls.otro = User.objects.create_user('otro', password=CLAVE)
+        hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        cls.pan = Alimento.objects.create(usuario=cls.usuario, nombre='Pan', calorias=250, proteinas=8,
+                                          carbohidratos=50, grasas=2)
+        cls.lentejas = Alimento.objects.create(usuario=cls.usuario, nombre='Lentejas', calorias=200, proteinas=10,
+                                               carbohidratos=30, grasas=1)
+        AlimentoNutriente.objects.create(alimento=cls.lentejas, nutriente=hierro, cantidad=3, unidad='mg')
+        cls.ajeno = Alimento.objects.create(usuario=cls.otro, nombre='Queso', calorias=350, proteinas=25,
+                                            carbohidratos=1, grasas=28)
+
+    def setUp(self):
+        self.client.login(username='normal', password=CLAVE)
+
+    def registrar(self, items):
+        return self.client.post(reverse('registrar_comida'), {'items': items}, content_type='application/json')
+
+    def test_registra_todos_los_items_y_devuelve_los_totales_del_dia(self):
+        respuesta = self.registrar([{'alimento': self.pan.id, 'cantidad': '1'},
+                                    {'alimento': self.lentejas.id, 'cantidad': '2'}])
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        self.assertEqual(RegistroDiario.objects.filter(usuario=self.usuario).count(), 2)
+        self.assertEqual(respuesta.json()['registrados'], 2)
+        totales = respuesta.json()['totales']
+        # 250 × 1 + 200 × 2
+        self.assertEqual(float(totales['calorias']), 650)
+        self.assertEqual(totales['micronutrientes'], {'Hierro': 6.0})
+
+    def test_rechaza_cantidades_no_positivas_y_alimentos_ajenos(self):
+        for items in ([{'alimento': self.pan.id, 'cantidad': '0'}],
+                      [{'alimento': self.pan.id, 'cantidad': '-1'}],
+                      [{'alimento': self.ajeno.id, 'cantidad': '1'}],
+                      []):
+            with self.subTest(items=items):
+                self.assertEqual(self.registrar(items).status_code, 400)
+        self.assertFalse(RegistroDiario.objects.exists())
+
+
+class AlimentosApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+        cls.otro = User.objects.create_user('otro', password=CLAVE)
+        cls.admin = User.objects.create_superuser('admin', password=CLAVE)
+        hierro = Nutriente.objects.create(nombre='Hierro', tipo='mineral')
+        cls.propios = [
+            Alimento.objects.create(usuario=cls.usuario, nombre=f'Propio {i}', calorias=100 + i, proteinas=1,
+                                    carbohidratos=1, grasas=1)
+            for i in range(5)
+        ]
+        AlimentoNutriente.objects.create(alimento=cls.propios[0], nutriente=hierro, cantidad=3, unidad='mg')
+        cls.ajeno = Alimento.objects.create(usuario=cls.otro, nombre='Ajeno', calorias=50, proteinas=1,
+                                            carbohidratos=1, grasas=1)
+
+    def setUp(self):
+        self.client.login(username='normal', password=CLAVE)
+
+    def ids(self, respuesta):
+        return [alimento['id'] for alimento in respuesta.json()['results']]
+
+    def test_cada_usuario_ve_solo_sus_alimentos(self):
+        respuesta = self.client.get(reverse('alimento-list'))
+        self.assertEqual(self.ids(respuesta), [alimento.id for alimento in reversed(self.propios)])
+        self.assertEqual(self.client.get(reverse('alimento-detail', args=[self.ajeno.id])).status_code, 404)
+
+        respuesta = self.client.post(reverse('alimento-list'), {**_datos_alimento(self), 'usuario': self.otro.id})
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        self.assertEqual(Alimento.objects.get(pk=respuesta.json()['id']).usuario, self.usuario)
+
+        self.client.login(username='admin', password=CLAVE)
+        self.assertIn(self.ajeno.id, self.ids(self.client.get(reverse('alimento-list'))))
+
+    def test_paginacion_por_cursor(self):
+        vistos = []
+        url = reverse('alimento-list') + '?page_size=2'
+        while url:
+            pagina = self.client.get(url).json()
+            self.assertNotIn('count', pagina)
+            vistos += [alimento['id'] for alimento in pagina['results']]
+            url = pagina['next']
+        self.assertEqual(vistos, [alimento.id for alimento in reversed(self.propios)])
+
+    def test_fields_limita_las_lecturas_pero_no_las_escrituras(self):
+        respuesta = self.client.get(reverse('alimento-detail', args=[self.propios[0].id]) + '?fields=id,nutrientes')
+        self.assertEqual(respuesta.json(), {
+            'id': self.propios[0].id,
+            'nutrientes': [{'id': self.propios[0].alimentonutriente_set.get().nutriente_id, 'nombre': 'Hierro',
+                            'tipo': 'mineral', 'cantidad': '3.00', 'unidad': 'mg'}],
+        })
+        self.assertEqual(set(self.client.get(reverse('alimento-list') + '?fields=id,nombre').json()['results'][0]),
+                         {'id', 'nombre'})
+
+        respuesta = self.client.post(reverse('alimento-list') + '?fields=id', _datos_alimento(self))
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        self.assertEqual(Alimento.objects.get(pk=respuesta.json()['id']).calorias, 120)
+
+
+class BusquedaAlimentosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+
+    def crear(self, nombre, descripcion=''):
+        return Alimento.objects.create(usuario=self.usuario, nombre=nombre, descripcion=descripcion, calorias=100,
+                                       proteinas=1, carbohidratos=20, grasas=0)
+
+    def buscar(self, texto):
+        return set(filtrar_alimentos(Alimento.objects.all(), texto).values_list('nombre', flat=True))
+
+    def test_encuentra_alimentos_creados_editados_y_no_los_eliminados(self):
+        platano = self.crear('Plátano maduro', 'Fruta tropical')
+        self.crear('Pan integral')
+        # Sin distinguir mayúsculas ni acentos, por prefijo y también en la descripción
+        self.assertEqual(self.buscar('PLATANO'), {'Plátano maduro'})
+        self.assertEqual(self.buscar('plat mad'), {'Plátano maduro'})
+        self.assertEqual(self.buscar('tropical'), {'Plátano maduro'})
+
+        platano.nombre = 'Banana'
+        platano.save()
+        self.assertEqual(self.buscar('platano'), set())
+        self.assertEqual(self.buscar('banana'), {'Banana'})
+        # update() y bulk_create no envían señales: los mantienen los triggers
+        Alimento.objects.filter(pk=platano.pk).update(descripcion='Postre')
+        self.assertEqual(self.buscar('tropical'), set())
+        Alimento.objects.bulk_create([Alimento(usuario=self.usuario, nombre='Banana split', calorias=300,
+                                               proteinas=4, carbohidratos=50, grasas=10)])
+        self.assertEqual(self.buscar('banana'), {'Banana', 'Banana split'})
+
+        platano.delete()
+        self.assertEqual(self.buscar('banana'), {'Banana split'})
+
+    def test_autocompletar_por_prefijo_prioriza_el_nombre(self):
+        otro = User.objects.create_user('otro', password=CLAVE)
+        self.crear('Batido', 'Con plátano')
+        self.crear('Plátano maduro')
+        self.crear('Platanitos fritos')
+        Alimento.objects.create(usuario=otro, nombre='Plátano de otro', calorias=90, proteinas=1, carbohidratos=20,
+                                grasas=0)
+
+        nombres = [alimento.nombre for alimento in autocompletar_alimentos('pla', self.usuario)]
+        # Primero los que coinciden en el nombre (el más corto antes), después los que sólo lo hacen en la descripción
+        self.assertEqual(nombres, ['Plátano maduro', 'Platanitos fritos', 'Batido'])
+        self.assertEqual(len(autocompletar_alimentos('pla', self.usuario, limite=1)), 1)
+        self.assertIn('Plátano de otro', [alimento.nombre for alimento in autocompletar_alimentos('pla')])
+        self.assertEqual(autocompletar_alimentos('', self.usuario), [])
+
+    def test_repone_los_triggers_que_borra_una_migracion(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('sólo SQLite')
+        self.assertFalse(asegurar_indice())
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER base_alimento_busqueda_ai')
+        sin_indexar = self.crear('Plátano maduro')
+        self.assertEqual(self.buscar('platano'), set())
+
+        with self.assertLogs('base.busqueda_service', 'WARNING'):
+            self.assertTrue(asegurar_indice())
+        # El índice se reconstruye con lo que se creó sin trigger, y los nuevos vuelven a indexarse
+        self.crear('Plátano verde')
+        self.assertEqual(self.buscar('platano'), {sin_indexar.nombre, 'Plátano verde'})
+
+
+def _png(color, tamano=(800, 400)):
+    salida = BytesIO()
+    Image.new('RGB', tamano, color).save(salida, 'PNG')
+    return salida.getvalue()
+
+
+# Guarda la imagen como lo haría un formulario (nombre por contenido) y la asigna con update(), sin las señales que
+# encolan las miniaturas en el pool de hilos.
+def _alimento_con_imagen(usuario, contenido, nombre='Manzana'):
+    alimento = Alimento.objects.create(usuario=usuario, nombre=nombre, calorias=50, proteinas=0, carbohidratos=14,
+                                       grasas=0)
+    imagen = Alimento._meta.get_field('imagen').storage.save('alimentos_imagenes/foto.png', ContentFile(contenido))
+    Alimento.objects.filter(pk=alimento.pk).update(imagen=imagen)
+    return Alimento.objects.get(pk=alimento.pk)
+
+
+def _alimento_guardado(usuario, contenido, nombre_archivo):
+    return Alimento.objects.create(usuario=usuario, nombre='Manzana', calorias=50, proteinas=0, carbohidratos=14,
+                                   grasas=0, imagen=ContentFile(contenido, name=nombre_archivo))
+
+def _rutas(derivados):
+    return [tamano[formato] for tamano in derivados['tamanos'].values() for formato in ('webp', 'jpeg')]
+
+
+class MediaTemporalMixin:
+    def setUp(self):
+        super().setUp()
+        directorio = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=directorio, IMAGENES_HILOS=0))
+
+
+class ImagenesTests(MediaTemporalMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('normal', password=CLAVE)
+
+    def test_miniaturas_nombradas_por_el_origen_y_compartidas(self):
+        manzana = _alimento_con_imagen(self.usuario, _png('red'))
+        digest = os.path.splitext(os.path.basename(manzana.imagen.name))[0]
+        derivados = generar_derivados(manzana.pk)
+
+        self.assertEqual(derivados['origen'], manzana.imagen.name)
+        self.assertEqual(derivados['tamanos']['50'], {
+            'ancho': 100, 'alto': 50,
+            'webp': f'alimentos_imagenes/derivados/{digest}_50.webp',
+            'jpeg': f'alimentos_imagenes/derivados/{digest}_50.jpeg',
+        })
+        manzana.refresh_from_db()
+        self.assertEqual(tamanos_vigentes(manzana), derivados['tamanos'])
+        self.assertEqual(srcset(manzana, 50, 'webp'), f'/media/alimentos_imagenes/derivados/{digest}_50.webp 1x, '
+                                                      f'/media/alimentos_imagenes/derivados/{digest}_100.webp 2x')
+
+        # Otro alimento con la misma imagen reutiliza las miniaturas sin volver a codificarlas
+        modificadas = {ruta: default_storage.get_modified_time(ruta) for ruta in _rutas(derivados)}
+        roja = _alimento_con_imagen(self.usuario, _png('red'), 'Manzana roja')
+        self.assertEqual(roja.imagen.name, manzana.imagen.name)
+        self.assertEqual(generar_derivados(roja.pk), derivados)
+        self.assertEqual({ruta: default_storage.get_modified_time(ruta) for ruta in _rutas(derivados)}, modificadas)
+
+        # Se eliminan con el último alimento que usa la imagen
+        with self.captureOnCommitCallbacks(execute=True):
+            manzana.delete()
+        self.assertTrue(all(default_storage.exists(ruta) for ruta in _rutas(derivados)))
+        roja.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            roja.delete()
+        self.assertFalse(any(default_storage.exists(ruta) for ruta in _rutas(derivados)))
+
+    def test_reemplazar_la_imagen_elimina_las_miniaturas_anteriores(self):
+        manzana = _alimento_con_imagen(self.usuario, _png('red'))
+        anteriores = generar_derivados(manzana.pk)
+        nueva = Alimento._meta.get_field('imagen').storage.save('alimentos_imagenes/otra.png',
+                                                               ContentFile(_png('green', (300, 300))))
+        Alimento.objects.filter(pk=manzana.pk).update(imagen=nueva)
+
+        derivados = generar_derivados(manzana.pk)
+        self.assertEqual(derivados['tamanos']['400']['ancho'], 300)
+        self.assertFalse(any(default_storage.exists(ruta) for ruta in _rutas(anteriores)))
+        self.assertTrue(all(default_storage.exists(ruta) for ruta in _rutas(derivados)))
+
+
+    def test_imagenes_nombradas_por_contenido_y_compartidas(self):
+        roja = _png('red')
+        primera = _alimento_guardado(self.usuario, roja, 'uno.png')
+        segunda = _alimento_guardado(self.usuario, roja, 'Dos.PNG')
+        verde = _alimento_guardado(self.usuario, _png('green'), 'uno.png')
+
+        nombre = f'alimentos_imagenes/{hashlib.sha256(roja).hexdigest()}.png'
+        self.assertEqual(primera.imagen.name, nombre)
+        self.assertEqual(segunda.imagen.name, nombre)
+        self.assertNotEqual(verde.imagen.name, nombre)
+        self.assertEqual(sorted(default_storage.listdir('alimentos_imagenes')[1]),
+                         sorted(os.path.basename(alimento.imagen.name) for alimento in (primera, verde)))
+
+    def test_archivo_compartido_se_elimina_con_su_ultimo_alimento(self):
+        primera = _alimento_guardado(self.usuario, _png('red'), 'uno.png')
+        segunda = _alimento_guardado(self.usuario, _png('red'), 'dos.png')
+        nombre = primera.imagen.name
+
+        # Reemplazar la imagen de uno no borra el archivo que el otro sigue usando
+        with self.captureOnCommitCallbacks(execute=True):
+            primera.imagen = ContentFile(_png('blue'), name='uno.png')
+            primera.save()
+        self.assertTrue(default_storage.exists(nombre))
+        with self.captureOnCommitCallbacks(execute=True):
+            segunda.delete()
+        self.assertFalse(default_storage.exists(nombre))
+        self.assertTrue(default_storage.exists(primera.imagen.name))
+
+    def test_deduplicar_imagenes_migra_los_archivos_anteriores(self):
+        roja = _png('red')
+        carpeta = default_storage.path('alimentos_imagenes')
+        os.makedirs(carpeta, exist_ok=True)
+        for archivo, contenido in (('vieja.png', roja), ('vieja_x1y2.png', roja), ('huerfana.png', _png('blue'))):
+            with open(os.path.join(carpeta, archivo), 'wb') as destino:
+                destino.write(contenido)
+        verde = _alimento_guardado(self.usuario, _png('green'), 'verde.png')
+        ids = []
+        for archivo in ('vieja.png', 'vieja_x1y2.png'):
+            alimento = Alimento.objects.create(usuario=self.usuario, nombre='Manzana', calorias=50, proteinas=0,
+                                               carbohidratos=14, grasas=0)
+            Alimento.objects.filter(pk=alimento.pk).update(imagen=f'alimentos_imagenes/{archivo}')
+            ids.append(alimento.pk)
+
+        call_command('deduplicar_imagenes', '--simular', '--huerfanos', stdout=StringIO())
+        self.assertEqual(len(os.listdir(carpeta)), 4)
+        self.assertEqual(Alimento.objects.get(pk=ids[0]).imagen.name, 'alimentos_imagenes/vieja.png')
+
+        ambitos = (AMBITO_ALIMENTOS, ambito_usuario(self.usuario.id))
+        antes = versiones(*ambitos)
+        salida = StringIO()
+        call_command('deduplicar_imagenes', '--huerfanos', stdout=salida)
+        # Los alimentos cambian sin señales: el comando incrementa las versiones para que no se sirvan URLs viejas
+        self.assertTrue(all(despues > version for despues, version in zip(versiones(*ambitos), antes)))
+        nombre = f'alimentos_imagenes/{hashlib.sha256(roja).hexdigest()}.png'
+        self.assertEqual(set(Alimento.objects.filter(pk__in=ids).values_list('imagen', flat=True)), {nombre})
+        # Quedan el archivo compartido y la imagen verde, que ya tenía nombre por contenido
+        self.assertEqual(sorted(os.listdir(carpeta)),
+                         sorted(os.path.basename(archivo) for archivo in (nombre, verde.imagen.name)))
+        self.assertIn('3 imágenes en uso, 2 archivos únicos; 3 archivos eliminados', salida.getvalue())
+
+class GenerarMiniaturasTests(MediaTemporalMixin, TransactionTestCase):
+    # El comando genera en un pool de hilos, que sólo ven los datos confirmados
+    def test_completa_las_pendientes_y_con_todas_las_regenera(self):
+        usuario = User.objects.create_user('normal', password=CLAVE)
+        manzana = _alimento_con_imagen(usuario, _png('red'))
+        Alimento.objects.create(usuario=usuario, nombre='Sin imagen', calorias=1, proteinas=0, carbohidratos=0,
+                                grasas=0)
+
+        salida = StringIO()
+        call_command('generar_miniaturas', stdout=salida)
+        self.assertIn('Miniaturas generadas para 1 alimentos.', salida.getvalue())
+        manzana.refresh_from_db()
+        derivados = manzana.imagen_derivados
+        self.assertEqual(set(tamanos_vigentes(manzana)), {'50', '100', '400'})
+        self.assertTrue(all(default_storage.exists(ruta) for ruta in _rutas(derivados)))
+
+        salida = StringIO()
+        call_command('generar_miniaturas', stdout=salida)
+        self.assertIn('Miniaturas generadas para 0 alimentos.', salida.getvalue())
+
+        # --todas vuelve a codificarlas con los mismos nombres
+        ruta = derivados['tamanos']['50']['webp']
+        with open(default_storage.path(ruta), 'wb') as archivo:
+            archivo.write(b'danada')
+        call_command('generar_miniaturas', '--todas', stdout=StringIO())
+        manzana.refresh_from_db()
+        self.assertEqual(manzana.imagen_derivados, derivados)
+        with default_storage.open(ruta, 'rb') as archivo:
+            self.assertEqual(Image.open(archivo).format, 'WEBP')
+
+
+class BenchmarkCargaTests(TransactionTestCase):
+    # Los flujos se ejecutan en un pool de hilos, que sólo ven los datos confirmados. Con un solo hilo: la base en
+    # memoria de las pruebas no admite escrituras concurrentes
+    def test_siembra_ejecuta_los_flujos_y_limpia(self):
+        salida = StringIO()
+        call_command('benchmark_carga', usuarios=2, alimentos=3, nutrientes=2, dias=2, registros_por_dia=2, hilos=1,
+                     iteraciones=1, limpiar=True, stdout=salida, stderr=StringIO())
+        reporte = json.loads(salida.getvalue())
+        self.assertEqual(set(reporte['urls']), {'login', 'registro_diario', 'analisis_nutricional',
+                                                'sugerencias_alimentos', 'api_alimentos', 'vista_analisis',
+                                                'reporte_excesos'})
+        self.assertEqual(reporte['urls']['login']['peticiones'], 3)
+        self.assertEqual(reporte['urls']['api_alimentos']['peticiones'], 2)
+        self.assertEqual({url: datos['detalle_errores'] for url, datos in reporte['urls'].items()
+                          if datos['errores']}, {})
+        self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+
+    def test_medir_guarda_el_tipo_y_el_mensaje_del_error(self):
+        from .management.commands.benchmark_carga import Command
+
+        def falla():
+            raise ConnectionError('servidor caído')
+
+        muestras = []
+        comando = Command()
+        comando.medir(muestras, 'ok', lambda: 200)
+        comando.medir(muestras, 'http', lambda: 503)
+        comando.medir(muestras, 'excepcion', falla)
+        self.assertEqual([(nombre, error) for nombre, _, error in muestras],
+                         [('ok', None), ('http', 'HTTP 503'), ('excepcion', 'ConnectionError: servidor caído')])
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from base.analisis_service import AnalisisConsumoService
+from base.models import ESTADOS_TRABAJO_ACTIVOS, TrabajoAnalisis
+
+logger = logging.getLogger(__name__)
+
+_ejecutor = None
+_ejecutor_lock = Lock()
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    with _ejecutor_lock:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=getattr(settings, 'TRABAJOS_HILOS', 2),
+                                           thread_name_prefix='trabajos')
+        return _ejecutor
+
+
+def _analisis_consumo(fecha_inicio=None, fecha_fin=None):
+    return AnalisisConsumoService().calcular(fecha_inicio, fecha_fin)
+
+
+def _guardar_analisis_consumo(resultado, fecha_inicio=None, fecha_fin=None):
+    # Deja el resultado en la caché para las vistas que la consultan
+    AnalisisConsumoService().guardar(resultado, fecha_inicio, fecha_fin)
+
+
+# Tareas que se pueden encolar: tipo -> función que recibe los parámetros del trabajo y devuelve un resultado
+# serializable en JSON.
+TAREAS = {
+    'analisis_consumo': _analisis_consumo,
+}
+# Qué hacer con el resultado de un trabajo sólo si se completó (no si se canceló mientras corría): tipo -> función
+# que recibe el resultado y los parámetros del trabajo.
+AL_COMPLETAR = {
+    'analisis_consumo': _guardar_analisis_consumo,
+}
+
+
+def clave_trabajo(tipo, parametros):
+    contenido = json.dumps([tipo, parametros], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+# Marca como error los trabajos activos más viejos que TRABAJOS_TIEMPO_MAXIMO: el proceso que los tenía en su pool
+# terminó sin completarlos (reinicio, despliegue) y, si siguieran activos, bloquearían los pedidos con la misma clave.
+def _abandonar_vencidos(**filtros):
+    limite = timezone.now() - timedelta(seconds=getattr(settings, 'TRABAJOS_TIEMPO_MAXIMO', 1800))
+    return TrabajoAnalisis.objects.filter(estado__in=ESTADOS_TRABAJO_ACTIVOS, creado__lt=limite, **filtros).update(
+        estado='error', error='Trabajo abandonado', terminado=timezone.now()
+    )
+
+
+# Encola una tarea de TAREAS y devuelve su TrabajoAnalisis. Si ya hay un trabajo activo con la misma tarea y
+# parámetros (o uno completado hace menos de TRABAJOS_VIGENCIA_RESULTADO segundos) devuelve ese en vez de crear otro.
+# La ejecución empieza al confirmarse la transacción en curso, en el pool de hilos del proceso.
+def encolar_trabajo(tipo, parametros=None, usuario=None):
+    if tipo not in TAREAS:
+        raise ValueError(f'Tarea desconocida: {tipo!r}')
+    parametros = parametros or {}
+    clave = clave_trabajo(tipo, parametros)
+    _abandonar_vencidos(clave=clave)
+
+    vigencia = timezone.now() - timedelta(seconds=getattr(settings, 'TRABAJOS_VIGENCIA_RESULTADO', 300))
+    existente = TrabajoAnalisis.objects.filter(
+        Q(estado__in=ESTADOS_TRABAJO_ACTIVOS) | Q(estado='completado', terminado__gte=vigencia), clave=clave
+    ).order_by('-creado').first()
+    if existente is not None:
+        return existente
+
+    try:
+        with transaction.atomic():
+            trabajo = TrabajoAnalisis.objects.create(tipo=tipo, parametros=parametros, clave=clave,
+                                                     solicitado_por=usuario)
+    except IntegrityError:
+        # Un pedido idéntico creó el trabajo al mismo tiempo (restricción trabajo_activo_por_clave)
+        return TrabajoAnalisis.objects.get(clave=clave, estado__in=ESTADOS_TRABAJO_ACTIVOS)
+    trabajo_id = trabajo.pk
+    transaction.on_commit(lambda: _obtener_ejecutor().submit(ejecutar_trabajo_en_hilo, trabajo_id))
+    return trabajo
+
+
+# Ejecuta un trabajo pendiente y guarda su resultado. Cada cambio de estado es un UPDATE condicionado al estado
+# anterior: un trabajo cancelado antes de empezar no se ejecuta, y si se cancela mientras corre su resultado se
+# descarta. Devuelve el resultado, o None si el trabajo no se ejecutó o falló.
+def ejecutar_trabajo(trabajo_id):
+    if not TrabajoAnalisis.objects.filter(pk=trabajo_id, estado='pendiente').update(
+            estado='en_curso', iniciado=timezone.now()):
+        return None
+    trabajo = TrabajoAnalisis.objects.get(pk=trabajo_id)
+    en_curso = TrabajoAnalisis.objects.filter(pk=trabajo_id, estado='en_curso')
+    try:
+        resultado = TAREAS[trabajo.tipo](**trabajo.parametros)
+    except Exception as error:
+        logger.exception('Error ejecutando el trabajo %s (%s)', trabajo_id, trabajo.tipo)
+        en_curso.update(estado='error', error=str(error) or repr(error), terminado=timezone.now())
+        return None
+    if not en_curso.update(estado='completado', resultado=resultado, terminado=timezone.now()):
+        return None
+    if trabajo.tipo in AL_COMPLETAR:
+        AL_COMPLETAR[trabajo.tipo](resultado, **trabajo.parametros)
+    return resultado
+
+
+# Envoltura de ejecutar_trabajo para los hilos del pool: cierra la conexión a la base de datos del hilo.
+def ejecutar_trabajo_en_hilo(trabajo_id):
+    try:
+        ejecutar_trabajo(trabajo_id)
+    finally:
+        connections.close_all()
+
+
+# Cancela un trabajo pendiente o en curso. Devuelve False si ya había terminado.
+def cancelar_trabajo(trabajo_id):
+    return bool(TrabajoAnalisis.objects.filter(pk=trabajo_id, estado__in=ESTADOS_TRABAJO_ACTIVOS).update(
+        estado='cancelado', terminado=timezone.now()
+    ))
+
+
+# Elimina los trabajos terminados hace más de `dias` días (por defecto TRABAJOS_RETENCION_DIAS) y da por abandonados
+# los activos vencidos. Devuelve la cantidad de trabajos eliminados.
+def limpiar_trabajos(dias=None):
+    dias = dias if dias is not None else getattr(settings, 'TRABAJOS_RETENCION_DIAS', 7)
+    _abandonar_vencidos()
+    limite = timezone.now() - timedelta(days=dias)
+    eliminados, _ = TrabajoAnalisis.objects.exclude(estado__in=ESTADOS_TRABAJO_ACTIVOS).filter(
+        creado__lt=limite
+    ).delete()
+    return eliminados
+
+
+# Estado de un trabajo en JSON para las vistas que lo consultan periódicamente.
+def estado_trabajo(trabajo):
+    datos = {
+        'id': trabajo.pk,
+        'tipo': trabajo.tipo,
+        'estado': trabajo.estado,
+        'creado': trabajo.creado,
+        'iniciado': trabajo.iniciado,
+        'terminado': trabajo.terminado,
+    }
+    if trabajo.estado == 'completado':
+        datos['resultado'] = trabajo.resultado
+    elif trabajo.estado == 'error':
+        datos['error'] = trabajo.error
+    return datos
@@ -25,15 +25,33 @@ from .views import (
     editar_nutriente_de_alimento,
     eliminar_nutriente_de_alimento,
     vista_analisis,
+    estado_trabajo_analisis,
+    cancelar_trabajo_analisis,
+    metricas,
     reporte_excesos,
-    AlimentoViewSet
+    exportar_historial,
+    exportar_historial_todos,
+    exportar_excesos,
+    api_analisis_nutricional,
+    api_ingestas,
+    api_plan_comidas,
+    api_tendencias,
+    AlimentoViewSet,
+    PlantillaComidaViewSet,
+    RegistroComidaView
 )
 
 router = DefaultRouter()
 router.register(r'alimentos', AlimentoViewSet)
+router.register(r'plantillas', PlantillaComidaViewSet, basename='plantilla')
 
 urlpatterns = [
     path('', Logueo.as_view(), name='login'),
+    path('api/registros/comida/', RegistroComidaView.as_view(), name='registrar_comida'),
+    path('api/analisis/nutricional/', api_analisis_nutricional, name='api_analisis_nutricional'),
+    path('api/ingestas/', api_ingestas, name='api_ingestas'),
+    path('api/plan-comidas/', api_plan_comidas, name='api_plan_comidas'),
+    path('api/tendencias/', api_tendencias, name='api_tendencias'),
     path('api/', include(router.urls)),
     path('registro/', PaginaRegistro.as_view(), name='registro'),
     path('logout/', LogoutView.as_view(next_page='login'), name='logout'),
@@ -43,12 +61,18 @@ urlpatterns = [
     path('perfil_nutricional/', perfil_nutricional, name='perfil_nutricional'),
     path('analisis_nutricional/', analisis_nutricional, name='analisis_nutricional'),
     path('reporte_excesos/', reporte_excesos, name='reporte_excesos'),
+    path('exportar/historial/', exportar_historial, name='exportar_historial'),
+    path('super/exportar/historial/', exportar_historial_todos, name='exportar_historial_todos'),
+    path('super/exportar/excesos/', exportar_excesos, name='exportar_excesos'),
     path('listar_alimentos/', listar_alimentos, name='listar_alimentos'),
     path('editar_alimento/<int:alimento_id>/', editar_alimento, name='editar_alimento'),
     path('eliminar_alimento/<int:alimento_id>/', eliminar_alimento, name='eliminar_alimento'),
     path('sugerencias_alimentos/', sugerencias_alimentos, name='sugerencias_alimentos'),
     path('listar-usuarios-inactivos/', listar_usuarios_inactivos, name='lista_usuarios_inactivos'),
     path('analisis-consumo/', vista_analisis, name='analisis-consumo'),
+    path('super/trabajos/<int:trabajo_id>/', estado_trabajo_analisis, name='estado_trabajo_analisis'),
+    path('super/trabajos/<int:trabajo_id>/cancelar/', cancelar_trabajo_analisis, name='cancelar_trabajo_analisis'),
+    path('super/metricas/', metricas, name='metricas'),
     path('super/listar_todos_alimentos/', listar_todos_alimentos, name='listar_todos_alimentos'),
     path('super/agregar_nutriente_a_alimento/<int:alimento_id>/', agregar_nutriente_a_alimento,
          name='agregar_nutriente_a_alimento'),
@@ -61,9 +85,11 @@ urlpatterns = [
 
     path('super/eliminar_nutriente_de_alimento/<int:alimento_id>/<int:relacion_id>/',
          eliminar_nutriente_de_alimento, name='eliminar_nutriente_de_alimento')
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+]
 
+# static() sólo agrega rutas con DEBUG; fuera de DEBUG los estáticos los sirve EstaticosMiddleware
 if settings.DEBUG:
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 
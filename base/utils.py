@@ -24,6 +24,11 @@ NECESIDADES_MICRONUTRIENTES_ESPECIFICOS = {
 }
 
 
+# Versión de las fórmulas de calcular_bmr/calcular_necesidades_nutricionales. Al cambiarlas hay que incrementarla
+# y ejecutar `manage.py recalcular_objetivos` para actualizar los objetivos guardados en PerfilNutricional.
+VERSION_FORMULA = 1
+
+
 def calcular_bmr(perfil):
     peso = float(perfil.peso)  # Convertimos a float
     altura = float(perfil.altura) * 100  # Convertimos la altura a cm
@@ -69,8 +74,23 @@ def calcular_necesidades_nutricionales(perfil):
         'grasas': round(grasas, 2)
     }
 
+# Objetivos diarios de un perfil con los nombres de los campos en que se guardan en PerfilNutricional.
+def calcular_objetivos(perfil):
+    necesidades = calcular_necesidades_nutricionales(perfil)
+    return {
+        'bmr': calcular_bmr(perfil),
+        'calorias_objetivo': necesidades['calorias'],
+        'proteinas_objetivo': necesidades['proteinas'],
+        'carbohidratos_objetivo': necesidades['carbohidratos'],
+        'grasas_objetivo': necesidades['grasas'],
+        'version_formula': VERSION_FORMULA,
+    }
+
 # Proporciona un análisis detallado de la ingesta nutricional de un usuario basado en sus registros diarios y sus necesidades nutricionales predefinidas.
 def analizar_ingesta_nutricional(registros, necesidades):
+    # Importación local: el catálogo usa NECESIDADES_MICRONUTRIENTES_ESPECIFICOS de este módulo
+    from base.catalogo_nutrientes import catalogo_nutrientes
+
     total_calorias = 0.0
     total_proteinas = 0.0
     total_carbohidratos = 0.0
@@ -79,16 +99,30 @@ def analizar_ingesta_nutricional(registros, necesidades):
     micronutrientes_ingestidos = {}
 
     for registro in registros:
-        total_calorias += float(registro.alimento.calorias)
-        total_proteinas += float(registro.alimento.proteinas)
-        total_carbohidratos += float(registro.alimento.carbohidratos)
-        total_grasas += float(registro.alimento.grasas)
+        total_calorias += float(registro.alimento.calorias) * float(registro.cantidad)
+        total_proteinas += float(registro.alimento.proteinas) * float(registro.cantidad)
+        total_carbohidratos += float(registro.alimento.carbohidratos) * float(registro.cantidad)
+        total_grasas += float(registro.alimento.grasas) * float(registro.cantidad)
 
+        # Por nutriente_id: el nombre sale del catálogo en memoria, sin cargar cada Nutriente
         for alimento_nutriente in registro.alimento.alimentonutriente_set.all():
-            nutriente_nombre = alimento_nutriente.nutriente.nombre
+            nutriente_id = alimento_nutriente.nutriente_id
             cantidad_nutriente = float(alimento_nutriente.cantidad) * float(registro.cantidad)
-            micronutrientes_ingestidos[nutriente_nombre] = micronutrientes_ingestidos.get(nutriente_nombre, 0) + cantidad_nutriente
+            micronutrientes_ingestidos[nutriente_id] = micronutrientes_ingestidos.get(nutriente_id, 0) + cantidad_nutriente
+
+    return construir_analisis(total_calorias, total_proteinas, total_carbohidratos, total_grasas,
+                              catalogo_nutrientes.por_nombre(micronutrientes_ingestidos), necesidades)
+
+# Igual que analizar_ingesta_nutricional, pero a partir de los totales ya agregados en un IngestaDiaria
+# (o None si el usuario no ha registrado nada en el día).
+def analizar_ingesta_diaria(ingesta, necesidades):
+    if ingesta is None:
+        return construir_analisis(0.0, 0.0, 0.0, 0.0, {}, necesidades)
+    return construir_analisis(float(ingesta.calorias), float(ingesta.proteinas), float(ingesta.carbohidratos),
+                              float(ingesta.grasas), ingesta.micronutrientes, necesidades)
 
+# Compara los totales consumidos con las necesidades del usuario y arma el diccionario de análisis con las recomendaciones.
+def construir_analisis(total_calorias, total_proteinas, total_carbohidratos, total_grasas, micronutrientes_ingestidos, necesidades):
     # Calcular deficiencias o excesos
     calorias_deficit = necesidades['calorias'] - total_calorias
     proteinas_deficit = (necesidades['proteinas'] - total_proteinas) * 4
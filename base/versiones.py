@@ -0,0 +1,68 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from base.models import VersionDatos
+
+# Contadores de versión guardados en la base (VersionDatos), compartidos por todos los workers. Los resultados
+# derivados de los datos de un usuario (o de todo el catálogo de nutrientes) se cachean con la versión actual en la
+# clave: al cambiar los datos se incrementa la versión y las entradas anteriores dejan de usarse, sin tener que
+# buscarlas ni borrarlas, aunque cada worker tenga su propia caché. Junto a cada contador se guarda la hora del
+# último cambio, para Last-Modified (ver condicional_por_version en decoradores.py).
+
+
+def ambito_usuario(usuario_id):
+    return f'usuario:{usuario_id}'
+
+
+AMBITO_CATALOGO = 'catalogo'
+# Alimentos de todos los usuarios (listados generales y la API para el superusuario)
+AMBITO_ALIMENTOS = 'alimentos'
+
+# Versión y hora de un ámbito que todavía no cambió (sin fila en VersionDatos). No la época Unix: condition() toma
+# una marca de tiempo 0 como si no hubiera Last-Modified.
+SIN_CAMBIOS = (0, datetime(2000, 1, 1, tzinfo=dt_timezone.utc))
+
+
+# Versiones de los ámbitos indicados (en el mismo orden) y hora del cambio más reciente entre ellos, con una sola
+# consulta.
+def estado(*ambitos):
+    filas = {
+        ambito: (version, modificado)
+        for ambito, version, modificado in VersionDatos.objects.filter(ambito__in=ambitos).values_list(
+            'ambito', 'version', 'modificado'
+        )
+    }
+    actuales = [filas.get(ambito, SIN_CAMBIOS) for ambito in ambitos]
+    return [version for version, _ in actuales], max(modificado for _, modificado in actuales)
+
+
+def versiones(*ambitos):
+    return estado(*ambitos)[0]
+
+
+def ultima_modificacion(*ambitos):
+    return estado(*ambitos)[1]
+
+
+# Incrementa las versiones con un UPDATE atómico (version = version + 1), así dos workers que cambian datos a la vez
+# no pierden ningún incremento. Los ámbitos sin fila se crean (ignorando los que otro proceso crea al mismo tiempo) y
+# se vuelve a incrementar: un ámbito que ya existía puede avanzar dos versiones, lo que sólo importa es que cambie.
+def incrementar_versiones(*ambitos):
+    ambitos = set(ambitos)
+    ahora = timezone.now()
+    pendientes = VersionDatos.objects.filter(ambito__in=ambitos)
+    if pendientes.update(version=F('version') + 1, modificado=ahora) < len(ambitos):
+        VersionDatos.objects.bulk_create(
+            [VersionDatos(ambito=ambito, version=0, modificado=ahora) for ambito in ambitos], ignore_conflicts=True
+        )
+        pendientes.update(version=F('version') + 1, modificado=ahora)
+
+
+# Incrementa las versiones al confirmarse la transacción en curso: un cálculo que lea los datos anteriores queda
+# guardado con la versión anterior. Las señales lo usan para cada cambio; quien escriba sin señales (bulk_create,
+# update) debe llamarlo explícitamente.
+def incrementar_al_confirmar(*ambitos):
+    transaction.on_commit(lambda: incrementar_versiones(*ambitos))
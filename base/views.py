@@ -1,3 +1,6 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
 from django.views.generic.edit import FormView
 from django.contrib.auth.forms import UserCreationForm
@@ -8,27 +11,159 @@ from django.contrib.auth.models import User
 from django.urls import reverse_lazy
 
 from .alimento_repository import AlimentoRepository
-from .models import Alimento, PerfilNutricional, RegistroDiario, Nutriente, AlimentoNutriente
+from .models import Alimento, PerfilNutricional, RegistroDiario, Nutriente, AlimentoNutriente, IngestaDiaria, PlantillaComida, TrabajoAnalisis
 from django.contrib.auth.decorators import login_required
-from .utils import calcular_necesidades_nutricionales, analizar_ingesta_nutricional, calcular_bmr, ha_cumplido_limites, esta_por_sobrepasar_limites
+from .utils import analizar_ingesta_diaria, ha_cumplido_limites, esta_por_sobrepasar_limites
 from .forms import PerfilNutricionalForm, AlimentoForm, RegistroDiarioForm, NutrienteForm, AlimentoNutrienteForm
 from django.db.models import Count
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from django.contrib import messages
-from django.db.models import F, Sum, DecimalField
-from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
-from .serializers import AlimentoSerializer
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_POST
+from django.utils.decorators import method_decorator
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .serializers import AlimentoSerializer, campos_solicitados, IngestaDiariaSerializer, RegistroComidaSerializer, PlantillaComidaSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from .alimento_service import AlimentoService
-
+from .analisis_service import AnalisisConsumoService, analisis_consumo, evaluar_grupos
+from .registro_service import registrar_comida
+from .metricas import registro as registro_metricas
+from .decoradores import (api_login_requerido_async, condicional_por_version, login_requerido_async,
+                          superusuario_requerido_async)
+from .busqueda_service import autocompletar_alimentos, filtrar_alimentos, LIMITE_AUTOCOMPLETAR
+from .recomendacion_service import recomendar_alimentos
+from .plan_service import ALIMENTOS_POR_PLAN, MAXIMO_ALIMENTOS_POR_PLAN, plan_de_comidas
+from .trabajos_service import cancelar_trabajo, encolar_trabajo, estado_trabajo
+from .reportes_service import consultar_excesos, pagina_excesos
+from .tendencias_service import AGRUPACIONES, MAXIMO_PUNTOS, PUNTOS_POR_DEFECTO, tendencias
+from .exportacion_service import (COLUMNAS_EXCESOS, COLUMNAS_HISTORIAL, FORMATOS, filas_excesos, filas_historial,
+                                  respuesta_exportacion)
+from .versiones import AMBITO_ALIMENTOS, AMBITO_CATALOGO, ambito_usuario
+
+# Días devueltos como máximo por api_ingestas
+INGESTAS_POR_CONSULTA = 366
+# Días que abarca api_tendencias si no se indica ?desde=
+DIAS_TENDENCIAS_POR_DEFECTO = 30
+
+
+# Ámbitos de versión (base/versiones.py) de las vistas con condicional_por_version
+def _ambitos_todos_alimentos(request, *args, **kwargs):
+    return [AMBITO_ALIMENTOS, AMBITO_CATALOGO]
+
+
+def _ambitos_usuario(request, *args, **kwargs):
+    return [ambito_usuario(request.user.pk), AMBITO_CATALOGO]
+
+
+def _ambitos_api_alimentos(request, *args, **kwargs):
+    if request.user.is_superuser:
+        return _ambitos_todos_alimentos(request)
+    return _ambitos_usuario(request)
+
+
+# Evalúa un queryset desde una vista async (incluye sus prefetch_related)
+async def _alista(queryset):
+    return [objeto async for objeto in queryset]
+
+# Paginación por cursor (keyset) sobre el id: cada página es un WHERE id < cursor ... LIMIT, sin OFFSET ni COUNT(*),
+# así que el costo no crece con el tamaño del catálogo.
+class AlimentoPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+# Filtro ?search= de la API de alimentos sobre el índice de texto completo (ver busqueda_service).
+class BusquedaAlimentoFilter(filters.BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        return filtrar_alimentos(queryset, request.query_params.get('search', ''))
+
+# API de alimentos. Cada usuario ve sólo sus alimentos (el superusuario ve todos). Los nutrientes, con su cantidad y
+# unidad, se cargan con un único prefetch por página, que se omite si ?fields= no los incluye. El listado y el
+# detalle responden 304 si los alimentos no cambiaron desde el ETag que envía el cliente.
 class AlimentoViewSet(viewsets.ModelViewSet):
     queryset = Alimento.objects.all()
     serializer_class = AlimentoSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    permission_classes = [IsAuthenticated]
+    pagination_class = AlimentoPagination
+    filter_backends = [DjangoFilterBackend, BusquedaAlimentoFilter]
     filterset_fields = ['nombre', 'calorias', 'proteinas', 'carbohidratos', 'grasas']
-    search_fields = ['nombre']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(usuario=self.request.user)
+        campos = campos_solicitados(self.request)
+        if campos is None or 'nutrientes' in campos:
+            queryset = queryset.prefetch_related(
+                Prefetch('alimentonutriente_set', queryset=AlimentoNutriente.objects.select_related('nutriente'))
+            )
+        return queryset
+
+    @method_decorator(condicional_por_version(_ambitos_api_alimentos))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(condicional_por_version(_ambitos_api_alimentos))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(usuario=self.request.user)
+
+    # Autocompletado ordenado por relevancia: /api/alimentos/autocompletar/?q=plat&limite=10
+    @action(detail=False)
+    def autocompletar(self, request):
+        try:
+            limite = int(request.query_params.get('limite', LIMITE_AUTOCOMPLETAR))
+        except ValueError:
+            limite = LIMITE_AUTOCOMPLETAR
+        usuario = None if request.user.is_superuser else request.user
+        alimentos = autocompletar_alimentos(request.query_params.get('q', ''), usuario, limite)
+        return Response([{'id': alimento.id, 'nombre': alimento.nombre} for alimento in alimentos])
+
+# Registra una comida completa (lista de alimentos y cantidades) en una sola petición. Valida que todos los alimentos
+# pertenezcan al usuario con una sola consulta, los inserta con un único bulk_create dentro de una transacción
+# y devuelve los totales actualizados del día.
+class RegistroComidaView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = RegistroComidaSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        items = [(item['alimento'], item['cantidad']) for item in serializer.validated_data['items']]
+        ingesta = registrar_comida(request.user, items)
+        return Response({
+            'registrados': len(items),
+            'totales': IngestaDiariaSerializer(ingesta).data,
+        }, status=status.HTTP_201_CREATED)
+
+# CRUD de las plantillas de comida del usuario. La acción registrar aplica la plantilla al registro diario de hoy.
+class PlantillaComidaViewSet(viewsets.ModelViewSet):
+    serializer_class = PlantillaComidaSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return PlantillaComida.objects.filter(usuario=self.request.user).prefetch_related('items')
+
+    @action(detail=True, methods=['post'])
+    def registrar(self, request, pk=None):
+        plantilla = self.get_object()
+        items = [(item.alimento_id, item.cantidad) for item in plantilla.items.all()]
+        ingesta = registrar_comida(request.user, items)
+        return Response({
+            'registrados': len(items),
+            'totales': IngestaDiariaSerializer(ingesta).data,
+        }, status=status.HTTP_201_CREATED)
 
 # Lista los usuarios que no tienen registros asociados (identificados como 'usuarios_sin_registros').
 # Si se envía un POST con el propósito de eliminar un usuario, se presenta primero una página de confirmación y, si se confirma, se elimina el usuario.
@@ -161,101 +296,30 @@ def eliminar_nutriente_de_alimento(request, alimento_id, relacion_id):
 
     return render(request, 'base/eliminar_nutriente_de_alimento.html', {'alimento': alimento, 'relacion': relacion})
 
-# Analiza el consumo nutricional de todos los perfiles, agrupándolos en menores de 30 años y mayores o iguales a 30 años.
-# Para cada grupo, calcula la suma total de calorías, proteínas, carbohidratos, grasas y nutrientes consumidos
-# y luego calcula el promedio por usuario en cada grupo.
-def analisis_consumo(fecha_inicio=None, fecha_fin=None):
-    # Convertir fechas de string a objetos datetime si son proporcionadas
-    fecha_inicio = datetime.strptime(fecha_inicio, "%Y-%m-%d") if fecha_inicio else None
-    fecha_fin = datetime.strptime(fecha_fin, "%Y-%m-%d") if fecha_fin else None
-
-    perfiles = PerfilNutricional.objects.all()
-    resultados = {
-        'menores_30': {'calorias': 0, 'proteinas': 0, 'carbohidratos': 0, 'grasas': 0, 'nutrientes': {}},
-        'mayores_30': {'calorias': 0, 'proteinas': 0, 'carbohidratos': 0, 'grasas': 0, 'nutrientes': {}}
-    }
-
-    for perfil in perfiles:
-        grupo = 'menores_30' if perfil.edad < 30 else 'mayores_30'
-        # Filtrar los registros por usuario y fechas si se proporcionan
-        registros = RegistroDiario.objects.filter(usuario=perfil.usuario)
-        if fecha_inicio:
-            registros = registros.filter(fecha__gte=fecha_inicio)
-        if fecha_fin:
-            registros = registros.filter(fecha__lte=fecha_fin)
-
-        for registro in registros:
-            alimento = registro.alimento
-            resultados[grupo]['calorias'] += float(alimento.calorias) * float(registro.cantidad)
-            resultados[grupo]['proteinas'] += float(alimento.proteinas) * float(registro.cantidad)
-            resultados[grupo]['carbohidratos'] += float(alimento.carbohidratos) * float(registro.cantidad)
-            resultados[grupo]['grasas'] += float(alimento.grasas) * float(registro.cantidad)
-
-            nutrientes = AlimentoNutriente.objects.filter(alimento=alimento)
-            for nutriente in nutrientes:
-                if nutriente.nutriente.nombre not in resultados[grupo]['nutrientes']:
-                    resultados[grupo]['nutrientes'][nutriente.nutriente.nombre] = 0
-                resultados[grupo]['nutrientes'][nutriente.nutriente.nombre] += float(nutriente.cantidad) * float(registro.cantidad)
-
-    # Calcular promedios
-    for grupo in resultados:
-        total_usuarios = PerfilNutricional.objects.filter(edad__lt=30).count() if grupo == 'menores_30' else PerfilNutricional.objects.filter(edad__gte=30).count()
-        if total_usuarios > 0:
-            for key in ['calorias', 'proteinas', 'carbohidratos', 'grasas']:
-                resultados[grupo][key] /= total_usuarios
-            for nutriente in resultados[grupo]['nutrientes']:
-                resultados[grupo]['nutrientes'][nutriente] /= total_usuarios
-
-    return resultados
-
-# Evalúa cuál grupo tiene un mayor riesgo basado en su consumo nutricional. Utiliza los resultados del análisis de consumo
-# para comparar el consumo calórico y de macronutrientes entre los dos grupos, así como la diversidad de nutrientes consumidos.
-# Proporciona como resultado un grupo con mayor riesgo y las razones de esta evaluación.
-def evaluar_grupos(resultados):
-    evaluacion = {
-        'grupo_mas_riesgo': '',
-        'razones': []
-    }
-
-    # Comparar consumo calórico
-    if resultados['menores_30']['calorias'] > resultados['mayores_30']['calorias']:
-        evaluacion['grupo_mas_riesgo'] = 'El grupo de menores de 30'
-        evaluacion['razones'].append('mayor consumo calórico')
-    else:
-        evaluacion['grupo_mas_riesgo'] = 'El grupo de mayores de 30'
-        evaluacion['razones'].append('mayor consumo calórico')
-
-    # Comparar macronutrientes
-    for nutriente in ['proteinas', 'carbohidratos', 'grasas']:
-        if resultados['menores_30'][nutriente] > resultados['mayores_30'][nutriente]:
-            evaluacion['razones'].append(f'mayor consumo de {nutriente} en menores de 30')
-        else:
-            evaluacion['razones'].append(f'mayor consumo de {nutriente} en mayores de 30')
-
-    # Comparar diversidad de nutrientes
-    nutrientes_menores_30 = set(resultados['menores_30']['nutrientes'].keys())
-    nutrientes_mayores_30 = set(resultados['mayores_30']['nutrientes'].keys())
-    if len(nutrientes_menores_30) < len(nutrientes_mayores_30):
-        evaluacion['razones'].append('menor diversidad de nutrientes en menores de 30.')
-    elif len(nutrientes_menores_30) > len(nutrientes_mayores_30):
-        evaluacion['razones'].append('menor diversidad de nutrientes en mayores de 30.')
-
-    return evaluacion
-
-# Ejecutar análisis y evaluación
-resultados_analisis = analisis_consumo()
-evaluacion_final = evaluar_grupos(resultados_analisis)
-
-# Realiza un análisis de consumo utilizando la función analisis_consumo, evalúa los grupos con evaluar_grupos,
-# y prepara los datos para ser visualizados en gráficos. Finalmente, envía esos datos a un template HTML
-# para su visualización. Es una vista de alto nivel que integra la lógica de análisis con la presentación de datos.
-@login_required
-@user_passes_test(lambda u: u.is_superuser)
-def vista_analisis(request):
-    fecha_inicio = request.GET.get('fecha_inicio') # o como se envíe el parámetro
-    fecha_fin = request.GET.get('fecha_fin') # o como se envíe el parámetro
-    resultados_analisis = analisis_consumo(fecha_inicio, fecha_fin)
-    evaluacion_final = evaluar_grupos(resultados_analisis)
+# Obtiene el análisis de consumo y la evaluación de grupos de la caché de AnalisisConsumoService, y prepara los datos
+# para ser visualizados en gráficos. Si aún no están calculados, encola el cálculo como trabajo en segundo plano
+# (compartido por pedidos idénticos) y responde enseguida con una página que consulta su estado hasta que termina.
+@superusuario_requerido_async
+async def vista_analisis(request):
+    fecha_inicio = request.GET.get('fecha_inicio') or None
+    fecha_fin = request.GET.get('fecha_fin') or None
+    # parse_date devuelve None si el formato no es AAAA-MM-DD y lanza ValueError si la fecha no existe (2024-02-30)
+    try:
+        fechas_validas = all(parse_date(fecha) for fecha in (fecha_inicio, fecha_fin) if fecha)
+    except ValueError:
+        fechas_validas = False
+    if not fechas_validas:
+        return HttpResponseBadRequest('Fechas no válidas')
+
+    en_cache = await AnalisisConsumoService().aen_cache(fecha_inicio, fecha_fin)
+    if en_cache is None:
+        trabajo = await sync_to_async(encolar_trabajo)(
+            'analisis_consumo', {'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}, request.user
+        )
+        if trabajo.estado != 'completado':
+            return render(request, 'analisis-consumo.html', {'trabajo': trabajo})
+        en_cache = trabajo.resultado['resultados'], trabajo.resultado['evaluacion']
+    resultados_analisis, evaluacion_final = en_cache
 
     # Preparar datos para gráficos
     datos_graficos = {
@@ -282,6 +346,31 @@ def vista_analisis(request):
 
     return render(request, 'analisis-consumo.html', context)
 
+# Estado (y resultado, si terminó) de un trabajo en segundo plano, en JSON. La página de análisis lo consulta
+# periódicamente mientras el trabajo está pendiente.
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def estado_trabajo_analisis(request, trabajo_id):
+    trabajo = get_object_or_404(TrabajoAnalisis, pk=trabajo_id)
+    return JsonResponse(estado_trabajo(trabajo))
+
+
+# Histogramas de latencia, SQL y plantillas por vista de este proceso, en el formato de texto de Prometheus.
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def metricas(request):
+    return HttpResponse(registro_metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+@require_POST
+def cancelar_trabajo_analisis(request, trabajo_id):
+    trabajo = get_object_or_404(TrabajoAnalisis, pk=trabajo_id)
+    cancelar_trabajo(trabajo.pk)
+    trabajo.refresh_from_db()
+    return JsonResponse(estado_trabajo(trabajo))
+
 # Personaliza la vista de login de Django definiendo un template específico, manejo de campos y redirección
 # tras un login exitoso. redirect_authenticated_user asegura que usuarios ya autenticados sean
 # redirigidos a una página principal.
@@ -341,7 +430,9 @@ def agregar_alimento(request):
 # Recupera y muestra todos los alimentos asociados con el usuario actual. Filtra los alimentos en la base de datos
 # para mostrar solo aquellos que pertenecen al usuario que ha iniciado sesión.
 # USO DE PATRON DE DISEÑO SERVICE
+# Si los alimentos no cambiaron desde la última visita responde 304 sin consultarlos ni renderizar.
 @login_required
+@condicional_por_version(_ambitos_todos_alimentos)
 def listar_alimentos(request):
     service = AlimentoService()
     alimentos = service.listar_todos_alimentos()
@@ -371,61 +462,103 @@ def eliminar_alimento(request, alimento_id):
         return redirect('listar_alimentos')
     return render(request, 'base/eliminar_alimento.html', {'alimento': alimento})
 
-# Permite al usuario registrar su ingesta diaria de alimentos. Al recibir un POST, valida y guarda los datos del formulario.
-# Antes de guardar, verifica que el alimento a registrar no haga que el usuario sobrepase sus límites nutricionales diarios.
-# Si el usuario ya ha cumplido o está por sobrepasar sus límites, muestra una advertencia o una felicitación, respectivamente.
+# Permite al usuario registrar su ingesta diaria de alimentos. Al recibir un POST, valida y guarda los datos del formulario
+# y redirige al análisis nutricional. Para registrar varios alimentos a la vez está RegistroComidaView.
 @login_required
 def registro_diario(request):
     if request.method == "POST":
         form = RegistroDiarioForm(request.POST, user=request.user)
         form.instance.usuario = request.user
         if form.is_valid():
-            registros = RegistroDiario.objects.filter(usuario=request.user, fecha=date.today())
-            perfil = get_object_or_404(PerfilNutricional, usuario=request.user)
-            necesidades = calcular_necesidades_nutricionales(perfil)
-            analisis = analizar_ingesta_nutricional(registros, necesidades)
-
-            alimento_obj = get_object_or_404(Alimento, id=form.cleaned_data['alimento'].id)
-            alimento_info = {
-                'calorias': alimento_obj.calorias,
-                'proteinas': alimento_obj.proteinas,
-                'carbohidratos': alimento_obj.carbohidratos,
-                'grasas': alimento_obj.grasas,
-                'cantidad': form.cleaned_data.get('cantidad', 1)
-            }
-
-            # Removed or modified code to ignore excess warning and fulfillment message.
-            registro = form.save(commit=False)
-            registro.exceso = False # Assuming all entries are not excessive by default.
-
-            registro.save()
-
-            # Removed the success message for fulfilling dietary limits.
-
+            # El análisis del día se consulta en analisis_nutricional; aquí sólo se guarda el registro.
+            form.save()
             return redirect('analisis_nutricional')
     else:
         form = RegistroDiarioForm(user=request.user)
     return render(request, 'base/registro_diario.html', {'form': form})
 
 
+# Reporte de excesos paginado por keyset. Filtros opcionales: ?desde= y ?hasta= (AAAA-MM-DD), ?usuario=<nombre de
+# usuario>; ?despues= es el cursor de la página anterior (ver reportes_service.pagina_excesos).
 @login_required
 def reporte_excesos(request):
-    # Get the total calorie intake for each user for each day
-    total_calorias = RegistroDiario.objects.values('fecha', 'usuario__username').annotate(
-        total_calorias=Sum(F('alimento__calorias') * F('cantidad'), output_field=DecimalField())
-    ).order_by('usuario', 'fecha')
+    try:
+        desde = parse_date(request.GET.get('desde', ''))
+        hasta = parse_date(request.GET.get('hasta', ''))
+        despues = request.GET.get('despues')
+        if despues:
+            usuario_id, fecha = despues.split(':')
+            despues = (int(usuario_id), date.fromisoformat(fecha))
+    except ValueError:
+        return HttpResponseBadRequest('Filtros del reporte no válidos')
+
+    nombre_usuario = request.GET.get('usuario', '').strip()
+    usuario = User.objects.filter(username=nombre_usuario).first() if nombre_usuario else None
+    if nombre_usuario and usuario is None:
+        excesos, siguiente = [], None
+    else:
+        excesos, siguiente = pagina_excesos(consultar_excesos(desde, hasta, usuario), despues or None)
+
+    filtros = request.GET.copy()
+    filtros.pop('despues', None)
+    if siguiente:
+        filtros['despues'] = siguiente
+    return render(request, 'base/reporte_excesos.html', {
+        'registros_excesos': excesos,
+        'filtros': {'desde': desde, 'hasta': hasta, 'usuario': nombre_usuario},
+        'siguiente': filtros.urlencode() if siguiente else None,
+    })
 
-    # You might need to get each user's calorie limit from PerfilNutricional or use a static value
-    # For simplicity, let's assume a static limit of 2000 calories here
-    CALORIE_LIMIT = 2000
 
-    # Filter out the days where the user exceeded the calorie limit
-    excesos = [registro for registro in total_calorias if registro['total_calorias'] > CALORIE_LIMIT]
+# Lee ?formato=csv|ndjson y el rango ?desde=&hasta= (AAAA-MM-DD) de una exportación. Devuelve None si algún
+# parámetro no es válido.
+def _parametros_exportacion(request):
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS:
+        return None
+    try:
+        desde = parse_date(request.GET.get('desde', ''))
+        hasta = parse_date(request.GET.get('hasta', ''))
+    except ValueError:
+        return None
+    return formato, desde, hasta
 
-    return render(request, 'base/reporte_excesos.html', {'registros_excesos': excesos})
 
+# Descarga el historial de registros del usuario como CSV o NDJSON. La respuesta se genera a medida que se envía,
+# así que sirve igual para unos pocos días que para años de historial.
+@login_required
+def exportar_historial(request):
+    parametros = _parametros_exportacion(request)
+    if parametros is None:
+        return HttpResponseBadRequest('Parámetros de exportación no válidos')
+    formato, desde, hasta = parametros
+    filas = filas_historial(request.user, desde, hasta)
+    return respuesta_exportacion(filas, COLUMNAS_HISTORIAL, formato, 'historial')
 
 
+# Igual que exportar_historial pero con los registros de todos los usuarios (o de ?usuario=<id>).
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def exportar_historial_todos(request):
+    parametros = _parametros_exportacion(request)
+    usuario_id = request.GET.get('usuario')
+    if parametros is None or (usuario_id and not usuario_id.isdigit()):
+        return HttpResponseBadRequest('Parámetros de exportación no válidos')
+    formato, desde, hasta = parametros
+    usuario = get_object_or_404(User, pk=usuario_id) if usuario_id else None
+    filas = filas_historial(usuario, desde, hasta)
+    return respuesta_exportacion(filas, COLUMNAS_HISTORIAL, formato, 'historial_usuarios')
+
+
+# Descarga el reporte de excesos completo como CSV o NDJSON.
+@login_required
+@user_passes_test(lambda u: u.is_superuser)
+def exportar_excesos(request):
+    parametros = _parametros_exportacion(request)
+    if parametros is None:
+        return HttpResponseBadRequest('Parámetros de exportación no válidos')
+    formato, desde, hasta = parametros
+    return respuesta_exportacion(filas_excesos(consultar_excesos(desde, hasta)), COLUMNAS_EXCESOS, formato, 'excesos')
 
 
 # Permite al usuario crear o editar su perfil nutricional. Utiliza get_or_create para evitar la creación de múltiples perfiles
@@ -445,45 +578,119 @@ def perfil_nutricional(request):
         form = PerfilNutricionalForm(instance=perfil)
     return render(request, 'base/perfil_nutricional.html', {'form': form})
 
-# Realiza y muestra un análisis nutricional del usuario basado en su perfil nutricional y registros diarios.
+# Realiza y muestra un análisis nutricional del usuario basado en su perfil nutricional y los totales del día (IngestaDiaria).
 # Calcula las necesidades nutricionales del usuario y compara su ingesta diaria con estas necesidades.
 # Si el usuario ha cumplido sus límites nutricionales para el día, muestra un mensaje de felicitación.
-@login_required
-def analisis_nutricional(request):
-    perfil = get_object_or_404(PerfilNutricional, usuario=request.user)
-    registros = RegistroDiario.objects.filter(usuario=request.user, fecha=date.today())
-    necesidades = calcular_necesidades_nutricionales(perfil)
-    analisis = analizar_ingesta_nutricional(registros, necesidades)
+# Responde 304 si los datos del usuario no cambiaron en el día desde la última visita.
+@login_requerido_async
+@condicional_por_version(_ambitos_usuario, diario=True)
+async def analisis_nutricional(request):
+    # Perfil y totales del día son independientes: se piden a la vez
+    perfil, ingesta = await asyncio.gather(
+        aget_object_or_404(PerfilNutricional, usuario=request.user),
+        IngestaDiaria.objects.filter(usuario=request.user, fecha=date.today()).afirst(),
+    )
+    necesidades = perfil.necesidades_nutricionales()
+    analisis = analizar_ingesta_diaria(ingesta, necesidades)
 
     if ha_cumplido_limites(analisis, necesidades):
         messages.success(request, '¡Felicidades! Has cumplido con tu dosis diaria.')
 
     return render(request, 'base/analisis_nutricional.html', {'analisis': analisis})
 
-# Proporciona sugerencias nutricionales personalizadas a usuarios autenticados basándose en su perfil e ingesta diaria.
-@login_required
-def sugerencias_alimentos(request):
-    # Obtener el perfil nutricional del usuario
-    perfil = get_object_or_404(PerfilNutricional, usuario=request.user)
-    bmr = calcular_bmr(perfil)
-
-    # Filtrar registros por la fecha de hoy
-    registros = RegistroDiario.objects.filter(usuario=request.user, fecha=date.today())
-    necesidades = calcular_necesidades_nutricionales(perfil)
-    analisis = analizar_ingesta_nutricional(registros, necesidades)
-
-    # Obtener top 5 de alimentos ricos en micronutrientes y macronutrientes
-    sugerencias_macro_micro = Alimento.objects.filter(usuario=request.user).annotate(total_macro=F('proteinas') + F('carbohidratos') + F('grasas') + F('nutrientes')).order_by('-total_macro')[:5]
-
-    Alimento.objects.filter(usuario=request.user)
-
+# Proporciona sugerencias nutricionales personalizadas a usuarios autenticados basándose en su perfil e ingesta diaria:
+# los alimentos del usuario que mejor cubren lo que aún le falta hoy (ver recomendacion_service.recomendar_alimentos).
+@login_requerido_async
+async def sugerencias_alimentos(request):
+    # Perfil y totales del día se piden a la vez
+    perfil, ingesta = await asyncio.gather(
+        aget_object_or_404(PerfilNutricional, usuario=request.user),
+        IngestaDiaria.objects.filter(usuario=request.user, fecha=date.today()).afirst(),
+    )
+    necesidades = perfil.necesidades_nutricionales()
+    analisis = analizar_ingesta_diaria(ingesta, necesidades)
+    sugerencias_macro_micro = await sync_to_async(recomendar_alimentos)(request.user, analisis, necesidades)
 
     return render(request, 'base/sugerencias_alimentos.html', {
-        'bmr': bmr,
+        'bmr': perfil.bmr,
         'analisis': analisis,
         'sugerencias_macro_micro': sugerencias_macro_micro,
     })
 
 
+# Análisis del día del usuario en JSON (misma información que analisis_nutricional).
+@api_login_requerido_async
+async def api_analisis_nutricional(request):
+    perfil, ingesta = await asyncio.gather(
+        PerfilNutricional.objects.filter(usuario=request.user).afirst(),
+        IngestaDiaria.objects.filter(usuario=request.user, fecha=date.today()).afirst(),
+    )
+    if perfil is None:
+        return JsonResponse({'detail': 'El usuario no tiene perfil nutricional.'}, status=404)
+    necesidades = perfil.necesidades_nutricionales()
+    return JsonResponse({
+        'fecha': date.today(),
+        'necesidades': necesidades,
+        'analisis': analizar_ingesta_diaria(ingesta, necesidades),
+    })
 
 
+# Plan de comidas para cubrir lo que le falta hoy al usuario, en JSON (ver plan_service.plan_de_comidas).
+# ?max_alimentos= limita la cantidad de alimentos distintos del plan (hasta MAXIMO_ALIMENTOS_POR_PLAN).
+@api_login_requerido_async
+async def api_plan_comidas(request):
+    max_alimentos = request.GET.get('max_alimentos', str(ALIMENTOS_POR_PLAN))
+    if not max_alimentos.isdigit() or not 1 <= int(max_alimentos) <= MAXIMO_ALIMENTOS_POR_PLAN:
+        return JsonResponse({'detail': f'max_alimentos debe estar entre 1 y {MAXIMO_ALIMENTOS_POR_PLAN}.'}, status=400)
+    perfil, ingesta = await asyncio.gather(
+        PerfilNutricional.objects.filter(usuario=request.user).afirst(),
+        IngestaDiaria.objects.filter(usuario=request.user, fecha=date.today()).afirst(),
+    )
+    if perfil is None:
+        return JsonResponse({'detail': 'El usuario no tiene perfil nutricional.'}, status=404)
+    necesidades = perfil.necesidades_nutricionales()
+    analisis = analizar_ingesta_diaria(ingesta, necesidades)
+    plan = await sync_to_async(plan_de_comidas)(request.user, analisis, necesidades, int(max_alimentos))
+    return JsonResponse(plan)
+
+
+# Totales diarios (IngestaDiaria) del usuario en JSON, del más reciente al más antiguo. Filtros opcionales
+# ?desde= y ?hasta= (AAAA-MM-DD); devuelve como máximo INGESTAS_POR_CONSULTA días.
+@api_login_requerido_async
+async def api_ingestas(request):
+    try:
+        desde = parse_date(request.GET.get('desde', ''))
+        hasta = parse_date(request.GET.get('hasta', ''))
+    except ValueError:
+        return JsonResponse({'detail': 'Fechas no válidas.'}, status=400)
+    ingestas = IngestaDiaria.objects.filter(usuario=request.user)
+    if desde:
+        ingestas = ingestas.filter(fecha__gte=desde)
+    if hasta:
+        ingestas = ingestas.filter(fecha__lte=hasta)
+    ingestas = await _alista(ingestas.order_by('-fecha')[:INGESTAS_POR_CONSULTA])
+    return JsonResponse({'results': IngestaDiariaSerializer(ingestas, many=True).data})
+
+
+# Evolución de calorías, macronutrientes y micronutrientes del usuario en JSON (ver tendencias_service.tendencias).
+# ?agrupacion= dia, semana o mes; ?desde= y ?hasta= (AAAA-MM-DD, por defecto los últimos
+# DIAS_TENDENCIAS_POR_DEFECTO días); ?max_puntos= cantidad máxima de puntos de la serie (hasta MAXIMO_PUNTOS).
+# Responde 304 si el diario del usuario no cambió desde el ETag que envía el cliente.
+@api_login_requerido_async
+@condicional_por_version(_ambitos_usuario, diario=True)
+async def api_tendencias(request):
+    agrupacion = request.GET.get('agrupacion', 'dia')
+    if agrupacion not in AGRUPACIONES:
+        return JsonResponse({'detail': f'agrupacion debe ser una de: {", ".join(AGRUPACIONES)}.'}, status=400)
+    max_puntos = request.GET.get('max_puntos', str(PUNTOS_POR_DEFECTO))
+    if not max_puntos.isdigit() or not 1 <= int(max_puntos) <= MAXIMO_PUNTOS:
+        return JsonResponse({'detail': f'max_puntos debe estar entre 1 y {MAXIMO_PUNTOS}.'}, status=400)
+    try:
+        hasta = parse_date(request.GET.get('hasta', '')) or date.today()
+        desde = parse_date(request.GET.get('desde', '')) or hasta - timedelta(days=DIAS_TENDENCIAS_POR_DEFECTO - 1)
+    except ValueError:
+        return JsonResponse({'detail': 'Fechas no válidas.'}, status=400)
+    if desde > hasta:
+        return JsonResponse({'detail': 'desde no puede ser posterior a hasta.'}, status=400)
+    serie = await sync_to_async(tendencias)(request.user.id, desde, hasta, agrupacion, int(max_puntos))
+    return JsonResponse(serie)
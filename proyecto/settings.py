@@ -44,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.middleware.EstaticosMiddleware',
+    'base.middleware.MetricasMiddleware',
+    'base.middleware.CompresionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,10 +61,15 @@ ROOT_URLCONF = 'proyecto.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'base.metricas.DjangoTemplatesMedidas',
         'DIRS': [BASE_DIR / 'base' / 'templates' / 'base'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'base.plantillas.CargadorArchivosMinificado',
+                    'base.plantillas.CargadorAppsMinificado',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -83,11 +91,46 @@ WSGI_APPLICATION = 'proyecto.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# CONN_MAX_AGE mantiene la conexión abierta entre solicitudes (con una verificación antes de reutilizarla). Bajo
+# ASGI cada solicitud corre en su propio hilo y las conexiones persistentes no se reutilizan: usar
+# DB_CONN_MAX_AGE=0. `timeout` es cuánto espera SQLite a que se libere el bloqueo de escritura antes de fallar con
+# "database is locked".
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': 20},
+    }
+}
+
+# Réplica de lectura para los análisis y reportes de administración (base/basedatos.py): una réplica de
+# PostgreSQL o una copia local del archivo SQLite. Sin DB_ANALITICA_NOMBRE todo se lee de 'default'. En las pruebas
+# es un espejo de 'default'.
+if os.environ.get('DB_ANALITICA_NOMBRE'):
+    DATABASES['analitica'] = {
+        'ENGINE': os.environ.get('DB_ANALITICA_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ['DB_ANALITICA_NOMBRE'],
+        'HOST': os.environ.get('DB_ANALITICA_HOST', ''),
+        'PORT': os.environ.get('DB_ANALITICA_PUERTO', ''),
+        'USER': os.environ.get('DB_ANALITICA_USUARIO', ''),
+        'PASSWORD': os.environ.get('DB_ANALITICA_CLAVE', ''),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['base.basedatos.RouterAnalitica']
+
+# PRAGMAs que se aplican a cada conexión SQLite: WAL para que las lecturas no bloqueen a las escrituras,
+# synchronous=NORMAL (seguro con WAL), 64 MB de caché de páginas por conexión y tablas temporales en memoria.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -138,10 +181,51 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# collectstatic guarda los estáticos con el hash del contenido en el nombre y sus versiones .gz/.br
+# (base/storage.py); fuera de DEBUG los sirve EstaticosMiddleware con caché inmutable. ESTATICOS_MAX_AGE son los
+# segundos de caché de los archivos pedidos por su nombre original.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'base.storage.EstaticosComprimidos'},
+}
+ESTATICOS_MAX_AGE = 60
+
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
-
-
-
+# Segundos que el análisis de consumo por grupos permanece en caché antes de recalcularse.
+# Con varios workers conviene configurar CACHES con un backend compartido para que
+# `manage.py precalentar_analisis` deje el resultado disponible para todos.
+ANALISIS_CONSUMO_CACHE_TIMEOUT = 300
+
+# Cómo se agregan los registros por cohorte en el análisis de consumo: 'sql' (consultas agrupadas) o 'numpy'
+# (cálculo vectorizado en memoria por bloques, más rápido con millones de registros; requiere numpy).
+ANALISIS_CONSUMO_BACKEND = 'sql'
+
+# Hilos del pool que genera en segundo plano las miniaturas WebP/JPEG de las imágenes de alimentos (0: sin pool,
+# se generan al confirmar la transacción en el mismo hilo).
+IMAGENES_HILOS = 2
+
+# Trabajos en segundo plano (base/trabajos_service.py): hilos que los ejecutan, segundos durante los que un resultado
+# terminado se reutiliza para pedidos idénticos, segundos tras los que un trabajo activo se da por abandonado (por
+# ejemplo, si el proceso se reinició) y días que se conservan los trabajos terminados (`manage.py limpiar_trabajos`).
+TRABAJOS_HILOS = 2
+TRABAJOS_VIGENCIA_RESULTADO = ANALISIS_CONSUMO_CACHE_TIMEOUT
+TRABAJOS_TIEMPO_MAXIMO = 1800
+TRABAJOS_RETENCION_DIAS = 7
+
+# Plan de comidas (base/plan_service.py): segundos que puede tardar la búsqueda de cantidades y segundos que se
+# conserva un plan en caché (se descarta antes si cambian el diario, el perfil o los alimentos del usuario).
+PLAN_COMIDAS_TIEMPO_MAXIMO = 0.2
+PLAN_COMIDAS_CACHE_TIMEOUT = 3600
+
+# Métricas por solicitud (base/middleware.py): cabecera Server-Timing e histogramas de latencia por vista en
+# formato Prometheus en /super/metricas/. Cada proceso acumula las suyas desde que arranca.
+METRICAS_ACTIVAS = True
+
+# Compresión de respuestas (base/middleware.py): brotli para los clientes que lo aceptan (requiere instalar brotli)
+# y gzip para el resto. HTML_MINIFICADO quita comentarios, sangría y líneas en blanco de las plantillas al cargarlas
+# (base/plantillas.py); se activa fuera de desarrollo.
+COMPRESION_BROTLI = False
+HTML_MINIFICADO = not DEBUG